@@ -1,45 +1,601 @@
 import json
 import requests
+import asyncio
 import base64
 import concurrent.futures
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+MAX_IMAGES = 5  # One image for each step of a question
+SPECULATION_WORKERS = 1  # Threads MathPixAPI sends answers read ahead of Compare on, apart from the workers above
+TIMEOUT = (3.05, 10)  # Seconds to connect and to wait for MathPix to answer, for each attempt
+RETRIES = 2  # Attempts after the first for connection errors, timeouts and the statuses below
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF = 0.25  # Attempt n waits a random time between 0 and BACKOFF * 2 ** n seconds before it is sent
+HISTORY = 1000  # Requests kept in MathPixAPI.records
+CACHE_SIZE = 256  # Responses OCRCache keeps in memory
+DISK_CACHE_SIZE = 2000  # Responses OCRCache keeps on disk, once given a directory (a few hundred bytes each)
+CONCURRENCY = 64  # Requests AsyncMathPixAPI has in flight at once, which is also how many connections it keeps open
+BACKEND = 'thread'  # The client get_client() makes: 'thread' for MathPixAPI, 'asyncio' for AsyncMathPixAPI
+
+# One image sent to MathPix: its response (None if every attempt failed), the seconds taken over every attempt, the
+# number of attempts made and the HTTP status of the last one (or the name of the exception it raised)
+Request = namedtuple('Request', 'response latency attempts status')
+
+
+def _handwritten(data):
+    """
+    :return: True if data is a handwritten answer, as an image or as strokes, rather than a typed one
+    """
+    if isinstance(data, str):
+        return data.startswith('data:image')
+    return isinstance(data, dict) and 'strokes' in data
+
+
+def _encode(data):
+    """
+    :param data: An image, as a data URI, or strokes (see imaging.strokes_payload)
+    :return: A tuple (endpoint, body): the endpoint to send data to, 'text' or 'strokes', and the JSON body to send
+    """
+    if isinstance(data, str):
+        return 'text', json.dumps({'src': data})
+    return 'strokes', json.dumps(data, separators=(',', ':'))
+
+
+class PostResult(dict):
+    """
+    The result of MathPixAPI.post_data(): the payload, with the response from MathPix in place of each handwritten
+    answer that was read. Answers whose request failed keep their data and are listed in failed.
+    """
+
+    def __init__(self, payload: dict):
+        super().__init__(payload)
+        self.failed = set()
+
+
+class OCRCache:
+    """
+    MathPix's responses, keyed by a hash of the exact request they answer: the endpoint and the body, which holds the
+    PNG or the strokes (already normalised by imaging.strokes_payload). An answer that hasn't changed since it was last
+    read, e.g. when Compare is pressed again or the tutorial is replayed, is never sent twice. Responses are kept in
+    memory and, once use_directory() has been called, in a directory as one JSON file each, both with least recently
+    used eviction. Safe to use from the MathPixAPI worker threads.
+    """
+
+    def __init__(self, size=CACHE_SIZE, disk_size=DISK_CACHE_SIZE):
+        """
+        :param size: How many responses to keep in memory - 0 turns the cache off, unless it is given a directory
+        :param disk_size: How many responses to keep on disk
+        """
+        self.size = size
+        self.disk_size = disk_size
+        self.directory = None
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()  # The key of every file in self.directory, least recently used first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str, body: str):
+        return hashlib.sha256(f'{url}\n{body}'.encode()).hexdigest()
+
+    def use_directory(self, directory: str):
+        """
+        Keeps responses on disk as well as in memory, e.g. under App.user_data_dir so that they outlive the app.
+        Responses already in the directory (from an earlier run) are picked up, oldest first.
+        """
+        os.makedirs(directory, exist_ok=True)
+        files = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                       key=lambda entry: entry.stat().st_mtime)
+        with self._lock:
+            self.directory = directory
+            self._disk = OrderedDict((entry.name[:-len('.json')], None) for entry in files)
+            self._evict_disk()
+
+    def get(self, key: str):
+        """
+        :return: The cached response for key, or None
+        """
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+            elif key in self._disk:
+                response = self._read(key)
+                if response is not None:
+                    self._disk.move_to_end(key)
+                    self._remember(key, response)
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return response
+
+    def put(self, key: str, response: dict):
+        with self._lock:
+            self._remember(key, response)
+            if self.directory is not None:
+                try:
+                    temporary = os.path.join(self.directory, f'{key}.tmp')
+                    with open(temporary, 'w') as cache_file:
+                        json.dump(response, cache_file)
+                    os.replace(temporary, os.path.join(self.directory, f'{key}.json'))
+                except OSError:
+                    return  # The disk store is only ever a bonus
+                self._disk[key] = None
+                self._disk.move_to_end(key)
+                self._evict_disk()
+
+    def _remember(self, key: str, response: dict):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+
+    def _read(self, key: str):
+        path = os.path.join(self.directory, f'{key}.json')
+        try:
+            with open(path) as cache_file:
+                response = json.load(cache_file)
+            os.utime(path)  # So that the order survives a restart
+            return response
+        except (OSError, ValueError):
+            del self._disk[key]
+            return None
+
+    def _evict_disk(self):
+        while len(self._disk) > self.disk_size:
+            key, _ = self._disk.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.directory, f'{key}.json'))
+            except OSError:
+                pass
 
 
 class MathPixAPI:
-    stroke_url = 'https://api.mathpix.com/v3/strokes'
     header = {
         "content-type": "application/json",
         "app_id": "********",
         "app_key": "********"           # Censored -- change as needed
     }
 
+    def __init__(self, base_url='https://api.mathpix.com', workers=MAX_IMAGES, timeout=TIMEOUT, retries=RETRIES,
+                 backoff=BACKOFF, cache=None):
+        """
+        A long lived client: one Session, whose connection pool keeps a connection per worker alive between Compare
+        presses, one pool of worker threads, and SPECULATION_WORKERS more threads for answers read ahead of Compare, so
+        that a read ahead, stale or not, never holds up a submission. Create it once (see get_client() below) and
+        close() it when the app stops.
+        :param base_url: Where the API is - change to point the app at a stub server (see mock_server.py)
+        :param workers: How many images are sent at once, which is also how many connections are kept alive
+        :param timeout: A (connect, read) tuple of seconds, for each attempt
+        :param retries: How many times a request is retried after a transient failure
+        :param backoff: The base of the jittered exponential backoff between attempts, in seconds
+        :param cache: An OCRCache - default is a new in-memory one
+        """
+        self.text_url = f'{base_url}/v3/text'
+        self.stroke_url = f'{base_url}/v3/strokes'
+        self.session = requests.Session()
+        self.session.headers.update(self.header)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers + SPECULATION_WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mathpix')
+        self.speculator = concurrent.futures.ThreadPoolExecutor(max_workers=SPECULATION_WORKERS,
+                                                                thread_name_prefix='mathpix-speculative')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.records = deque(maxlen=HISTORY)  # A Request, without its response, for each image sent
+        self.cache = OCRCache() if cache is None else cache
+        self._closing = threading.Event()  # Set by close(wait=False), to stop retrying
+
+    @staticmethod
+    def format_png(png: bytes):
+        return "data:image/png;base64," + base64.b64encode(png).decode()
+
     @staticmethod
     def format_data(file_name: str):
-        return "data:image/png;base64," + base64.b64encode(open(file_name, "rb").read()).decode()
+        with open(file_name, "rb") as image_file:
+            return MathPixAPI.format_png(image_file.read())
 
-    def _send_request(self, data: str):
-        try:
-            r = requests.post("https://api.mathpix.com/v3/text",
-                              data=json.dumps({'src': data}),
-                              headers=self.header)
-        except:
-            # A connection error has occured
-            return None
+    def _send_request(self, data):
+        """
+        Sends one handwritten answer, unless self.cache already has the response to it. Connection errors, timeouts and
+        overloaded or failing servers are retried with jittered exponential backoff; any other response (including
+        MathPix's own errors about the answer) is returned as is, and cached if the request succeeded.
+        :param data: An image, as a data URI, or strokes (see imaging.strokes_payload)
+        :return: A Request, with no attempts and a status of 'cached' if the response came from the cache
+        """
+        endpoint, body = _encode(data)
+        url = self.text_url if endpoint == 'text' else self.stroke_url
+        start = time.perf_counter()
+        key = self.cache.key(url, body)
+        response = self.cache.get(key)
+        if response is not None:
+            request = Request(response, time.perf_counter() - start, 0, 'cached')
+            self.records.append(request._replace(response=None))
+            return request
+        attempts = 0
+        for attempt in range(self.retries + 1):
+            if attempt and self._closing.wait(random.uniform(0, self.backoff * 2 ** attempt)):
+                break  # The client is closing, and the app shouldn't wait for another attempt
+            attempts += 1
+            try:
+                r = self.session.post(url, data=body, timeout=self.timeout)
+            except requests.RequestException as error:
+                # A connection error has occured
+                status = type(error).__name__
+                continue
+            status = r.status_code
+            if status in RETRY_STATUSES:
+                continue
+            try:
+                response = json.loads(r.text)
+            except ValueError:
+                status = 'invalid JSON'
+            if status == 200 and response is not None:
+                self.cache.put(key, response)
+            break
+        request = Request(response, time.perf_counter() - start, attempts, status)
+        self.records.append(request._replace(response=None))
+        return request
+
+    def submit_data(self, payload: dict, speculative=False):
+        """
+        Sends every handwritten answer in payload to MathPix without waiting for the results.
+        :param payload: A dictionary of answers, where handwritten answers are either images (strings starting with
+                        'data:image') or strokes (dictionaries with a 'strokes' key)
+        :param speculative: True if the answers are being read ahead of Compare, to send them on the threads kept for
+                            that. Cancel their Futures once they are stale: those still queued are never sent
+        :return: A dictionary of Futures, keyed like payload, one for each handwritten answer. Each resolves to a
+                 Request, whose response is None if the answer could not be sent
+        """
+        executor = self.speculator if speculative else self.executor
+        return {location: executor.submit(self._send_request, _data) for location, _data in payload.items()
+                if _handwritten(_data)}
 
-        return json.loads(r.text)
+    @staticmethod
+    def withdraw(future):
+        """
+        Cancels a request made by submit_data(), but only if it hasn't started, so that one already sent is never
+        paid for twice.
+        :return: True if it was withdrawn, False if it has been or is being sent
+        """
+        return future.cancel()
 
     def post_data(self, payload: dict):
-        result = dict(payload)
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            keys = []
-            data = []
-            for location, _data in payload.items():
-                if isinstance(_data, str):
-                    if _data.startswith('data:image'):
-                        keys.append(location)
-                        data.append(_data)
-            futures = executor.map(self._send_request, data)
-            for key, value in zip(keys, futures):
-                if value is None:
-                    return None
-                result[key] = value
+        """
+        Sends every image in payload to MathPix and waits for the results.
+        :return: A PostResult
+        """
+        result = PostResult(payload)
+        for key, future in self.submit_data(payload).items():
+            response = future.result().response
+            if response is None:
+                result.failed.add(key)
+            else:
+                result[key] = response
+        return result
+
+    def close(self, wait=True):
+        """
+        Waits for any requests still in flight, then closes the pooled connections. Answers read ahead of Compare that
+        haven't been sent yet are dropped.
+        :param wait: False to return at once, e.g. when the app stops: requests that haven't been sent are cancelled
+                     and those in flight make no more attempts, so they end within one TIMEOUT
+        """
+        if not wait:
+            self._closing.set()
+        self.speculator.shutdown(wait=wait, cancel_futures=True)
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        self.session.close()
+
+
+class AsyncMathPixAPI:
+    """
+    MathPixAPI on asyncio, for sending thousands of answers at once (e.g. re-reading archived canvases in a batch job)
+    without a thread for each. Requests are made over HTTP/1.1 with asyncio streams, from a pool of kept alive
+    connections shared by every request, and a semaphore caps how many are in flight. It has the same cache, retries,
+    records and results as MathPixAPI.
+
+    From a coroutine, await post_data_async() or iterate over post_many(). Everything else (including the app, when
+    api.BACKEND is 'asyncio') can use submit_data() and post_data() exactly as on MathPixAPI: they run the requests on
+    an event loop in a background thread. The pool belongs to one event loop at a time, so don't mix the two.
+    """
+    header = MathPixAPI.header
+
+    def __init__(self, base_url='https://api.mathpix.com', concurrency=CONCURRENCY, timeout=TIMEOUT, retries=RETRIES,
+                 backoff=BACKOFF, cache=None):
+        """
+        :param base_url: Where the API is - change to point the client at a stub server (see mock_server.py)
+        :param concurrency: How many requests are in flight at once, which is also how many connections are kept open
+        :param timeout: A (connect, read) tuple of seconds, for each attempt
+        :param retries: How many times a request is retried after a transient failure
+        :param backoff: The base of the jittered exponential backoff between attempts, in seconds
+        :param cache: An OCRCache - default is a new in-memory one
+        """
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.ssl = url.scheme == 'https'
+        self.text_url = f'{base_url}/v3/text'  # Only used in cache keys, which are the same as MathPixAPI's
+        self.stroke_url = f'{base_url}/v3/strokes'
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.records = deque(maxlen=HISTORY)
+        self.cache = OCRCache() if cache is None else cache
+        self._loop = None  # The event loop the pool below belongs to
+        self._semaphore = None
+        self._idle = []  # Open connections that aren't in use, as (reader, writer) tuples
+        self._background = None  # The event loop submit_data() and post_data() use, once started
+        self._thread = None  # ... and the thread running it
+        self._queued = {}  # An Event for each request from submit_data() still waiting to start, set until it does
+
+    def _bind(self):
+        """
+        Ties the pool to the running event loop, starting a new pool if the loop it was tied to has been closed.
+        :raises RuntimeError: If the pool is in use by another event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            raise RuntimeError('AsyncMathPixAPI is already in use by another event loop')
+        self._loop = loop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._idle = []
+
+    async def _connect(self):
+        """
+        :return: A tuple (reader, writer, reused), reusing an idle connection if one is still open
+        """
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl or None), self.timeout[0])
+        return reader, writer, False
+
+    async def _exchange(self, endpoint: str, body: str):
+        """
+        Makes one POST request. A kept alive connection may have been closed by the server since it was last used, so
+        a request that fails on one before getting any reply is sent again on a new connection.
+        :return: A tuple (status, text) of the response
+        """
+        while True:
+            reader, writer, reused = await self._connect()
+            try:
+                content = body.encode()
+                head = f'POST /v3/{endpoint} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(content)}\r\n' + \
+                    ''.join(f'{name}: {value}\r\n' for name, value in self.header.items())
+                writer.write(head.encode('latin-1') + b'\r\n' + content)
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), self.timeout[1])
+                if not status_line:
+                    raise ConnectionError('connection closed by the server')
+                status, headers, text = await asyncio.wait_for(self._read_response(status_line, reader),
+                                                               self.timeout[1])
+            except ConnectionError:
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if headers.get('connection', '').lower() == 'close' or 'content-length' not in headers and \
+                    headers.get('transfer-encoding', '').lower() != 'chunked':
+                writer.close()
+            else:
+                self._idle.append((reader, writer))
+            return status, text
+
+    @staticmethod
+    async def _read_response(status_line: bytes, reader):
+        """
+        :return: A tuple (status, headers, text) of the response that starts with status_line
+        :raises ValueError: If the response isn't HTTP
+        """
+        version, _, rest = status_line.decode('latin-1').partition(' ')
+        status = rest[:3]
+        if not version.startswith('HTTP/') or not status.isdigit():
+            raise ValueError(f'not an HTTP response: {status_line!r}')
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while size := int((await reader.readline()).split(b';')[0], 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            while await reader.readline() not in (b'\r\n', b'\n', b''):
+                pass  # Trailers
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            content = await reader.read()  # The body runs until the server closes the connection
+        return int(status), headers, content.decode()
+
+    async def send(self, data):
+        """
+        The coroutine version of MathPixAPI._send_request(): sends one handwritten answer, unless the cache already has
+        the response to it, with the same retries.
+        :return: A Request
+        """
+        self._bind()
+        endpoint, body = _encode(data)
+        start = time.perf_counter()
+        key = self.cache.key(self.text_url if endpoint == 'text' else self.stroke_url, body)
+        response = self.cache.get(key)
+        if response is not None:
+            request = Request(response, time.perf_counter() - start, 0, 'cached')
+            self.records.append(request._replace(response=None))
+            return request
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            try:
+                async with self._semaphore:
+                    status, text = await self._exchange(endpoint, body)
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+                status = type(error).__name__
+                continue
+            if status in RETRY_STATUSES:
+                continue
+            try:
+                response = json.loads(text)
+            except ValueError:
+                status = 'invalid JSON'
+            if status == 200 and response is not None:
+                self.cache.put(key, response)
+            break
+        request = Request(response, time.perf_counter() - start, attempt + 1, status)
+        self.records.append(request._replace(response=None))
+        return request
+
+    async def post_data_async(self, payload: dict):
+        """
+        Sends every handwritten answer in payload at once (up to the concurrency limit) and waits for the results.
+        :return: A PostResult, as from MathPixAPI.post_data()
+        """
+        keys = [key for key, data in payload.items() if _handwritten(data)]
+        requests = await asyncio.gather(*(self.send(payload[key]) for key in keys))
+        result = PostResult(payload)
+        for key, request in zip(keys, requests):
+            if request.response is None:
+                result.failed.add(key)
+            else:
+                result[key] = request.response
         return result
+
+    async def post_many(self, payloads, window=None):
+        """
+        Sends a stream of payloads, e.g. every archived submission, without reading the whole stream in at once: at
+        most window payloads are in flight, and no more are taken from payloads while the caller holds up the loop
+        that consumes the results.
+        :param payloads: An iterable of (key, payload) tuples
+        :param window: How many payloads to have in flight - default is enough to keep every connection busy
+        :return: An asynchronous iterator of (key, PostResult) tuples, in the order they finish
+        """
+        window = window or self.concurrency
+        payloads = iter(payloads)
+        pending = {}
+        while True:
+            for key, payload in payloads:
+                pending[asyncio.ensure_future(self.post_data_async(payload))] = key
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield pending.pop(task), task.result()
+
+    def _run(self, coroutine):
+        """
+        Runs coroutine on the background event loop, starting it if need be.
+        :return: A concurrent.futures.Future of its result
+        """
+        if self._thread is None:
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=loop.run_forever, name='mathpix', daemon=True)
+            self._thread.start()
+            self._background = loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self._background)
+
+    def submit_data(self, payload: dict, speculative=False):
+        """
+        As MathPixAPI.submit_data(). Answers read ahead of Compare share the concurrency limit, and cancelling their
+        Futures stops them even once they have been sent (see withdraw() to only stop those that haven't).
+        :return: A dictionary of concurrent.futures.Future, keyed like payload, one for each handwritten answer
+        """
+        return {location: self._submit(_data) for location, _data in payload.items() if _handwritten(_data)}
+
+    def _submit(self, data):
+        """
+        Runs send(data) on the background event loop, noting when it starts for withdraw().
+        :return: A concurrent.futures.Future of its Request
+        """
+        queued = threading.Event()
+        queued.set()
+
+        async def send():
+            queued.clear()
+            return await self.send(data)
+        future = self._run(send())
+        self._queued[future] = queued
+        future.add_done_callback(lambda done: self._queued.pop(done, None))
+        return future
+
+    def withdraw(self, future):
+        """
+        As MathPixAPI.withdraw(). A Future from run_coroutine_threadsafe() can be cancelled while its request is in
+        flight, so whether it has started is tracked here instead.
+        :return: True if it was withdrawn, False if it has been or is being sent
+        """
+        queued = self._queued.get(future)
+        return queued is not None and queued.is_set() and future.cancel()
+
+    def post_data(self, payload: dict):
+        """
+        As MathPixAPI.post_data().
+        :return: A PostResult
+        """
+        return self._run(self.post_data_async(payload)).result()
+
+    async def aclose(self):
+        """
+        Closes the pooled connections, from the event loop that used them.
+        """
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+    def close(self, wait=True):
+        """
+        Waits for any requests still in flight on the background event loop, then closes the pooled connections and
+        stops the loop.
+        :param wait: False to cancel the requests in flight instead of waiting for them, e.g. when the app stops
+        """
+        if self._thread is None:
+            return
+        async def drain():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if not wait:
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)  # A cancelled request isn't an error
+            await self.aclose()
+        self._run(drain()).result()
+        self._background.call_soon_threadsafe(self._background.stop)
+        self._thread.join()
+        self._background.close()
+        self._thread = None
+
+
+_client = None
+
+
+def get_client():
+    """
+    :return: The one client the app uses, made the first time it is asked for (in MainApp.on_start) with BACKEND as it
+             is then
+    """
+    global _client
+    if _client is None:
+        _client = AsyncMathPixAPI() if BACKEND == 'asyncio' else MathPixAPI()
+    return _client
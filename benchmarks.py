@@ -0,0 +1,1285 @@
+"""
+Benchmarks for the grading engine. Each benchmark first checks that the optimised code agrees with the reference
+implementation it replaced, then times both over the same corpus. Run `python benchmarks.py --help` for a list.
+"""
+from api import CONCURRENCY, MAX_IMAGES, AsyncMathPixAPI, MathPixAPI, OCRCache
+from latex_parser import COORDINATES, QUESTIONS, SAMPLE_POINTS, STEPS, TEST_CASES, Expression, LatexParser, \
+    answer_index_info, grade_parallel, re_patterns, _adjust_coefficient, _convert_latex, _lexical_analysis, \
+    _syntactic_analysis, _tokenize
+from imaging import IMAGE_HEIGHT, IMAGE_MARGIN, INK, PAPER, PNG_SIGNATURE, binarise, encode_png, export_scale, \
+    preprocess, stroke_box, strokes_payload
+from handwriting import render, scribble, writing
+from mock_server import MockCollectorServer, MockMathPixServer
+from telemetry import TelemetryUploader
+import telemetry
+from eventlog import BinaryEventLog, EventBuffer, EventLog, EventWriter, convert, read_events, read_logged, read_rows
+from ast import literal_eval
+from fractions import Fraction
+import concurrent.futures
+import csv
+import gzip
+import io
+from timeit import default_timer, repeat
+from itertools import product
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import requests
+import struct
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+
+def _reference_convert_latex(exp: str):
+    """
+    The original implementation of latex_parser._convert_latex: one re.sub per entry in re_patterns.
+    """
+    for pattern, replace in re_patterns.items():
+        exp = re.sub(pattern, replace, exp)
+    exp = exp.replace(" ", "")
+    return exp.lower()
+
+
+def _reference_evaluate_expression(exp: list):
+    """
+    The original implementation of LatexParser._evaluate_expression: collapses the first closed bracket it finds,
+    splices the result back into the list and starts again from the beginning.
+    """
+    stack = []
+    for i, x in enumerate(exp):
+        if x == '(':
+            stack.append(i)
+        elif x == ')':
+            start = stack.pop()
+            result = _reference_evaluate_brackets(exp[start + 1: i])
+            if result is not False:
+                exp[start: i + 1] = result
+                return _reference_evaluate_expression(exp)
+            else:
+                return False
+    return _reference_evaluate_brackets(exp)
+
+
+def _reference_evaluate_brackets(exp: list):
+    """
+    The original implementation of LatexParser._evaluate_brackets.
+    """
+    count = 1
+    while len(exp) > 1:
+        if '*' in exp:
+            index = exp.index('*')
+            product = float(exp[index - 1]) * float(exp[index + 1])
+            exp.insert(index + 2, product)
+            del exp[index - 1:index + 2]
+            continue
+        if '/' in exp:
+            index = exp.index('/')
+            try:
+                division = float(exp[index - 1]) / float(exp[index + 1])
+            except ZeroDivisionError:
+                return False
+            exp.insert(index + 2, division)
+            del exp[index - 1:index + 2]
+            continue
+        if '+' in exp:
+            index = exp.index('+')
+            summation = float(exp[index - 1]) + float(exp[index + 1])
+            exp.insert(index + 2, summation)
+            del exp[index - 1:index + 2]
+            continue
+        if '-' in exp:
+            index = exp.index('-')
+            subtraction = float(exp[index - 1]) - float(exp[index + 1])
+            exp.insert(index + 2, subtraction)
+            del exp[index - 1:index + 2]
+            continue
+        if count > 5:
+            break
+        count += 1
+    return exp
+
+
+def _reference_evaluate(exp: list):
+    """
+    Reduces the original evaluator's output to the value LatexParser._check_solution used: the first element as a
+    float, or False.
+    """
+    result = _reference_evaluate_expression(list(exp))
+    if result is False or len(result) == 0:
+        return False
+    return float(result[0])
+
+
+def _reference_check_solution(exp: list, solution=None):
+    """
+    The original implementation of LatexParser._check_solution, on the original evaluator. Each side counts as the
+    first element it reduces to, and a side whose first element isn't a number is skipped when there is no solution.
+    """
+    def is_float(value):
+        try:
+            float(value)
+            return True
+        except ValueError:
+            return False
+
+    if solution is None:
+        evaluated_expressions = set()
+        for expression in exp:
+            simplified = _reference_evaluate_expression(list(expression))
+            if is_float(simplified[0]):
+                evaluated_expressions.add(float(simplified[0]))
+        return len(evaluated_expressions) == 1
+    for expression in exp:
+        simplified = _reference_evaluate_expression(list(expression))
+        if simplified is False or len(simplified) == 0 or not is_float(simplified[0]) or \
+                float(simplified[0]) != solution:
+            return False
+    return True
+
+
+def _reference_syntactic_analysis(exp: str):
+    """
+    The original implementation of latex_parser._syntactic_analysis, the if/elif chain the transition table replaced.
+    """
+    stack = []  # Checks whether the brackets in the expression are correct
+    for i, char in enumerate(exp):
+        if char == '(':
+            stack.append(char)
+        elif char == ')':
+            if len(stack) == 0:
+                return False  # Prevents )() and other such issues
+            elif exp[i - 1] == '+' or exp[i - 1] == '/' or exp[i - 1] == '*' or exp[i - 1] == '-':
+                return False  # +) /) ×)
+            stack.pop()
+            continue
+        elif char == '/' or char == '*':
+            if i == 0:
+                return False
+            elif exp[i - 1] == '+' or exp[i - 1] == '/' or exp[i - 1] == '*' or exp[i - 1] == '-' or exp[i - 1] == '=':
+                return False  # /+ /- // /× =/ ×+ ×- ×/ ×× =×
+        elif char == '+':
+            if i == 0:  # Expression that starts with a plus is allowed
+                continue
+            elif exp[i - 1] == '+' or exp[i - 1] == '*' or exp[i - 1] == '/' or exp[i - 1] == '=':  # ++ ×+ /+ =+
+                return False
+            elif i > 2:
+                if exp[i - 1] == '-' and not exp[i - 2].isnumeric():  # +-+ --+ +++ -++ (-+ etc.
+                    return False
+        elif char == '-':
+            if i == 0:  # Expression that starts with -- is allowed
+                continue
+            elif i > 2:
+                if (exp[i - 1] == '+' or exp[i - 1] == '-' or exp[i - 1] == '*' or exp[i - 1] == '/') \
+                        and (not exp[i - 2] in 'mxcy0123456789'):  # +-- --- -+- ++- (-- *-- *+- /-- etc.
+                    return False
+        elif char == '=':
+            if i == 0:
+                continue  # Expression that starts with = is allowed
+            elif exp[i - 1] == '+' or exp[i - 1] == '/' or exp[i - 1] == '*' or exp[i - 1] == '-' or exp[i - 1] == '=':
+                return False  # /= -= ×= += ==
+            elif len(stack) > 0:
+                return False  # Prevents (x = c) = 4
+        elif char.isnumeric():
+            if i == 0:
+                continue
+            if exp[i - 1].isalpha():
+                return False  # Prevents a2
+        elif char.isalpha() and char not in 'ymxc':
+            return False  # Not all that useful but acts as a safety net if user attempts to add other characters
+    if len(stack) > 0:
+        return False  # Prevents (() and other errors with opening and closing brackets
+    return True
+
+
+def _reference_post_data(payload: dict, url: str):
+    """
+    The original implementation of api.MathPixAPI.post_data: a new thread pool for every submission, and a new
+    connection for every image.
+    """
+    def send_request(data: str):
+        try:
+            r = requests.post(url, data=json.dumps({'src': data}), headers=MathPixAPI.header)
+        except:
+            return None
+        return json.loads(r.text)
+
+    result = dict(payload)
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        keys = []
+        data = []
+        for location, _data in payload.items():
+            if isinstance(_data, str) and _data.startswith('data:image'):
+                keys.append(location)
+                data.append(_data)
+        for key, value in zip(keys, executor.map(send_request, data)):
+            if value is None:
+                return None
+            result[key] = value
+    return result
+
+
+def _corpus_expressions():
+    """
+    Every expression the parsers evaluate while grading latex_parser.TEST_CASES, with the question's values substituted
+    for m, c, x and y the way the parsers do it (x and y take both points, so each answer contributes two lists).
+    """
+    expressions = []
+    for i, (x1, y1, x2, y2) in enumerate(QUESTIONS):
+        parser = LatexParser(x1, y1, x2, y2, exact=False)
+        for step in range(5):
+            for case in TEST_CASES[f'{i}{step}']:
+                tokens = _tokenize(case, two=step == 2)
+                if tokens is None:
+                    continue
+                for x, y in ((x1, y1), (x2, y2)):
+                    values = {'m': str(parser.m), 'c': str(parser.c), 'x': str(x), 'y': str(y)}
+                    expressions.extend([values.get(token, token) for token in exp] for exp in tokens)
+    return expressions
+
+
+def _synthetic_expression(size: int, rng: random.Random):
+    """
+    A well formed tokenized expression of roughly size tokens: numbers joined by the four operators, with randomly
+    nested brackets.
+    """
+    tokens = []
+    depth = 0
+    while True:
+        while len(tokens) < size and rng.random() < 0.2:
+            tokens.append('(')
+            depth += 1
+        tokens.append(str(rng.randint(-20, 20)))
+        while depth > 0 and (len(tokens) >= size or rng.random() < 0.3):
+            tokens.append(')')
+            depth -= 1
+        if len(tokens) >= size:
+            return tokens
+        tokens.append(rng.choice('+-*/'))
+
+
+def _malformed_expression(rng: random.Random):
+    """
+    A short tokenized expression, well formed or broken in one of the ways OCR output can be: two operands with no
+    operator between them, as in (2)(1) or 2(1+3), a trailing operator, a lone operator or nothing at all. A leading
+    * or / is left out: _syntactic_analysis refuses it, and the original evaluator never returned from it.
+    """
+    tokens = _synthetic_expression(rng.randint(1, 7), rng)
+    mistake = rng.choice(('none', 'juxtaposed', 'juxtaposed', 'trailing', 'operator', 'blank'))
+    if mistake == 'juxtaposed':
+        operand = rng.choice([['(', str(rng.randint(-9, 9)), ')'], [str(rng.randint(0, 9))],
+                              ['(', '(', str(rng.randint(0, 9)), ')', ')']])
+        tokens = tokens + operand if rng.random() < 0.5 else operand + tokens
+    elif mistake == 'trailing':
+        tokens = tokens + [rng.choice('+-*/')]
+    elif mistake == 'operator':
+        tokens = [rng.choice('+-*/')]
+    elif mistake == 'blank':
+        tokens = []
+    return tokens
+
+
+def _corpus_answers():
+    """
+    Every (question, step, answer) in latex_parser.TEST_CASES, with question as its coordinates.
+    """
+    return [(tuple(question), step, case) for i, question in enumerate(QUESTIONS) for step in range(5)
+            for case in TEST_CASES[f'{i}{step}']]
+
+
+def _fraction_answers():
+    """
+    Correct answers, in the forms the keyboard produces, for questions whose slope or intercept is a fraction. These
+    are the answers that depend on rounding when graded with floats.
+    """
+    answers = []
+    for question in ((2, 5, 10, 9), (3, -7, 27, 1), (-1, 1, 7, 5), (40, 10, 20, 5), (1, 1, 7, 3), (1, 2, 11, 5)):
+        x1, y1, x2, y2 = question
+        m = Fraction(y2 - y1, x2 - x1)
+        c = y1 - m * x1
+        m_text = f'(({m.numerator})/({m.denominator}))'
+        c_text = f'(({c.numerator})/({c.denominator}))' if c.denominator != 1 else str(c)
+        x_text = f'(({m.numerator}x)/({m.denominator}))'
+        answers.extend((question, step, answer) for step, answer in (
+            (0, f'(({y2}-{y1})/({x2}-{x1}))={m_text}'), (1, f'y={m_text}x+c'), (1, f'y={x_text}+c'),
+            (2, f'{y2}={m_text}×{x2}+c'), (2, f'{y2}={x2}×{m_text}+c'), (3, f'c={c_text}'),
+            (4, f'y={m_text}x+{c_text}'), (4, f'y={x_text}+{c_text}')))
+    return answers
+
+
+def _corpus():
+    """
+    Every answer in latex_parser.TEST_CASES, flattened into a single list.
+    """
+    return [case for cases in TEST_CASES.values() for case in cases]
+
+
+def _latex_corpus(size: int, seed: int = 0):
+    """
+    Random strings built from the fragments MathPix actually returns (and a few it shouldn't), used to check the
+    normaliser against the reference on inputs the hand written corpus doesn't cover.
+    """
+    fragments = ['\\frac{', '}{', '}', '\\left(', '\\right)', '\\times', '\\alpha', '\\rho', '\\mid', '\\(', '\\)',
+                 '\\', '×', ' ', 'x', 'y', 'c', 'm', 's', 'S', 'b', 'g', 'q', 't', 'L', 'l', '[', ']', '=', '+', '-',
+                 '1', '2', '7', '(', ')']
+    rng = random.Random(seed)
+    return [''.join(rng.choice(fragments) for _ in range(rng.randint(1, 20))) for _ in range(size)]
+
+
+def _time(function, corpus, number: int):
+    """
+    :return: The best of five runs, in microseconds per expression
+    """
+    best = min(repeat(lambda: [function(exp) for exp in corpus], number=number, repeat=5))
+    return best / (number * len(corpus)) * 1e6
+
+
+def bench_normalise(number: int):
+    corpus = _corpus()
+    for exp in corpus + _latex_corpus(20000):
+        assert _convert_latex(exp) == _reference_convert_latex(exp), exp
+    for name, exps in (('corpus', corpus), ('latex', [f'\\( {exp} \\)'.replace('×', '\\times ') for exp in corpus])):
+        before = _time(_reference_convert_latex, exps, number)
+        after = _time(_convert_latex, exps, number)
+        print(f'normalise [{name}]: {before:.2f} us -> {after:.2f} us per expression ({before / after:.1f}x)')
+
+
+def bench_syntax(number: int):
+    alphabet = '0123456789ymxc+-*/=()'
+    rng = random.Random(0)
+    exhaustive = [''.join(exp) for length in range(5) for exp in product(alphabet, repeat=length)]
+    random_strings = [''.join(rng.choice(alphabet) for _ in range(rng.randint(5, 30))) for _ in range(200000)]
+    unicode_strings = [''.join(rng.choice(alphabet + 'ab.² ½一٣X') for _ in range(rng.randint(1, 12)))
+                       for _ in range(50000)]
+    mutated = []  # Corpus answers with a few characters changed, most of which are still nearly valid
+    for exp in rng.choices([_convert_latex(exp) for exp in _corpus()], k=100000):
+        for _ in range(rng.randint(1, 3)):
+            i = rng.randrange(len(exp) + 1)
+            exp = exp[:i] + rng.choice(('', rng.choice(alphabet))) + exp[i + rng.randint(0, 1):]
+        mutated.append(exp)
+    for exp in _corpus() + exhaustive + random_strings + unicode_strings + mutated:
+        assert _syntactic_analysis(exp) == _reference_syntactic_analysis(exp), exp
+    print(f'syntax: {len(exhaustive)} exhaustive, {len(random_strings)} random, {len(unicode_strings)} unicode and '
+          f'{len(mutated)} mutated strings agree with the reference ({sum(map(_syntactic_analysis, mutated))} valid)')
+    long = [_synthetic_expression(size, rng) for size in (100, 1000) for _ in range(10)]
+    for name, exps in (('corpus', [_convert_latex(exp) for exp in _corpus()]), ('random', random_strings[:2000]),
+                       ('long', ['y=' + ''.join(exp).replace('+-', '+').replace('--', '-') for exp in long])):
+        before = _time(_reference_syntactic_analysis, exps, max(1, number // 10))
+        after = _time(_syntactic_analysis, exps, max(1, number // 10))
+        print(f'syntax [{name}]: {before:.2f} us -> {after:.2f} us per expression ({before / after:.1f}x)')
+
+
+def bench_evaluate(number: int):
+    rng = random.Random(0)
+    corpus = _corpus_expressions()
+    synthetic = {size: [_synthetic_expression(size, rng) for _ in range(20)] for size in (10, 30, 100, 300, 1000)}
+    for exp in corpus + [exp for exps in synthetic.values() for exp in exps]:
+        assert LatexParser._evaluate_expression(exp) == _reference_evaluate(exp), exp
+    print(f'evaluate: {len(corpus)} corpus expressions agree with the reference evaluator')
+    # Answers of one to three sides, some of them malformed, graded both ways. The only differences allowed are answers
+    # the old code raised on, and answers it accepted although a side is malformed: it read the first number a side
+    # reduced to, e.g. 2 for (2)((1)), and skipped sides such as a lone - that didn't reduce to a number at all
+    outcomes = {'agree': 0, 'raised': 0, 'accepted malformed': 0}
+    for _ in range(20000):
+        sides = [_malformed_expression(rng) for _ in range(rng.choice((1, 2, 2, 3)))]
+        solution = rng.choice((None, _reference_evaluate(sides[0]) if sides[0] and
+                               Expression(sides[0]).rpn is not None else rng.randint(-9, 9)))
+        graded = LatexParser._check_solution([Expression(side) for side in sides], {}, solution)
+        try:
+            reference = _reference_check_solution(sides, solution)
+        except (ValueError, IndexError, TypeError):
+            assert graded is False, sides
+            outcomes['raised'] += 1
+            continue
+        if graded == reference:
+            outcomes['agree'] += 1
+            continue
+        assert reference and not graded and any(Expression(side).rpn is None for side in sides), (sides, solution)
+        outcomes['accepted malformed'] += 1
+    print(f'evaluate: of 20000 answers with juxtaposed operands, stray operators and blank sides, '
+          f'{outcomes["agree"]} are graded as before, {outcomes["raised"]} that raised are now False, and '
+          f'{outcomes["accepted malformed"]} that were accepted although a side is malformed are now False')
+    for name, exps in [('corpus', corpus)] + [(f'{size} tokens', exps) for size, exps in synthetic.items()]:
+        before = _time(_reference_evaluate, exps, max(1, number // 10))
+        after = _time(LatexParser._evaluate_expression, exps, max(1, number // 10))
+        print(f'evaluate [{name}]: {before:.2f} us -> {after:.2f} us per expression ({before / after:.1f}x)')
+
+
+def bench_points(number: int):
+    # The line through the question's points, written as its gradient from one of the further points, divides by zero
+    # there. It was right when only the two given points were checked, and still is
+    for x1, y1, x2, y2 in QUESTIONS:
+        parser = LatexParser(x1, y1, x2, y2)
+        for k in SAMPLE_POINTS[2:]:
+            x, y = x1 + k * (x2 - x1), y1 + k * (y2 - y1)
+            assert parser.four(f'((y-({y}))/(x-({x})))=(({y2 - y1})/({x2 - x1}))'), (x1, y1, x2, y2, k)
+            assert not parser.four(f'((y-({y1}))/(x-({x1})))=(({y2 - y1})/({x2 - x1}))'), (x1, y1, x2, y2)
+    answers = []
+    for i, (x1, y1, x2, y2) in enumerate(QUESTIONS):
+        parser = LatexParser(x1, y1, x2, y2, exact=False)
+        for step in (1, 4):
+            answers.extend((parser, _tokenize(case)) for case in TEST_CASES[f'{i}{step}'] if _tokenize(case))
+    for count in (2, 4, 16):
+
+        def substitute(answer):
+            parser, tokens = answer
+            for x in range(count):
+                values = {'c': str(parser.c), 'x': str(x), 'y': str(parser.m * x + parser.c)}
+                [_reference_evaluate([values.get(token, token) for token in exp]) for exp in tokens]
+
+        def compile_once(answer):
+            parser, tokens = answer
+            expressions = [Expression(exp) for exp in tokens]
+            for x in range(count):
+                values = {'c': parser.c, 'x': float(x), 'y': parser.m * x + parser.c}
+                [expression.evaluate(values) for expression in expressions]
+
+        before = _time(substitute, answers, number)
+        after = _time(compile_once, answers, number)
+        print(f'points [{count} points]: {before:.2f} us -> {after:.2f} us per answer ({before / after:.1f}x)')
+
+
+def bench_exact(number: int):
+    for name, answers in (('corpus', _corpus_answers()), ('fractions', _fraction_answers())):
+        results = {}
+        for exact in (False, True):
+            parsers = {question: LatexParser(*question, exact=exact) for question, _, _ in answers}
+
+            def grade(answer):
+                question, step, text = answer
+                return parsers[question].run(text, step)
+
+            results[exact] = (_time(grade, answers, max(1, number // 10)), sum(map(grade, answers)))
+        (float_time, float_correct), (exact_time, exact_correct) = results[False], results[True]
+        print(f'exact [{name}]: {float_time:.2f} us -> {exact_time:.2f} us per answer, '
+              f'{float_correct} -> {exact_correct} of {len(answers)} graded correct')
+
+
+def bench_cache(number: int):
+    answers = [(case, step == 2) for _, step, case in _corpus_answers()]
+    _tokenize.cache_clear()
+    before = _time(lambda answer: _tokenize.__wrapped__(*answer), answers, number)
+    after = _time(lambda answer: _tokenize(*answer), answers, number)
+    info = _tokenize.cache_info()
+    print(f'cache: {before:.2f} us -> {after:.2f} us per answer ({before / after:.1f}x), '
+          f'{info.hits} hits, {info.misses} misses, {info.currsize} entries')
+
+
+def bench_index(number: int):
+    answers = _corpus_answers() + _fraction_answers()
+    indexed = {question: LatexParser(*question) for question, _, _ in answers}
+    unindexed = {question: LatexParser(*question) for question, _, _ in answers}
+    for parser in unindexed.values():
+        parser.index = dict.fromkeys(STEPS, frozenset())  # Every lookup misses, so every answer is evaluated in full
+    start = answer_index_info()
+    results = [indexed[question].run(text, step) for question, step, text in answers]
+    end = answer_index_info()
+    hits, misses = (sum(end[step][i] - start[step][i] for step in STEPS) for i in (0, 1))
+    for (question, step, text), result in zip(answers, results):
+        assert result == unindexed[question].run(text, step), (question, step, text)
+    before = _time(lambda answer: unindexed[answer[0]].run(answer[2], answer[1]), answers, number)
+    after = _time(lambda answer: indexed[answer[0]].run(answer[2], answer[1]), answers, number)
+    print(f'index: {before:.2f} us -> {after:.2f} us per answer ({before / after:.1f}x), {hits} of {hits + misses} '
+          f'valid answers ({hits / (hits + misses):.0%}) accepted by lookup')
+
+
+def bench_client(number: int):
+    payload = {step: 'data:image/png;base64,' + 'A' * 20000 for step in range(5)}  # About the size of a 15 kB PNG
+    for handshake in (0, 0.02):
+        server = MockMathPixServer(handshake_delay=handshake).start()
+        client = MathPixAPI(server.url, cache=OCRCache(size=0))  # Every submission goes over the network
+        try:
+            assert client.post_data(payload) == _reference_post_data(payload, f'{server.url}/v3/text')
+            server.connections = 0
+            cold = min(repeat(lambda: _reference_post_data(payload, f'{server.url}/v3/text'), number=number, repeat=3))
+            cold_connections, server.connections = server.connections, 0
+            warm = min(repeat(lambda: client.post_data(payload), number=number, repeat=3))
+            warm_connections = server.connections
+        finally:
+            client.close()
+            server.stop()
+        print(f'client [{handshake * 1000:.0f} ms handshake]: {cold / number * 1000:.2f} ms -> '
+              f'{warm / number * 1000:.2f} ms per five image submission ({cold / warm:.1f}x), '
+              f'{cold_connections} -> {warm_connections} connections opened')
+
+    # When the app stops, neither client waits for the backoff between attempts or for answers not yet sent
+    server = MockMathPixServer(error_rate=1.0).start()  # Every answer is retried
+    try:
+        for client in (MathPixAPI(server.url, backoff=10, cache=OCRCache(size=0)),
+                       AsyncMathPixAPI(server.url, backoff=10, cache=OCRCache(size=0))):
+            futures = [future for _ in range(3) for future in client.submit_data(payload).values()]
+            time.sleep(0.2)
+            start = default_timer()
+            client.close(wait=False)
+            closed = default_timer() - start
+            concurrent.futures.wait(futures, 1)
+            assert closed < 0.1 and all(future.done() for future in futures), (type(client).__name__, closed)
+            assert all(future.cancelled() or future.result().attempts == 1 for future in futures)
+    finally:
+        server.stop()
+
+
+def _decode_png(png: bytes):
+    """
+    Just enough of a PNG decoder to check imaging.encode_png(): checks the signature and every CRC, then undoes the
+    (unfiltered) rows. 1 bit pixels are unpacked to a byte each, INK or PAPER.
+    :return: A tuple (width, height, colour_type, pixels)
+    """
+    assert png.startswith(PNG_SIGNATURE)
+    position, chunks = len(PNG_SIGNATURE), {}
+    while position < len(png):
+        length, = struct.unpack('>I', png[position:position + 4])
+        chunk_type, data = png[position + 4:position + 8], png[position + 8:position + 8 + length]
+        crc, = struct.unpack('>I', png[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + data)
+        chunks[chunk_type] = chunks.get(chunk_type, b'') + data
+        position += 12 + length
+    width, height, depth, colour_type = struct.unpack('>IIBB', chunks[b'IHDR'][:10])
+    raw = zlib.decompress(chunks[b'IDAT'])
+    stride = len(raw) // height
+    assert depth in (1, 8) and all(raw[row] == 0 for row in range(0, len(raw), stride))
+    rows = [raw[row + 1:row + stride] for row in range(0, len(raw), stride)]
+    if depth == 1:
+        rows = [bytes(PAPER if byte >> (7 - bit) & 1 else INK for byte in row for bit in range(8))[:width]
+                for row in rows]
+    return width, height, colour_type, b''.join(rows)
+
+
+def bench_capture(number: int):
+    width, height = 600, 160  # About the size of a ResponseField on the tablets we deploy to
+    canvases = [scribble(width, height, strokes, seed)[0] for seed, strokes in enumerate((3, 6, 12))]
+    for pixels in canvases:
+        assert _decode_png(encode_png(pixels, width, height)) == (width, height, 6, pixels)
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'image_0.png')
+
+        def through_file(pixels):
+            with open(file_name, 'wb') as image_file:
+                image_file.write(encode_png(pixels, width, height))
+            return MathPixAPI.format_data(file_name)
+
+        def in_memory(pixels):
+            return MathPixAPI.format_png(encode_png(pixels, width, height))
+
+        assert list(map(through_file, canvases)) == list(map(in_memory, canvases))
+        before = _time(through_file, canvases, max(1, number // 10))
+        after = _time(in_memory, canvases, max(1, number // 10))
+    size = sum(len(encode_png(pixels, width, height)) for pixels in canvases) // len(canvases)
+    print(f'capture [{width}x{height}]: {before / 1000:.2f} ms -> {after / 1000:.2f} ms per image '
+          f'({before / after:.1f}x), {size / 1000:.1f} kB PNG')
+
+
+def bench_strokes(number: int):
+    width, height = 600, 160
+    pen = ([0, 10, 10, 10, 20, 10, 30, 10], 2, True)
+    assert strokes_payload([pen, ([20, 0, 20, 20], 3, False)], 0, 20) == \
+        {'strokes': {'strokes': {'x': [[0, 10], [30]], 'y': [[10, 10], [10]]}}}  # The eraser splits the pen stroke
+    assert strokes_payload([([20, 0, 20, 20], 3, False), pen], 0, 20)['strokes']['strokes']['x'] == [[0, 10, 20, 30]]
+    answers = [scribble(width, height, strokes, seed) for seed, strokes in enumerate((3, 6, 9, 12, 15))]
+    images = {step: MathPixAPI.format_png(encode_png(pixels, width, height))
+              for step, (pixels, _) in enumerate(answers)}
+    strokes = {step: strokes_payload(lines, 0, height) for step, (_, lines) in enumerate(answers)}
+    image_size = sum(len(json.dumps({'src': image})) for image in images.values())
+    strokes_size = sum(len(json.dumps(data, separators=(',', ':'))) for data in strokes.values())
+    server = MockMathPixServer().start()
+    client = MathPixAPI(server.url, cache=OCRCache(size=0))
+    try:
+        assert not client.post_data(strokes).failed
+        before = min(repeat(lambda: client.post_data(images), number=number, repeat=3)) / number
+        after = min(repeat(lambda: client.post_data(strokes), number=number, repeat=3)) / number
+    finally:
+        client.close()
+        server.stop()
+    print(f'strokes: {image_size / 1000:.1f} kB -> {strokes_size / 1000:.1f} kB per five answer submission '
+          f'({image_size / strokes_size:.2f}x), {before * 1000:.2f} ms -> {after * 1000:.2f} ms against the stub')
+
+
+def bench_preprocess(number: int):
+    width, height = 600, 160
+    answers = [writing(width, height, characters, size, seed)
+               for seed, (characters, size) in enumerate([(3, 40), (6, 60), (6, 120), (9, 80), (12, 50)])]
+    boxes = [stroke_box(lines, 0, height, IMAGE_MARGIN) for lines in answers]  # As get_image_data()
+    scales = [export_scale(box) for box in boxes]
+    canvases = [render(lines, width, height) for lines in answers]
+    exports = [(render(lines, width, height, scale), box, scale) for lines, box, scale in zip(answers, boxes, scales)]
+    full = [encode_png(pixels, width, height) for pixels in canvases]
+    small = [preprocess(pixels, int(width * scale), int(height * scale), box, scale) for pixels, box, scale in exports]
+    for png, (pixels, _, _) in zip(small, exports):
+        _, rows, colour_type, grey = _decode_png(png)
+        assert colour_type == 0 and rows <= IMAGE_HEIGHT
+        assert grey.count(INK) == binarise(pixels).count(INK)  # Cropping kept every stroke
+    full_time = _time(lambda pixels: encode_png(pixels, width, height), canvases, max(1, number // 10))
+    small_time = _time(lambda export: preprocess(export[0], int(width * export[2]), int(height * export[2]), *export[1:]),
+                       exports, max(1, number // 10))
+    before = {step: MathPixAPI.format_png(png) for step, png in enumerate(full)}
+    after = {step: MathPixAPI.format_png(png) for step, png in enumerate(small)}
+    server = MockMathPixServer().start()
+    client = MathPixAPI(server.url, cache=OCRCache(size=0))
+    try:
+        full_result, small_result = client.post_data(before), client.post_data(after)
+        assert not full_result.failed and not small_result.failed
+        for step, png in enumerate(small):  # The stub read every image, and the same text from both
+            assert 'error' not in small_result[step] and small_result[step]['text'] == full_result[step]['text']
+            assert small_result[step]['image_height'] == struct.unpack('>I', png[20:24])[0]
+        full_latency = min(repeat(lambda: client.post_data(before), number=number, repeat=3)) / number
+        small_latency = min(repeat(lambda: client.post_data(after), number=number, repeat=3)) / number
+    finally:
+        client.close()
+        server.stop()
+    full_size, small_size = sum(map(len, full)) / len(full), sum(map(len, small)) / len(small)
+    print(f'preprocess [{width}x{height}]: {full_size / 1000:.2f} kB -> {small_size / 1000:.2f} kB per image '
+          f'({full_size / small_size:.1f}x), {full_time / 1000:.2f} ms -> {small_time / 1000:.2f} ms to encode, '
+          f'{full_latency * 1000:.2f} ms -> {small_latency * 1000:.2f} ms per five image submission against the stub')
+
+
+def bench_ocr(number: int):
+    width, height = 600, 160
+    images = {step: MathPixAPI.format_png(encode_png(scribble(width, height, 9, seed)[0], width, height))
+              for step, seed in enumerate(range(5))}
+    server = MockMathPixServer(handshake_delay=0.02).start()
+    with tempfile.TemporaryDirectory() as directory:
+        client = MathPixAPI(server.url, cache=OCRCache(disk_size=3))
+        client.cache.use_directory(directory)
+        try:
+            start = default_timer()
+            first = client.post_data(images)
+            cold = default_timer() - start
+            assert server.requests == 5 and len(os.listdir(directory)) == 3  # The two oldest were evicted from disk
+            warm = min(repeat(lambda: client.post_data(images), number=number, repeat=3)) / number
+            assert server.requests == 5 and client.post_data(images) == first
+            restarted = MathPixAPI(server.url, cache=OCRCache())  # Only what is on disk survives a restart
+            restarted.cache.use_directory(directory)
+            assert restarted.post_data(images) == first and server.requests == 7
+            restarted.close()
+        finally:
+            client.close()
+            server.stop()
+
+    # Answers read ahead of Compare that have gone stale, one of them still in flight, don't hold up the submission
+    latency = 0.1
+    server = MockMathPixServer(latency=latency).start()
+    speculating = MathPixAPI(server.url, cache=OCRCache(size=0))
+    try:
+        stale = [speculating.submit_data({step: images[step]}, speculative=True)[step] for step in range(5)]
+        time.sleep(latency / 2)
+        cancelled = sum(future.cancel() for future in stale)
+        start = default_timer()
+        assert speculating.post_data(images) == first
+        submitted = default_timer() - start
+        assert cancelled == 4 and submitted < latency * 1.8, (cancelled, submitted)
+        # A read ahead that is still current when Compare is pressed is only withdrawn if it hasn't been sent yet, on
+        # either client, though the asyncio one's Futures can be cancelled in flight
+        for reader in (speculating, AsyncMathPixAPI(server.url, cache=OCRCache(size=0))):
+            future = reader.submit_data({0: images[0]}, speculative=True)[0]
+            time.sleep(latency / 2)
+            assert not reader.withdraw(future) and future.result().response == first[0]
+        reader.submit_data({0: images[1]}, speculative=True)[0].cancel()
+        reader.close()  # Straight after a request was cancelled, which mustn't stop the app's other clean up
+    finally:
+        speculating.close()
+        server.stop()
+    print(f'ocr: {cold * 1000:.2f} ms -> {warm * 1000:.3f} ms per five image submission once cached '
+          f'({client.cache.hits} hits, {client.cache.misses} misses), {restarted.cache.hits} of 5 read back from disk; '
+          f'{submitted * 1000:.0f} ms with a stale read ahead in flight ({latency * 1000:.0f} ms each answer)')
+
+
+def bench_async(number: int):
+    latency, submissions = 0.05, max(number * 4, 20)  # A batch of archived five field submissions, 50 ms each answer
+    payloads = [{step: strokes_payload(scribble(600, 160, 3, seed * 5 + step)[1], 0, 160) for step in range(5)}
+                for seed in range(submissions)]
+    server = MockMathPixServer(latency=latency).start()
+
+    def threaded(workers):
+        client = MathPixAPI(server.url, workers=workers, cache=OCRCache(size=0))
+        try:
+            futures = [client.submit_data(payload) for payload in payloads]  # Everything at once, as a batch job would
+            return [{key: future.result().response for key, future in submission.items()} for submission in futures]
+        finally:
+            client.close()
+
+    def asynchronous(concurrency):
+        async def read_all():
+            client = AsyncMathPixAPI(server.url, concurrency=concurrency, cache=OCRCache(size=0))
+            results = [None] * submissions
+            async for index, result in client.post_many(enumerate(payloads)):
+                results[index] = dict(result)
+            await client.aclose()
+            return results
+        return asyncio.run(read_all())
+
+    try:
+        assert threaded(MAX_IMAGES) == asynchronous(CONCURRENCY)
+        timings = []
+        for name, send, limit in (('threads', threaded, MAX_IMAGES), ('threads', threaded, CONCURRENCY),
+                                  ('asyncio', asynchronous, CONCURRENCY), ('asyncio', asynchronous, 4 * CONCURRENCY)):
+            server.connections = 0
+            start = default_timer()
+            send(limit)
+            timings.append(f'{name} x{limit}: {submissions * 5 / (default_timer() - start):.0f} ({server.connections} '
+                           f'connections)')
+    finally:
+        server.stop()
+    print(f'async [{submissions * 5} answers, {latency * 1000:.0f} ms each]: answers per second with '
+          f'{", ".join(timings)}')
+
+
+def _cohort(size: int, seed: int = 0):
+    """
+    A synthetic cohort's worth of logged submissions for COORDINATES: corpus answers padded with a random +k-k so that
+    most of them are distinct, as they would be across a real cohort.
+    """
+    rng = random.Random(seed)
+    answers = _corpus_answers()
+    submissions = []
+    for _ in range(size):
+        _, step, text = rng.choice(answers)
+        k = rng.randint(0, size // 10)
+        submissions.append((rng.randrange(len(COORDINATES)), step, f'{text}+{k}-{k}' if k else text))
+    return submissions
+
+
+def bench_scaling(number: int):
+    submissions = _cohort(number * 2000)
+    expected = list(LatexParser.grade_many(submissions))
+    print(f'scaling: {len(submissions)} submissions, {len(set(submissions))} distinct, {os.cpu_count()} CPUs')
+    for workers in range(1, (os.cpu_count() or 1) + 2):
+        _tokenize.cache_clear()  # Forked workers would otherwise inherit a warm cache
+        start = default_timer()
+        assert grade_parallel(submissions, workers) == expected
+        elapsed = default_timer() - start
+        print(f'scaling [{workers} workers]: {len(submissions) / elapsed:,.0f} submissions per second')
+
+
+def _nested_fractions(depth: int, count: int, seed: int = 0):
+    """
+    Line equations whose right hand side is depth fractions nested inside one another, as the keyboard writes them.
+    """
+    rng = random.Random(seed)
+    answers = []
+    for _ in range(count):
+        exp = 'x'
+        for _ in range(depth):
+            exp = f'(({exp}+{rng.randint(1, 9)})/({rng.randint(1, 9)}))'
+        answers.append(f'y={exp}')
+    return answers
+
+
+def _long_sums(terms: int, count: int, seed: int = 0):
+    """
+    Line equations whose right hand side is an x term followed by a sum of terms numbers. There is only the one x term
+    because _adjust_coefficient() only inserts the multiplication sign into the first.
+    """
+    rng = random.Random(seed)
+    return [f'y={rng.randint(1, 99)}x' + ''.join(f"{rng.choice('+-')}{rng.randint(1, 99)}" for _ in range(terms))
+            for _ in range(count)]
+
+
+# The characters MathPix confuses with each other, i.e. re_patterns read backwards
+_OCR_CONFUSIONS = {'5': ('s', 'S'), '6': ('b',), '9': ('g', 'q', '\\rho'), '+': ('t',), 'c': ('L',),
+                   '1': ('l', '[', ']', '\\mid'), '*': ('\\times', '\\alpha', '×')}
+
+
+def _ocr_noise(count: int, seed: int = 0):
+    """
+    Corpus answers written out the way MathPix returns them (\\frac, \\left( and \\right), \\times, stray spaces)
+    with characters swapped for the ones OCR confuses them with, and now and then a letter it should never have read.
+    """
+    rng = random.Random(seed)
+    answers = []
+    for _ in range(count):
+        exp = re.sub(r'\(\(([^()]*)\)/\(([^()]*)\)\)', r'\\frac{\1}{\2}', rng.choice(_corpus()))
+        noisy = []
+        for character in exp:
+            if character in _OCR_CONFUSIONS and rng.random() < 0.3:
+                character = rng.choice(_OCR_CONFUSIONS[character])
+            elif character == '(' and rng.random() < 0.5:
+                character = '\\left('
+            elif character == ')' and rng.random() < 0.5:
+                character = '\\right)'
+            elif rng.random() < 0.02:
+                character += rng.choice('ozk')
+            noisy.append(character + ' ' * (rng.random() < 0.2))
+        answers.append(''.join(noisy))
+    return answers
+
+
+def _phases(answers: list, number: int):
+    """
+    Times each phase of grading separately over answers, feeding every phase the output of the one before it. Answers
+    that fail the syntax check drop out there, so the later phases are timed over the answers that reach them.
+    :param answers: A list of (answer, values) tuples, with values the dictionary the answer is evaluated at
+    :return: A dictionary of counts and timings (in microseconds per answer)
+    """
+    normalised = [(_convert_latex(answer), values) for answer, values in answers]
+    valid = [(answer, values) for answer, values in normalised if _syntactic_analysis(answer)]
+
+    def tokenise(answer):
+        for variable in ('x', 'y'):
+            answer = _adjust_coefficient(answer, variable)
+        return _lexical_analysis(answer)
+
+    tokenised = [(tokenise(answer), values) for answer, values in valid]
+
+    def evaluate(answer):
+        tokens, values = answer
+        return [Expression(exp, exact=True).evaluate(values) for exp in tokens]
+
+    return {
+        'answers': len(answers),
+        'valid': len(valid),
+        'evaluated': sum(False not in evaluate(answer) for answer in tokenised),
+        'us_per_answer': {
+            'normalise': round(_time(lambda answer: _convert_latex(answer[0]), answers, number), 3),
+            'syntax': round(_time(lambda answer: _syntactic_analysis(answer[0]), normalised, number), 3),
+            'tokenise': round(_time(lambda answer: tokenise(answer[0]), valid, number), 3),
+            'evaluate': round(_time(evaluate, tokenised, number), 3),
+        },
+    }
+
+
+def _session(events: int, seed: int = 0):
+    """
+    A synthetic session's worth of DataLogger rows: mostly answers, with the OCR, peek and next events around them.
+    Some answers hold a line break or a quote, as MathPix's LaTeX can.
+    """
+    rng = random.Random(seed)
+    answers = [case for cases in TEST_CASES.values() for case in cases]
+    answers += ['\\begin{array}{l}y=2x\n+3\\end{array}', '"y"=2']
+    rows = []
+    for index in range(events):
+        event_type = rng.choice(('solution', 'solution', 'solution', 'ocr', 'peek', 'next'))
+        if event_type == 'solution':
+            result = {str(rng.randrange(5)): {'correct': rng.random() < 0.7, 'confidence': round(rng.random(), 3),
+                                              'text': rng.choice(answers)}}
+        elif event_type == 'ocr':
+            result = {str(step): {'latency': round(rng.uniform(0.2, 1), 3), 'attempts': 1, 'status': 200,
+                                  'speculative': False} for step in range(5)}
+            result['cache'] = {'hits': index // 4, 'misses': index // 3}
+        else:
+            result = None
+        rows.append(['%.5f' % (index * 1.7), index // 40, event_type, result])
+    return rows
+
+
+def bench_log(number: int):
+    batch = 3  # Rows logged between saves: an answer or two and an ocr event, or a peek and a next
+    with tempfile.TemporaryDirectory() as directory:
+        rewritten, appended = os.path.join(directory, 'rewritten.csv'), os.path.join(directory, 'appended.csv')
+
+        def rewrite(rows):  # What DataLogger.save_data() did
+            with open(rewritten, 'w', encoding='utf-8') as data_file:
+                csv.writer(data_file).writerows(rows)
+
+        rows = _session(3000)
+        rewrite(rows)
+        event_log = EventLog(appended, fsync=None)
+        for start in range(0, len(rows), batch):
+            event_log.write(rows[start:start + batch])
+        event_log.close()
+        with open(rewritten, 'rb') as old, open(appended, 'rb') as new:
+            full = new.read()
+            assert old.read() == full
+        with open(appended, newline='', encoding='utf-8') as data_file:
+            assert list(csv.reader(data_file)) == [['' if value is None else str(value) for value in row]
+                                                   for row in rows]
+
+        # A row cut short anywhere is dropped when the log is opened again, and logging carries on after the last
+        # complete row - including where a quoted field spans lines
+        ends = [0]  # Where each row ends in the file
+        for row in rows:
+            buffer = io.StringIO(newline='')
+            csv.writer(buffer).writerow(row)
+            ends.append(ends[-1] + len(buffer.getvalue().encode('utf-8')))
+        rng = random.Random(0)
+        for cut in rng.sample(range(1, ends[200]), 300) + [ends[5], ends[5] - 1, ends[5] + 1]:
+            with open(appended, 'wb') as data_file:
+                data_file.write(full[:cut])
+            complete = max(i for i, end in enumerate(ends) if end <= cut)
+            event_log = EventLog(appended, fsync=None)
+            assert event_log.recovered == cut - ends[complete]
+            event_log.write(rows[complete:200])
+            event_log.close()
+            with open(appended, 'rb') as data_file:
+                assert data_file.read() == full[:ends[200]]
+
+        timings = []
+        for events in (100, 1000, 10000):
+            rows = _session(events)
+            os.remove(appended)
+            event_log = EventLog(appended, fsync=None)
+            event_log.write(rows[:-batch])
+            tail = rows[-batch:]
+            before = min(repeat(lambda: rewrite(rows), number=max(1, number // 10), repeat=3)) / max(1, number // 10)
+            after = min(repeat(lambda: event_log.write(tail), number=number, repeat=3)) / number
+            event_log.close()
+            event_log = EventLog(appended, fsync=0)
+            synced = min(repeat(lambda: event_log.write(tail), number=max(1, number // 10), repeat=3)) / \
+                max(1, number // 10)
+            event_log.close()
+            timings.append(f'{events} rows: {before * 1000:.2f} ms -> {after * 1000:.3f} ms '
+                           f'({synced * 1000:.2f} ms with an fsync)')
+        written = sum(ends[end] for end in range(batch, len(ends), batch))  # Every save rewrote the whole file
+    print(f'log [save every {batch} rows]: per save, {", ".join(timings)}; a 3000 row session writes '
+          f'{written / 1e6:.1f} MB -> {len(full) / 1e6:.2f} MB')
+
+
+def bench_writer(number: int):
+    rows = _session(3000)
+    with tempfile.TemporaryDirectory() as directory:
+        expected, path = os.path.join(directory, 'expected.csv'), os.path.join(directory, 'written.csv')
+        event_log = EventLog(expected, fsync=None)
+        event_log.write(rows)
+        event_log.close()
+        with open(expected, 'rb') as data_file:
+            full = data_file.read()
+
+        def written():
+            with open(path, 'rb') as data_file:
+                return data_file.read()
+
+        # Nothing is lost or reordered when the queue has to block, or with a backlog
+        writer = EventWriter(path, backlog=rows[:1000], size=10, overflow='block', batch=7)
+        for row in rows[1000:]:
+            writer.put(row)
+        writer.close()
+        assert written() == full and writer.dropped == 0
+        # When it has to drop rows, the ones it keeps are written in order
+        os.remove(path)
+        writer = EventWriter(path, size=10, overflow='drop')
+        kept = [row for row in rows if writer.put(row)]
+        writer.close()
+        dropped = writer.dropped
+        assert dropped == len(rows) - len(kept) and writer.error is None
+        with open(path, newline='', encoding='utf-8') as data_file:
+            assert list(csv.reader(data_file)) == [['' if value is None else str(value) for value in row]
+                                                   for row in kept]
+
+        # A result that can't be written as it is, e.g. a lone surrogate from OCR, costs at most its own row, and the
+        # writer carries on rather than leaving flush() and close() to wait forever
+        class Unprintable:
+            def __repr__(self):
+                raise RuntimeError('no repr')
+            __str__ = __repr__
+
+        for extension in ('.csv', '.bin'):
+            awkward = rows[:20] + [['1.00000', 0, 'solution', '\udcff'], ['2.00000', 0, 'solution', Unprintable()]] + \
+                rows[20:40]
+            writer = EventWriter(os.path.join(directory, f'awkward{extension}'), batch=100)
+            for row in awkward:
+                writer.put(row)
+            assert writer.flush(5) and isinstance(writer.error, RuntimeError)
+            writer.close()
+            logged = list(read_logged(writer.path))
+            assert len(logged) == 41 and logged[20][3] == '\\udcff' and \
+                logged[21:] == list(read_logged(expected))[20:40]
+
+        def handler_latencies(log_row):  # The time a touch handler spends logging each row
+            latencies = []
+            for row in rows[:number * 10]:
+                start = default_timer()
+                log_row(row)
+                latencies.append(default_timer() - start)
+            latencies.sort()
+            return latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100], latencies[-1]
+
+        results = []
+        for name, fsync in (('no fsync', None), ('fsync every row', 0)):
+            os.remove(path)
+            event_log = EventLog(path, fsync=fsync)
+            before = handler_latencies(lambda row: event_log.write([row]))
+            event_log.close()
+            os.remove(path)
+            writer = EventWriter(path, size=len(rows), fsync=fsync)
+            after = handler_latencies(writer.put)
+            writer.close()
+            assert writer.dropped == 0
+            results.append(f'{name}: ' + ' / '.join(f'{b * 1e6:.0f}' for b in before) + ' -> ' +
+                           ' / '.join(f'{a * 1e6:.0f}' for a in after) + ' us')
+    print(f'writer [p50 / p99 / max per logged row, written in place -> queued]: {", ".join(results)}; '
+          f'{dropped} of {len(rows)} rows dropped from a burst into a queue of 10')
+
+
+def bench_format(number: int):
+    batch = 3
+    rows = _session(3000)
+    rows += [['1.00000', -1, 'app-start', None], ['2.50000', 12, 'peek', {'peeking': True, 'score': -300}],
+             ['3.00000', 0, 'custom', {'pair': (1, 2), 1: 'not a string key', 'nested': [{'x': 0.1}, None, 'π']}],
+             ['4.00000', 0, 'custom', (3, 4)], ['5.00000', 0, 'custom', 2.5]]  # Whatever else might be logged
+    with tempfile.TemporaryDirectory() as directory:
+        text, binary = os.path.join(directory, 'data.csv'), os.path.join(directory, 'data.bin')
+
+        def write(event_log):
+            for start in range(0, len(rows), batch):
+                event_log.write(rows[start:start + batch])
+            event_log.close()
+
+        write(EventLog(text, fsync=None))
+        write(BinaryEventLog(binary, fsync=None))
+        with open(text, 'rb') as data_file:
+            csv_data = data_file.read()
+        with open(binary, 'rb') as data_file:
+            binary_data = data_file.read()
+        converted = io.StringIO(newline='')
+        convert([binary], converted)
+        assert converted.getvalue().encode('utf-8') == csv_data  # The converter gives back the CSV, byte for byte
+        assert list(read_rows(binary)) == list(read_rows(text))
+        as_json = io.StringIO()
+        convert([binary], as_json, as_json=True)
+        assert [json.loads(line)['result'] for line in as_json.getvalue().splitlines()][:3000] == \
+            [row[3] for row in rows[:3000]]
+
+        # A record cut short anywhere is dropped when the log is opened again, and logging carries on after it
+        rng = random.Random(0)
+        for cut in rng.sample(range(1, len(binary_data)), 200) + [1, 8]:
+            with open(binary, 'wb') as data_file:
+                data_file.write(binary_data[:cut])
+            event_log = BinaryEventLog(binary, fsync=None)
+            assert event_log.set_aside is None, cut
+            kept = len(list(read_events(binary)))
+            event_log.write(rows[kept:])
+            event_log.close()
+            assert list(read_rows(binary)) == list(read_rows(text))
+
+        # A record garbled early on ends the read there, without the rest of the file being buffered behind it
+        for damage in (b'\x00', b'\xff' * 12, b'\x7f\x00'):
+            garbled = bytearray(binary_data)
+            garbled[1000:1000 + len(damage)] = damage
+            with open(binary, 'wb') as data_file:
+                data_file.write(garbled)
+            tracemalloc.start()
+            kept = sum(1 for _ in read_events(binary))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert kept < 100 and peak < 1 << 18, (damage, kept, peak)
+
+            # ... and opening it moves it aside whole, rather than cutting off every row after the damage
+            event_log = BinaryEventLog(binary, fsync=None)
+            event_log.write(rows[:10])
+            event_log.close()
+            with open(event_log.set_aside, 'rb') as data_file:
+                assert data_file.read() == garbled
+            os.remove(event_log.set_aside)
+            assert event_log.recovered == 0 and list(read_rows(binary)) == list(read_rows(text))[:10]
+        with open(binary, 'wb') as data_file:
+            data_file.write(binary_data)
+
+        timings = {}
+        for name, log_type, path in (('csv', EventLog, text), ('binary', BinaryEventLog, binary)):
+            os.remove(path)
+            event_log = log_type(path, fsync=None)
+            chunks = [rows[start:start + batch] for start in range(0, len(rows), batch)]
+            seconds = min(repeat(lambda: [event_log.write(chunk) for chunk in chunks], number=max(1, number // 10),
+                                 repeat=3)) / max(1, number // 10)
+            event_log.close()
+            timings[name] = seconds
+
+        def read_csv():
+            with open(text, newline='', encoding='utf-8') as data_file:
+                return [literal_eval(row[3]) if row[3] else None for row in csv.reader(data_file)]
+
+        def read_binary():
+            return [row[3] for row in read_events(binary)]
+
+        read_number = max(1, number // 10)
+        read_timings = [min(repeat(read, number=read_number, repeat=3)) / read_number
+                        for read in (read_csv, read_binary)]
+    print(f'format [{len(rows)} rows]: {len(csv_data) / 1000:.0f} kB -> {len(binary_data) / 1000:.0f} kB '
+          f'({len(csv_data) / len(binary_data):.1f}x smaller), written at {len(rows) / timings["csv"] / 1000:.0f}k -> '
+          f'{len(rows) / timings["binary"] / 1000:.0f}k rows/s in saves of {batch}, read back into Python at '
+          f'{len(rows) / read_timings[0] / 1000:.0f}k -> {len(rows) / read_timings[1] / 1000:.0f}k rows/s')
+
+
+def bench_phases(number: int):
+    """
+    Prints a JSON report of how long each phase of grading takes on the corpus and on the stress corpora, along with
+    how many answers pass each phase and how many corpus answers are graded correct, so that a regression in either
+    speed or results shows up as a changed number from one commit to the next.
+    """
+    corpus = []
+    for question, step, answer in _corpus_answers():
+        parser = LatexParser(*question)
+        if step == 2:
+            answer = re.sub(r"x|X", "*", answer)  # As LatexParser.two() does before parsing
+        corpus.append((answer, {'m': parser.m, 'c': parser.c, 'x': question[0], 'y': question[1]}))
+    values = {'m': 2, 'c': 3, 'x': 1, 'y': 5}
+    stress = {f'nested fractions [depth {depth}]': _nested_fractions(depth, 50) for depth in (2, 8, 32)}
+    stress.update((f'long sums [{terms} terms]', _long_sums(terms, 20)) for terms in (10, 100, 1000))
+    stress['ocr noise'] = _ocr_noise(500)
+    report = {
+        'python': platform.python_version(),
+        'number': number,
+        'graded_correct': {'corpus': sum(LatexParser(*question).run(answer, step)
+                                         for question, step, answer in _corpus_answers()),
+                           'fractions': sum(LatexParser(*question).run(answer, step)
+                                            for question, step, answer in _fraction_answers())},
+        'phases': {'corpus': _phases(corpus, number)},
+    }
+    for name, answers in stress.items():
+        report['phases'][name] = _phases([(answer, values) for answer in answers], max(1, number // 10))
+    print(json.dumps(report, indent=2))
+
+
+def bench_buffer(number: int):
+    rows = _session(3000)
+    with tempfile.TemporaryDirectory() as directory:
+        first, second = os.path.join(directory, '0000-data.bin'), os.path.join(directory, '1234-data.bin')
+        # Every row comes back, oldest first, from disk and then from memory, also once the user ID has changed (and
+        # changed back), though each row is only written to the log of the user it was logged under
+        buffer = EventBuffer(size=100, overflow='block', fsync=None)  # A burst this size would overflow the queue
+        buffer.open(first)
+        for row in rows[:1000]:
+            buffer.append(row)
+        assert list(buffer) == rows[:1000] and buffer.tail() == rows[900:1000]
+        switches = []
+        for path, chunk in ((second, rows[1000:2000]), (first, rows[2000:])):
+            buffer.writer.flush()  # As in the app, where the writer has long caught up by the time the user changes
+            start = default_timer()
+            buffer.open(path)
+            switches.append(default_timer() - start)
+            for row in chunk:
+                buffer.append(row)
+        assert list(buffer) == rows and len(buffer) == len(rows)
+        buffer.close()
+        assert list(read_logged(first)) == rows[:1000] + rows[2000:] and list(read_logged(second)) == rows[1000:2000]
+        assert list(buffer) == rows  # The logs can still be read back once they are closed
+
+        # Rows the writer drops are missing from the history once they have left memory, and only then
+        os.remove(second)
+        buffer = EventBuffer(size=100, queue_size=10, fsync=None)
+        buffer.open(second)
+        for row in rows:
+            buffer.append(row)
+        history = list(buffer)
+        buffer.close()
+        dropped = buffer.writer.dropped
+        assert dropped == len(buffer.dropped) and history == [row for index, row in enumerate(rows) if
+                                                              index not in buffer.dropped or index >= len(rows) - 100]
+
+        def retained(container, events):  # The memory a container holds on to once events rows have been logged
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            for start in range(0, events, 1000):
+                for row in _session(min(1000, events - start), start):  # Made in chunks, so only the container keeps them
+                    container.append(row)
+            after = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            return after - before
+
+        events = number * 100
+        memory = retained([], events)
+        os.remove(second)
+        buffer = EventBuffer(overflow='block', fsync=None)
+        buffer.open(second)
+        buffer_memory = retained(buffer, events)
+        start = default_timer()
+        count = sum(1 for _ in buffer)
+        seconds = default_timer() - start
+        buffer.close()
+        assert count == events and buffer.writer.dropped == 0
+    print(f'buffer [{events} rows, {buffer.size} in memory]: {memory / 1e6:.1f} MB in a list -> '
+          f'{buffer_memory / 1e6:.2f} MB, whole history read back at {events / seconds / 1000:.0f}k rows/s; '
+          f'{dropped} of {len(rows)} rows dropped by a queue of 10; changing user took {max(switches) * 1000:.2f} ms')
+
+
+def bench_telemetry(number: int):
+    events = [{'user': '1234', 'time': float(time_log), 'question': question_number, 'event': event_type,
+               'result': result} for time_log, question_number, event_type, result in _session(3000)]
+    fast = {'batch': 100, 'interval': 0.05, 'backoff': 0.005, 'max_backoff': 0.05}  # Retries in ms rather than s
+
+    def deliver(uploader):  # flush() returns when an attempt fails, so is called until everything has been sent
+        deadline = default_timer() + 60
+        while not uploader.flush():
+            assert default_timer() < deadline
+
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = os.path.join(directory, 'telemetry-outbox')
+        # Every event arrives once and in order, however many batches fail or have their response lost
+        server = MockCollectorServer(error_rate=0.3, lose_rate=0.1).start()
+        uploader = TelemetryUploader(server.endpoint, **fast)
+        uploader.use_directory(outbox)
+        latencies = []
+        for event in events:
+            start = default_timer()
+            uploader.put(event)
+            latencies.append(default_timer() - start)
+        deliver(uploader)
+        uploader.close()
+        server.stop()
+        assert server.events == events and not os.listdir(outbox)
+        attempts, duplicates, batches = server.requests, server.duplicates, len(server.batches)
+        raw = sum(len(json.dumps(event, separators=(',', ':'), ensure_ascii=False).encode()) + 1 for event in events)
+        compressed = sum(len(gzip.compress('\n'.join(json.dumps(event, separators=(',', ':'), ensure_ascii=False)
+                                                      for event in batch).encode(), mtime=0))
+                         for batch in server.batches.values())
+        latencies.sort()
+
+        # Offline, batches wait on disk, and a new uploader (the next run of the app) sends them once it is back
+        server = MockCollectorServer()
+        address = server.server_address
+        server.server_close()  # Nothing listening, as if the tablet were offline
+        uploader = TelemetryUploader(server.endpoint, **fast)
+        uploader.use_directory(outbox)
+        for event in events[:1000]:
+            uploader.put(event)
+        assert not uploader.flush()  # Gives up once an attempt has failed, rather than waiting to be back online
+        uploader.close()
+        waiting = len(os.listdir(outbox))
+        assert waiting == 10 and uploader.sent == 0
+        server = MockCollectorServer(address).start()
+        telemetry.ENDPOINT = server.endpoint  # As configured before the app starts, which use_directory() reads
+        uploader = TelemetryUploader(**fast)
+        uploader.use_directory(outbox)
+        telemetry.ENDPOINT = None
+        for event in events[1000:]:
+            uploader.put(event)
+        deliver(uploader)
+        uploader.close()
+        server.stop()
+        assert server.events == events and not os.listdir(outbox)
+    print(f'telemetry [{len(events)} events in batches of {fast["batch"]}]: {raw / 1000:.0f} kB of JSON -> '
+          f'{compressed / 1000:.0f} kB gzipped ({raw / compressed:.1f}x smaller); put() p50 / p99 / max '
+          f'{latencies[len(latencies) // 2] * 1e6:.1f} / {latencies[len(latencies) * 99 // 100] * 1e6:.1f} / '
+          f'{latencies[-1] * 1e6:.0f} us; {attempts} POSTs for {batches} batches against a 30% error rate and 10% lost '
+          f'responses ({duplicates} duplicates dropped by ID), none lost; {waiting} batches kept offline and sent on '
+          f'restart')
+
+
+BENCHMARKS = {
+    'normalise': bench_normalise,
+    'syntax': bench_syntax,
+    'evaluate': bench_evaluate,
+    'points': bench_points,
+    'exact': bench_exact,
+    'cache': bench_cache,
+    'index': bench_index,
+    'scaling': bench_scaling,
+    'client': bench_client,
+    'capture': bench_capture,
+    'strokes': bench_strokes,
+    'ocr': bench_ocr,
+    'async': bench_async,
+    'preprocess': bench_preprocess,
+    'phases': bench_phases,
+    'log': bench_log,
+    'writer': bench_writer,
+    'format': bench_format,
+    'buffer': bench_buffer,
+    'telemetry': bench_telemetry,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"One of {', '.join(BENCHMARKS)} (default: all of them)")
+    parser.add_argument('-n', '--number', type=int, default=50, help='Passes over the corpus per timing run')
+    arguments = parser.parse_args()
+    for unknown in set(arguments.benchmarks) - set(BENCHMARKS):
+        parser.error(f'unknown benchmark {unknown!r}')
+    for benchmark in arguments.benchmarks or BENCHMARKS:
+        BENCHMARKS[benchmark](arguments.number)
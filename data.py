@@ -1,16 +1,16 @@
 from kivy.app import App
-from kivy.network.urlrequest import UrlRequest
-from json import dumps
+from eventlog import EXTENSIONS, EventBuffer
+import eventlog
 from os.path import join
+from telemetry import uploader
 from time import time
-import csv
 
 
 class DataLogger:
 
-    user_id = '0000'
+    _user_id = '0000'
     t0 = time()
-    local_data_packet = []
+    local_data_packet = EventBuffer()  # The latest rows, with the rest of the session read back from the log
     question_number = -1
 
     def __init__(self):
@@ -28,7 +28,7 @@ class DataLogger:
 
         self.pause_time = 0
         self.enter_time = 0
-        
+
     class TimeStamp:
 
         def __init__(self, event_type, *args):
@@ -44,7 +44,12 @@ class DataLogger:
             def wrapper(*args, **kwargs):
                 time_log = "%.5f" % (time() - DataLogger.t0)
                 result = function(*args, **kwargs)
-                DataLogger.local_data_packet.append([time_log, log.question_number, self.event_type, result])
+                row = [time_log, log.question_number, self.event_type, result]
+                if DataLogger.local_data_packet.writer is None:  # The first row of the session
+                    log.on_user_id()
+                DataLogger.local_data_packet.append(row)
+                uploader.put({'user': log.user_id, 'time': float(time_log), 'question': log.question_number,
+                              'event': self.event_type, 'result': result})  # Does nothing unless an ENDPOINT is set
 
                 if self.event_type == 'peek':           # Keeps an internal record on the number of peeks
                     log.current_peeks += 1
@@ -72,11 +77,41 @@ class DataLogger:
 
             return wrapper
 
+    @property
+    def user_id(self):
+        return self._user_id
+
+    @user_id.setter
+    def user_id(self, user_id: str):
+        self._user_id = user_id
+        self.on_user_id()
+
+    def on_user_id(self):
+        """
+        Switches the event log to the current user's file, so that each row is written to the file of the user it was
+        logged under, and only that one.
+        """
+        self.local_data_packet.open(self.data_path())
+
+    def data_path(self):
+        """
+        :return: The path of the current user's event log, {user_id}-data.bin (see eventlog.LOG_FORMAT)
+        """
+        return join(App.get_running_app().user_data_dir, f'{self.user_id}-data{EXTENSIONS[eventlog.LOG_FORMAT]}')
+
     def save_data(self, *args):
-        print(App.get_running_app().user_data_dir)
-        file_path = join(App.get_running_app().user_data_dir, f'{self.user_id}-data.csv')
-        with open(file_path, 'w') as data_file:
-            csv_writer = csv.writer(data_file)
-            csv_writer.writerows(self.local_data_packet)
+        """
+        Rows are written in the background as they are logged (see eventlog.EventBuffer) to the file on_user_id()
+        opened, so this only makes sure a file is open.
+        """
+        if self.local_data_packet.writer is None:
+            self.on_user_id()
+
+    def close(self):
+        """
+        Waits for every row to be written, makes sure they have reached the disk and closes the file. Called when the
+        app stops.
+        """
+        self.local_data_packet.close()
 
 log = DataLogger()
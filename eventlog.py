@@ -0,0 +1,692 @@
+"""
+The file DataLogger writes its events to, without needing Kivy so that it can be benchmarked on its own. Each
+{user_id}-data.csv file is only ever appended to, a few rows at a time, rather than rewritten for every save, so writing
+an event costs the same however long the session has been going. Rows are written whole, so a crash or power cut can at
+most leave the last row half written; EventLog drops it when it opens the file again. EventWriter does the writing on a
+thread of its own, so that logging an event from a touch handler never waits for the disk.
+
+By default the log is kept in a compact binary format (BinaryEventLog), in a {user_id}-data.bin file. Analysts can turn
+it back into the CSV layout, or into JSON lines, with `python eventlog.py convert FILE...`, and read_rows() reads either
+format as if it were CSV.
+"""
+from ast import literal_eval
+from collections import deque
+from itertools import islice
+import argparse
+import csv
+import io
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+FSYNC_INTERVAL = 5.0  # Seconds between fsyncs of the log (see EventLog)
+QUEUE_SIZE = 1000  # Rows EventWriter holds while waiting for the disk
+BATCH_SIZE = 100  # The most rows EventWriter writes at once
+MEMORY_ROWS = 500  # Rows DataLogger keeps in memory (see EventBuffer)
+OVERFLOW = 'drop'  # What EventWriter.put() does when the queue is full: 'drop' the row or 'block' until there's room
+LOG_FORMAT = 'binary'  # How DataLogger stores its events: 'binary' (BinaryEventLog) or 'csv' (EventLog)
+EXTENSIONS = {'binary': '.bin', 'csv': '.csv'}
+MAGIC = b'CCCLOG\x00\x01'  # The start of every binary log: a name and a format version
+
+
+def _complete_length(data: bytes):
+    """
+    :param data: The contents of a CSV file
+    :return: A tuple (length, rows): the length of data up to the end of its last complete row, i.e. the last line
+             ending that isn't inside a quoted field, and how many rows that is
+    """
+    position = length = rows = count = 0
+
+    def lines():
+        nonlocal position
+        pieces = data.split(b'\n')
+        for index, piece in enumerate(pieces):
+            line = piece if index == len(pieces) - 1 else piece + b'\n'
+            if line:
+                position += len(line)
+                yield line.decode('utf-8', 'replace')
+
+    try:
+        for _ in csv.reader(lines()):
+            count += 1
+            if data[position - 1:position] == b'\n':
+                length, rows = position, count
+    except csv.Error:
+        pass  # Anything after the last good row is dropped
+    return length, rows
+
+
+class EventLog:
+    """
+    An open CSV file that rows are appended to, in the format DataLogger has always written (and
+    latex_parser.read_logged_answers reads).
+    """
+
+    def __init__(self, path: str, fsync=FSYNC_INTERVAL):
+        """
+        Opens the file at path for appending, creating it if need be. If the last row in it was cut short, e.g. by the
+        app being killed mid-write, that row is dropped. A file damaged before its end is never cut down: it is moved
+        aside (see set_aside) and a new one is started in its place.
+        :param path: The file to append to
+        :param fsync: How often to make sure rows have reached the disk, not just the OS: None to leave it to the OS,
+                      0 after every write, or a number of seconds to do it at most that often (and when closed)
+        """
+        self.path = path
+        self.fsync = fsync
+        self.recovered = 0  # Bytes of a half-written row dropped when the file was opened
+        self.set_aside = None  # Where the file was moved to if it was damaged before its end
+        self.existing = 0  # Rows already in the file when it was opened, e.g. from earlier sessions
+        self.rows = 0  # Rows written since the file was opened
+        self._file = open(path, 'ab+')
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        self._file.seek(0)
+        length = self._recover(self._file.read())
+        if length is None:
+            self._file.close()
+            self.set_aside = _set_aside(path)
+            self.existing = 0
+            self._file = open(path, 'ab+')
+        elif length < size:
+            self._file.truncate(length)
+            self.recovered = size - length
+        self._synced = time.monotonic()
+
+    def _recover(self, data: bytes):
+        """
+        :param data: What is already in the file
+        :return: How much of it to keep, having counted the rows it holds in self.existing, or None if it is damaged
+                 before its end and has to be set aside
+        """
+        length, self.existing = _complete_length(data)
+        return length
+
+    def _encode(self, rows: list):
+        buffer = io.StringIO(newline='')
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        return buffer.getvalue().encode('utf-8', 'backslashreplace')  # e.g. a lone surrogate from a bad OCR result
+
+    def write(self, rows: list):
+        """
+        Appends rows to the file, each a list of values as for csv.writer, then flushes (and fsyncs, as the policy
+        allows) the file.
+        """
+        data = self._encode(rows)
+        if not data:
+            return
+        self._file.write(data)
+        self._file.flush()
+        self.rows += len(rows)
+        if self.fsync is not None and time.monotonic() - self._synced >= self.fsync:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._synced = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self.fsync is not None:
+            self.sync()
+        self._file.close()
+
+
+# The kinds of record in a binary log, and the tags of the values in an event's result
+_STRING, _EVENT = 0, 1
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _DICT, _LIST, _REPR = range(9)
+_DOUBLE = struct.Struct('<d')
+_BYTES = [bytes([number]) for number in range(0x80)]  # The varints that fit in a byte, which nearly all of them do
+
+
+class _Repr(str):
+    """
+    A value a binary log has no type for, e.g. a tuple, kept as its repr so that it converts back to the same CSV.
+    """
+
+    def __repr__(self):
+        return str(self)
+
+
+def _varint(number: int):
+    """
+    :return: A non-negative integer in 7 bit groups, least significant first, each but the last with its top bit set
+    """
+    if number < 0x80:
+        return _BYTES[number]
+    data = bytearray()
+    while number > 0x7f:
+        data.append(number & 0x7f | 0x80)
+        number >>= 7
+    data.append(number)
+    return data
+
+
+def _read_varint(data, position: int):
+    """
+    :return: A tuple (number, position after it)
+    :raises IndexError: If data ends in the middle of it
+    """
+    number = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+class BinaryEventLog(EventLog):
+    """
+    An EventLog in a compact binary format. After MAGIC, the file is a series of records, each its length (a varint),
+    its body and the CRC-32 of its body (4 bytes, little endian), so that a record cut short or garbled is found and
+    dropped when the file is opened. A body is a kind then its fields:
+    - _STRING: the next string in the file's table, as a varint length and UTF-8. Event types and the keys of results
+      are interned in the table, each defined just before it is first used, so the file describes itself.
+    - _EVENT: the time (a double), the question number (a zigzag varint), the event type (a varint index into the
+      table) and the result as a tagged value: a tag, then nothing for None, True and False, a zigzag varint for an
+      int, a double for a float, a varint length and UTF-8 for a string, a varint count then (key index, value) pairs
+      for a dictionary with string keys, a varint count then values for a list, or for anything else its repr as a
+      string.
+    """
+
+    def __init__(self, path: str, fsync=FSYNC_INTERVAL):
+        self._strings = {}  # Every string in the file's table, and its index
+        super().__init__(path, fsync)
+        if not self._file.seek(0, os.SEEK_END):
+            self._file.write(MAGIC)
+            self._file.flush()
+
+    def write(self, rows: list):
+        strings = dict(self._strings)
+        try:
+            super().write(rows)
+        except Exception:
+            self._strings = strings  # The strings defined in rows may not have reached the file
+            raise
+
+    def _recover(self, data: bytes):
+        if not data.startswith(MAGIC):
+            return 0 if MAGIC.startswith(data) else None  # Not even the header made it to the disk, or not a log
+        length = len(MAGIC)
+        for length, record in _records(data, length):
+            if record[0] == _STRING:
+                self._strings[_decode_string(record, 1)[0]] = len(self._strings)
+            else:
+                self.existing += 1
+        if _resumes(data, length):
+            self._strings = {}
+            return None
+        return length
+
+    def _intern(self, string: str, data: bytearray):
+        """
+        :return: The index of string in the table, writing a record to define it to data if it isn't there yet
+        """
+        index = self._strings.get(string)
+        if index is None:
+            index = self._strings[string] = len(self._strings)
+            encoded = string.encode('utf-8', 'backslashreplace')
+            _frame(bytes([_STRING]) + _varint(len(encoded)) + encoded, data)
+        return index
+
+    def _value(self, value, data: bytearray, body: bytearray):
+        """
+        Adds value to body, with any strings it needs defined in data.
+        """
+        if value is None:
+            body.append(_NONE)
+        elif value is True or value is False:
+            body.append(_TRUE if value else _FALSE)
+        elif type(value) is int:
+            body.append(_INT)
+            body += _varint(value * 2 if value >= 0 else -value * 2 - 1)
+        elif type(value) is float:
+            body.append(_FLOAT)
+            body += _DOUBLE.pack(value)
+        elif type(value) is str:
+            encoded = value.encode('utf-8', 'backslashreplace')
+            body.append(_STR)
+            body += _varint(len(encoded)) + encoded
+        elif type(value) is dict and all(type(key) is str for key in value):
+            body.append(_DICT)
+            body += _varint(len(value))
+            for key, item in value.items():
+                body += _varint(self._intern(key, data))
+                self._value(item, data, body)
+        elif type(value) is list:
+            body.append(_LIST)
+            body += _varint(len(value))
+            for item in value:
+                self._value(item, data, body)
+        else:
+            encoded = repr(value).encode('utf-8', 'backslashreplace')
+            body.append(_REPR)
+            body += _varint(len(encoded)) + encoded
+
+    def _encode(self, rows: list):
+        data = bytearray()
+        for time_log, question_number, event_type, result in rows:
+            body = bytearray([_EVENT])
+            body += _DOUBLE.pack(float(time_log))
+            body += _varint(question_number * 2 if question_number >= 0 else -question_number * 2 - 1)
+            body += _varint(self._intern(event_type, data))
+            self._value(result, data, body)
+            _frame(body, data)
+        return bytes(data)
+
+
+def _frame(body: bytes, data: bytearray):
+    data += _varint(len(body))
+    data += body
+    data += struct.pack('<I', zlib.crc32(body))
+
+
+def _records(data, position: int):
+    """
+    :return: A generator of (position after the record, record body) tuples for every whole, undamaged record in data
+             from position on
+    """
+    while position < len(data):
+        try:
+            length, start = _read_varint(data, position)
+        except IndexError:
+            return
+        end = start + length
+        if not length or end + 4 > len(data):
+            return
+        body = bytes(data[start:end])
+        if struct.unpack('<I', data[end:end + 4])[0] != zlib.crc32(body):
+            return
+        position = end + 4
+        yield position, body
+
+
+def _damaged(data, position: int, remaining: int):
+    """
+    :param remaining: The bytes of the file not yet in data
+    :return: True if the record at position can't be read however much more of the file is read: it is whole but
+             _records() refused it, its length doesn't fit in the rest of the file or the length itself is garbled
+    """
+    try:
+        length, start = _read_varint(data, position)
+    except IndexError:
+        return len(data) - position > 10  # No varint that long is ever written
+    end = start + length + 4
+    return not length or end <= len(data) or end > len(data) + remaining
+
+
+def _resumes(data, position: int):
+    """
+    :return: True if there is a whole, undamaged record anywhere in data after position, i.e. what stopped _records()
+             at position is damage in the middle of the file rather than the end of it cut short
+    """
+    return any(next(_records(data, start), None) is not None for start in range(position + 1, len(data)))
+
+
+def _set_aside(path: str):
+    """
+    Moves a damaged log out of the way, next to where it was, as {path}.damaged (or .damaged1, .damaged2 and so on if
+    one is there already), so that nothing in it is lost.
+    :return: The path it was moved to
+    """
+    aside, number = f'{path}.damaged', 0
+    while os.path.exists(aside):
+        number += 1
+        aside = f'{path}.damaged{number}'
+    os.replace(path, aside)
+    return aside
+
+
+def _decode_string(body: bytes, position: int):
+    length, position = _read_varint(body, position)
+    return body[position:position + length].decode('utf-8'), position + length
+
+
+def _decode_value(body: bytes, position: int, strings: list):
+    """
+    :return: A tuple (value, position after it)
+    """
+    tag = body[position]
+    position += 1
+    if tag in (_NONE, _TRUE, _FALSE):
+        return (None, True, False)[tag], position
+    if tag == _INT:
+        number, position = _read_varint(body, position)
+        return (number >> 1) ^ -(number & 1), position
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(body, position)[0], position + 8
+    if tag in (_STR, _REPR):
+        string, position = _decode_string(body, position)
+        return (string if tag == _STR else _Repr(string)), position
+    count, position = _read_varint(body, position)
+    if tag == _DICT:
+        result = {}
+        for _ in range(count):
+            key, position = _read_varint(body, position)
+            result[strings[key]], position = _decode_value(body, position, strings)
+        return result, position
+    items = []
+    for _ in range(count):
+        item, position = _decode_value(body, position, strings)
+        items.append(item)
+    return items, position
+
+
+def read_events(path: str, chunk_size: int = 1 << 16):
+    """
+    Streams the events out of a binary log, a chunk at a time, stopping at the first record that was cut short or
+    damaged. Nothing after a damaged record is read, so a garbled file never takes more than a chunk and one record.
+    :return: A generator of [time, question_number, event_type, result] lists, time being a float and result what was
+             logged
+    """
+    strings = []
+    with open(path, 'rb') as log_file:
+        if log_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a binary event log')
+        data, position = b'', 0
+        while True:
+            chunk = log_file.read(chunk_size)
+            data = data[position:] + chunk
+            position = 0
+            for position, body in _records(data, 0):
+                if body[0] == _STRING:
+                    strings.append(_decode_string(body, 1)[0])
+                    continue
+                time_log, = _DOUBLE.unpack_from(body, 1)
+                question_number, offset = _read_varint(body, 9)
+                event_type, offset = _read_varint(body, offset)
+                yield [time_log, (question_number >> 1) ^ -(question_number & 1), strings[event_type],
+                       _decode_value(body, offset, strings)[0]]
+            if not chunk or _damaged(data, position, os.fstat(log_file.fileno()).st_size - log_file.tell()):
+                return
+
+
+def read_rows(path: str):
+    """
+    Reads a log in either format as the CSV format is read by csv.reader.
+    :return: A generator of rows, each a list of strings: the time to 5 decimal places, the question number, the event
+             type, and the result as the CSV format holds it ('' for None)
+    """
+    with open(path, 'rb') as log_file:
+        binary = log_file.read(len(MAGIC)) == MAGIC
+    if not binary:
+        with open(path, newline='', encoding='utf-8') as log_file:
+            yield from csv.reader(log_file)
+        return
+    for time_log, question_number, event_type, result in read_events(path):
+        yield ['%.5f' % time_log, str(question_number), event_type, '' if result is None else str(result)]
+
+
+def read_logged(path: str):
+    """
+    Reads a log in either format back into the rows DataLogger logged.
+    :return: A generator of [time, question_number, event_type, result] lists, time being a string to 5 decimal places
+             and result what was logged (or, from a CSV log, its repr if it isn't a literal)
+    """
+    with open(path, 'rb') as log_file:
+        binary = log_file.read(len(MAGIC)) == MAGIC
+    if binary:
+        for time_log, question_number, event_type, result in read_events(path):
+            yield ['%.5f' % time_log, question_number, event_type, result]
+        return
+    for time_log, question_number, event_type, result in read_rows(path):
+        try:
+            result = literal_eval(result) if result else None
+        except (ValueError, SyntaxError):
+            pass
+        yield [time_log, int(question_number), event_type, result]
+
+
+def open_log(path: str, fsync=FSYNC_INTERVAL):
+    """
+    :return: A BinaryEventLog if path ends with EXTENSIONS['binary'], otherwise an EventLog
+    """
+    return (BinaryEventLog if path.endswith(EXTENSIONS['binary']) else EventLog)(path, fsync)
+
+
+class EventWriter:
+    """
+    Appends rows to an EventLog from a thread of its own. put() only queues the row; the thread writes whatever has
+    queued up, in batches of up to BATCH_SIZE rows, as soon as it can.
+    """
+    _CLOSE = object()  # Queued by close() to stop the thread
+
+    def __init__(self, path: str, backlog=(), size=QUEUE_SIZE, overflow=None, batch=BATCH_SIZE,
+                 fsync=FSYNC_INTERVAL):
+        """
+        :param path: The file to append to, which the thread opens (see open_log)
+        :param backlog: Rows to write first, which don't count towards size
+        :param size: How many rows can be queued before overflow applies
+        :param overflow: 'drop' to drop a row put while the queue is full, counting it in dropped, or 'block' to wait
+                         for room - default is OVERFLOW as it is when the writer is created
+        :param batch: The most rows written at once
+        :param fsync: The fsync policy of the EventLog
+        """
+        overflow = OVERFLOW if overflow is None else overflow
+        if overflow not in ('drop', 'block'):
+            raise ValueError(f'unknown overflow policy {overflow!r}')
+        self.path = path
+        self.overflow = overflow
+        self.batch = batch
+        self.dropped = 0  # Rows dropped because the queue was full
+        self.error = None  # The last error writing rows, if there was one: from the disk or a row that can't be written
+        self.existing = 0  # Rows already in the file when the thread opened it
+        self.closed = False
+        self._opened = threading.Event()  # Set once the file is open and the backlog written
+        self._queue = queue.Queue(size)
+        self._thread = threading.Thread(target=self._run, args=(list(backlog), fsync), name='event-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def put(self, row: list):
+        """
+        Queues a row to be written, without waiting for the disk unless the queue is full and overflow is 'block'.
+        :return: False if the row was dropped, which rows put after close() always are
+        """
+        if self.closed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put(row, block=self.overflow == 'block')
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Waits for every row queued so far to be written.
+        :param timeout: The most seconds to wait, or None to wait as long as it takes
+        :return: True if they were all written in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._opened.wait(timeout):
+            return False
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, wait=True):
+        """
+        Writes what is still queued, then closes the file.
+        :param wait: Wait for the thread to finish, rather than leaving it to finish in the background - also when the
+                     writer had already been closed
+        """
+        if not self.closed:
+            self.closed = True
+            self._queue.put(self._CLOSE)  # Waits for room whatever the overflow policy, so the thread always stops
+        if wait:
+            self._thread.join()
+
+    def _run(self, backlog: list, fsync):
+        event_log = None
+        try:
+            event_log = open_log(self.path, fsync)
+            self.existing = event_log.existing
+            event_log.write(backlog)
+        except OSError as error:
+            self.error, event_log = error, None
+        except Exception as error:
+            self.error = error
+            if event_log is not None:
+                self._write_each(event_log, backlog)
+        self._opened.set()
+        closing = False
+        while not closing:
+            rows = [self._queue.get()]
+            while len(rows) < self.batch:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            taken = len(rows)
+            if any(row is self._CLOSE for row in rows):
+                closing = True
+                rows = rows[:next(index for index, row in enumerate(rows) if row is self._CLOSE)]
+            if event_log is not None:
+                try:
+                    event_log.write(rows)
+                except OSError as error:
+                    self.error = error  # Keep draining the queue, so that put() and flush() never hang
+                except Exception as error:
+                    self.error = error
+                    self._write_each(event_log, rows)
+            for _ in range(taken):
+                self._queue.task_done()
+        if event_log is not None:
+            event_log.close()
+
+    def _write_each(self, event_log: EventLog, rows: list):
+        """
+        Writes rows one at a time, after writing them together failed on something other than the disk, e.g. a result
+        whose repr() raises, so that only the rows that can't be written are lost.
+        """
+        for row in rows:
+            try:
+                event_log.write([row])
+            except Exception as error:
+                self.error = error
+
+
+class EventBuffer:
+    """
+    Every row logged in a session, of which only the latest size are kept in memory, in a ring buffer. Every row is
+    handed to an EventWriter as it is logged, so the older ones are on disk, in the logs the writers append to, and
+    iterating over the buffer reads them back from there.
+    """
+
+    def __init__(self, size=MEMORY_ROWS, queue_size=QUEUE_SIZE, **writer_options):
+        """
+        :param size: How many of the latest rows to keep in memory
+        :param queue_size: How many rows each EventWriter may fall behind by (its size)
+        :param writer_options: Other keyword arguments for each EventWriter (see open())
+        """
+        self.size = size
+        self.writer = None  # The EventWriter for the current log, see open()
+        self.dropped = set()  # The index of each row that isn't in any log, because a writer dropped it
+        self._rows = deque(maxlen=size)
+        self._count = 0
+        self._logs = []  # An (EventWriter, index of its first row) tuple for each log written to, in order
+        self._writer_options = dict(writer_options, size=queue_size)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """
+        Reads rows that are no longer in memory back from the logs, having waited for the writers to catch up. Rows
+        that are neither, because a writer dropped them (see EventWriter.put) or they were logged before the first log
+        was opened, are skipped.
+        :return: An iterator over every row logged in the session, oldest first
+        """
+        on_disk = self._count - len(self._rows)  # Rows before this index are only on disk
+        tail = list(self._rows)
+        for number, (writer, first) in enumerate(self._logs):
+            end = min(self._logs[number + 1][1] if number + 1 < len(self._logs) else on_disk, on_disk)
+            written = sum(index not in self.dropped for index in range(first, end))
+            if written:
+                writer.flush()
+                yield from islice(read_logged(writer.path), writer.existing, writer.existing + written)
+        yield from tail
+
+    def tail(self):
+        """
+        :return: A list of the rows in memory, oldest first
+        """
+        return list(self._rows)
+
+    def open(self, path: str):
+        """
+        Makes path the log rows are written to from now on, unless it already is. The old log is closed in the
+        background and keeps the rows logged so far: they aren't copied into the new one.
+        """
+        if self.writer is not None and self.writer.path == path:
+            return
+        if self.writer is not None:
+            self.writer.close(wait=False)
+        for writer, _ in self._logs:
+            if writer.path == path:
+                writer.close()  # Back to an earlier log, which has to be finished with before it is appended to again
+        self.writer = EventWriter(path, **self._writer_options)
+        self._logs.append((self.writer, self._count))
+
+    def append(self, row: list):
+        self._rows.append(row)
+        if self.writer is None or not self.writer.put(row):
+            self.dropped.add(self._count)
+        self._count += 1
+
+    def close(self):
+        """
+        Waits for every row to be written, then closes the log. Rows appended after this are only kept in memory, but
+        the logs can still be read back.
+        """
+        if self.writer is not None:
+            self.writer.close()
+
+
+def convert(files: list, output=sys.stdout, as_json: bool = False):
+    """
+    Writes the rows of each log in files, in either format, to output as CSV in the layout DataLogger has always
+    written, or as JSON lines of {"time", "question", "event", "result"} objects.
+    """
+    writer = csv.writer(output)
+    for file_name in files:
+        if not as_json:
+            writer.writerows(read_rows(file_name))
+            continue
+        with open(file_name, 'rb') as log_file:
+            binary = log_file.read(len(MAGIC)) == MAGIC
+        for time_log, question_number, event_type, result in read_events(file_name) if binary else read_rows(file_name):
+            if not binary:
+                time_log, question_number = float(time_log), int(question_number)
+                try:
+                    result = literal_eval(result) if result else None
+                except (ValueError, SyntaxError):
+                    pass  # Not a literal, so kept as it was written
+            output.write(json.dumps({'time': time_log, 'question': question_number, 'event': event_type,
+                                     'result': result}, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert_parser = commands.add_parser('convert', help='Write event logs to stdout as CSV (or JSON lines)')
+    convert_parser.add_argument('files', nargs='+', metavar='file', help='A {user_id}-data.bin or .csv file')
+    convert_parser.add_argument('--json', action='store_true', help='Write JSON lines rather than CSV')
+    arguments = parser.parse_args()
+    sys.stdout.reconfigure(newline='')  # csv.writer ends its own lines
+    convert(arguments.files, as_json=arguments.json)
@@ -0,0 +1,77 @@
+"""
+Synthetic handwriting, for benchmarks and load tests that need answers like the ones students write without Kivy or a
+touch screen. writing() makes the strokes of a line of writing and scribble() random pen strokes, both as an
+ExpressionWriter records them, and render() draws strokes into pixels as exporting the ExpressionWriter would.
+"""
+import math
+import random
+
+
+def render(lines: list, width: int, height: int, scale: float = 1):
+    """
+    Rasterises pen strokes the way an ExpressionWriter exported at scale draws them: each Line is a band width either
+    side of its points, sampled about every pixel along each segment.
+    :param lines: Strokes as recorded by an ExpressionWriter, in window coordinates with the canvas in the bottom left
+                  corner of the window
+    :return: RGBA pixels, transparent where nothing was drawn, row by row from the top
+    """
+    columns, rows = int(width * scale), int(height * scale)
+    pixels = bytearray(columns * rows * 4)
+    for points, line_width, _ in lines:
+        reach = max(line_width * scale, 0.5)
+        points = [(x * scale, (height - y) * scale) for x, y in zip(points[::2], points[1::2])]
+        for (ax, ay), (bx, by) in zip(points, points[1:] or points):
+            steps = max(int(math.hypot(bx - ax, by - ay)), 1)
+            for step in range(steps + 1):
+                x, y = ax + (bx - ax) * step / steps, ay + (by - ay) * step / steps
+                left, right = max(int(x - reach), 0), min(int(x + reach), columns)
+                for row in range(max(int(y - reach), 0), min(int(y + reach), rows)):
+                    start = (row * columns + left) * 4
+                    pixels[start:start + (right - left) * 4] = b'\x00\x00\x00\xff' * (right - left)
+    return pixels
+
+
+def scribble(width: int, height: int, strokes: int, seed: int = 0):
+    """
+    A synthetic handwritten answer: strokes pen strokes, each a smoothly turning path sampled every three pixels or so
+    (about what a touch screen reports at writing speed) and, like a Line of width 2, four pixels thick. Returned both
+    as the pixels of an exported ExpressionWriter (see render()) and as the strokes the ExpressionWriter recorded.
+    :return: A tuple (pixels, strokes), see imaging.encode_png() and imaging.strokes_payload()
+    """
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(strokes):
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        angle = rng.uniform(0, 2 * math.pi)
+        points = []
+        for _ in range(rng.randint(10, 40)):
+            angle += rng.gauss(0, 0.4)
+            x = min(max(x + 3 * math.cos(angle), 2), width - 3)
+            y = min(max(y + 3 * math.sin(angle), 2), height - 3)
+            points += [round(x, 1), round(height - y, 1)]
+        lines.append((points, 2, True))
+    return render(lines, width, height), lines
+
+
+def writing(width: int, height: int, characters: int, size: float, seed: int = 0):
+    """
+    A synthetic line of writing: characters glyphs of two or three short strokes each, size pixels tall, written left
+    to right from a little way into the canvas, as an answer such as y=2x+3 usually is.
+    :return: The strokes, as recorded by an ExpressionWriter (see render())
+    """
+    rng = random.Random(seed)
+    lines = []
+    left, middle = rng.uniform(10, 40), rng.uniform(size / 2 + 4, height - size / 2 - 4)
+    for character in range(characters):
+        centre = left + (character + 0.5) * size * 0.7
+        for _ in range(rng.randint(2, 3)):
+            x, y = centre + rng.uniform(-size / 4, size / 4), middle + rng.uniform(-size / 2, size / 2)
+            angle = rng.uniform(0, 2 * math.pi)
+            points = []
+            for _ in range(int(size / 6)):
+                angle += rng.gauss(0, 0.4)
+                x = min(max(x + 3 * math.cos(angle), centre - size / 3), centre + size / 3)
+                y = min(max(y + 3 * math.sin(angle), middle - size / 2), middle + size / 2)
+                points += [round(x, 1), round(height - y, 1)]
+            lines.append((points, 2, True))
+    return lines
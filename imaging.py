@@ -0,0 +1,181 @@
+"""
+Image helpers that don't need Kivy, so that they can be benchmarked on their own. encode_png() turns the raw pixels of
+a texture into a PNG in memory, which lets ExpressionWriter send its canvas to MathPix without going through a file.
+Before it is encoded, the image is exported no more than IMAGE_HEIGHT pixels tall (export_scale()), cropped to the
+bounding box of the strokes (stroke_box() and crop()) and reduced to black and white (binarise()), so that MathPix is
+sent a small 1 bit PNG rather than the whole canvas in colour; preprocess() does the last two.
+strokes_payload() turns the lines drawn on an ExpressionWriter into the body of a request to MathPix's /v3/strokes
+endpoint, which is sent instead of an image when widgets.SEND_STROKES is set.
+"""
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+COLOUR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}  # PNG colour type for each number of channels: grey, grey + alpha, RGB, RGBA
+INK = 0  # The grey level binarise() gives the strokes
+PAPER = 255  # ... and everything else
+IMAGE_HEIGHT = 96  # The most pixels tall a preprocessed answer can be
+IMAGE_MARGIN = 8  # Pixels of paper left around the strokes when cropping
+
+# str.translate() tables for binarise() and for packing 1 bit rows
+_DARK = bytes(255 if value < 128 else 0 for value in range(256))
+_OPAQUE = bytes(255 if value >= 128 else 0 for value in range(256))
+_BITS = bytes(ord('0') if value < 128 else ord('1') for value in range(256))
+
+
+def _chunk(chunk_type: bytes, data: bytes):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _pack_bits(row):
+    """
+    :return: A row of 8 bit grey pixels as a row of 1 bit pixels (dark to 0, light to 1), padded to a whole byte
+    """
+    padding = -len(row) % 8
+    return (int(bytes(row).translate(_BITS), 2) << padding).to_bytes((len(row) + padding) // 8, 'big')
+
+
+def encode_png(pixels, width: int, height: int, channels: int = 4, level: int = 6, bit_depth: int = 8):
+    """
+    Encodes pixels as a PNG. Rows are stored unfiltered: the canvas is mostly blank, which zlib compresses well enough
+    on its own, and filtering in Python would cost more than it saves.
+    :param pixels: The pixels as bytes (or any bytes-like object), 8 bits a channel, row by row from the top, e.g.
+                   Texture.pixels of an image from Widget.export_as_image()
+    :param width: The width of the image in pixels
+    :param height: The height of the image in pixels
+    :param channels: The number of bytes per pixel - 4 for RGBA (the default), 3 for RGB, 2 for grey and alpha, 1 for
+                     grey
+    :param level: The zlib compression level
+    :param bit_depth: 8, or 1 to store grey pixels (channels=1) as black and white, 8 to a byte
+    :return: The PNG file, as bytes
+    :raises ValueError: If pixels isn't width * height * channels bytes long, or a bit depth of 1 isn't for grey
+    """
+    stride = width * channels
+    if len(pixels) != stride * height:
+        raise ValueError(f'expected {stride * height} bytes of pixels, got {len(pixels)}')
+    if bit_depth == 1 and channels != 1:
+        raise ValueError('only grey pixels can be stored 1 bit deep')
+    view = memoryview(pixels)
+    rows = (view[row:row + stride] for row in range(0, stride * height, stride))
+    raw = b'\x00'.join(map(_pack_bits, rows) if bit_depth == 1 else rows)
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, COLOUR_TYPES[channels], 0, 0, 0)
+    return PNG_SIGNATURE + _chunk(b'IHDR', header) + _chunk(b'IDAT', zlib.compress(b'\x00' + raw, level)) + \
+        _chunk(b'IEND', b'')
+
+
+def stroke_box(strokes: list, left: float, top: float, margin: float):
+    """
+    The bounding box of every pen stroke, in pixels from the top left of the canvas. A Line is drawn width either side
+    of its points, so that is added to the margin.
+    :param strokes: A list of (points, width, pen) tuples, see strokes_payload()
+    :param left: The x coordinate of the left hand side of the canvas, in window coordinates
+    :param top: The y coordinate of the top of the canvas, in window coordinates
+    :param margin: Pixels of paper to leave around the strokes
+    :return: A (left, top, right, bottom) tuple, which may reach past the canvas, or None if nothing has been drawn
+    """
+    boxes = [(min(points[::2]) - width, max(points[1::2]) + width, max(points[::2]) + width, min(points[1::2]) - width)
+             for points, width, pen in strokes if pen and points]
+    if not boxes:
+        return None
+    x_min, y_max, x_max, y_min = (function(box[i] for box in boxes) for i, function in enumerate((min, max, max, min)))
+    return x_min - left - margin, top - y_max - margin, x_max - left + margin, top - y_min + margin
+
+
+def crop(pixels, width: int, height: int, box: tuple, channels: int = 4):
+    """
+    :param pixels: The pixels, row by row from the top, as in encode_png()
+    :param box: A (left, top, right, bottom) tuple in pixels from the top left, which is clipped to the image and
+                rounded outwards
+    :return: A tuple (pixels, width, height) of the part of the image inside box
+    """
+    left, top = max(int(box[0]), 0), max(int(box[1]), 0)
+    right, bottom = min(-int(-box[2] // 1), width), min(-int(-box[3] // 1), height)
+    right, bottom = max(right, left), max(bottom, top)
+    view = memoryview(pixels)
+    stride = width * channels
+    cropped = b''.join(view[row * stride + left * channels:row * stride + right * channels]
+                       for row in range(top, bottom))
+    return cropped, right - left, bottom - top
+
+
+def binarise(pixels):
+    """
+    Reduces an exported ExpressionWriter to black and white. The canvas is transparent where nothing was drawn, the pen
+    is black and the eraser white, so ink is any pixel that is both dark and opaque.
+    :param pixels: RGBA pixels
+    :return: One byte of grey per pixel: INK for the strokes and PAPER everywhere else
+    """
+    pixels = bytes(pixels)
+    size = len(pixels) // 4
+    dark = int.from_bytes(pixels[0::4].translate(_DARK), 'big')  # 255 wherever the red channel is dark
+    opaque = int.from_bytes(pixels[3::4].translate(_OPAQUE), 'big')  # 255 wherever the alpha channel is opaque
+    ink = (dark & opaque).to_bytes(size, 'big')
+    return ink.translate(bytes(PAPER if value == 0 else INK for value in range(256)))
+
+
+def export_scale(box: tuple, height: int = IMAGE_HEIGHT):
+    """
+    :param box: The stroke_box() of an answer
+    :return: The scale to export the canvas at so that the box, once cropped, is no more than height pixels tall
+    """
+    return min(1, (height - 1) / (box[3] - box[1]))  # Less a pixel, as crop() rounds the box outwards
+
+
+def preprocess(pixels, width: int, height: int, box: tuple, scale: float):
+    """
+    Crops a canvas exported at scale to box and reduces it to a 1 bit black and white PNG.
+    :param pixels: The RGBA pixels of the export, width by height
+    :param box: The stroke_box() of the strokes, at a scale of 1
+    :return: The PNG
+    """
+    cropped, columns, rows = crop(pixels, width, height, [side * scale for side in box])
+    return encode_png(binarise(cropped), columns, rows, channels=1, bit_depth=1)
+
+
+def _erased(x: float, y: float, eraser: list, reach: float):
+    """
+    :return: True if (x, y) is within reach of any segment of eraser, a list of (x, y) points
+    """
+    for (ax, ay), (bx, by) in zip(eraser, eraser[1:] or eraser):
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        t = 0 if length == 0 else min(max(((x - ax) * dx + (y - ay) * dy) / length, 0), 1)
+        if (x - ax - t * dx) ** 2 + (y - ay - t * dy) ** 2 <= reach * reach:
+            return True
+    return False
+
+
+def strokes_payload(strokes: list, left: float, top: float):
+    """
+    Serialises the lines drawn on an ExpressionWriter into MathPix's strokes format. Eraser strokes are dropped, along
+    with every part of an earlier pen stroke they rubbed out (a Line is drawn width either side of its points, so an
+    eraser reaches width from its points); a pen stroke the eraser cuts through is split in two.
+    :param strokes: A list of (points, width, pen) tuples in the order they were drawn, where points is the flat list
+                    [x0, y0, x1, y1, ...] of a Line, width its width, and pen False for eraser strokes
+    :param left: The x coordinate of the left hand side of the canvas, in window coordinates
+    :param top: The y coordinate of the top of the canvas, in window coordinates (MathPix measures y downwards)
+    :return: A dictionary to send as JSON to the /v3/strokes endpoint
+    """
+    ink = []  # Each pen stroke that is still (partly) visible, as a list of (x, y) points
+    for points, width, pen in strokes:
+        points = list(zip(points[::2], points[1::2]))
+        if pen:
+            ink.append(points)
+            continue
+        x_min, x_max = min(x for x, _ in points) - width, max(x for x, _ in points) + width
+        y_min, y_max = min(y for _, y in points) - width, max(y for _, y in points) + width
+        visible = []
+        for stroke in ink:
+            piece = []
+            for x, y in stroke:
+                if x_min <= x <= x_max and y_min <= y <= y_max and _erased(x, y, points, width):
+                    if piece:
+                        visible.append(piece)
+                    piece = []
+                else:
+                    piece.append((x, y))
+            if piece:
+                visible.append(piece)
+        ink = visible
+    return {'strokes': {'strokes': {'x': [[round(x - left) for x, _ in stroke] for stroke in ink],
+                                    'y': [[round(top - y) for _, y in stroke] for stroke in ink]}}}
@@ -1,5 +1,14 @@
+from ast import literal_eval
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from eventlog import read_rows
+from fractions import Fraction
+from functools import lru_cache
+import argparse
+import csv
+import operator
 import re
+import sys
 
 re_patterns = {
     r'\\frac{([^}]+)}{([^}]+)}': r'((\1)/(\2))',
@@ -15,77 +24,151 @@ re_patterns = {
     r'\]|\[|l|\\mid': '1'
 }
 
+# re_patterns compiled into the stages _convert_latex actually runs. Keep these in sync with re_patterns above - the
+# benchmark in benchmarks.py checks both produce identical output before timing anything.
+_FRACTION = re.compile(r'\\frac{([^}]+)}{([^}]+)}')
+_COMMANDS = {'\\alpha': '*', '\\rho': '9', '\\mid': '1'}
+_COMMAND_PATTERN = re.compile('|'.join(re.escape(command) for command in _COMMANDS))
+_CHARACTERS = str.maketrans({'×': '*', 's': '5', 'S': '5', 'b': '6', 'g': '9', 'q': '9', 't': '+', 'L': 'c',
+                             ']': '1', '[': '1', 'l': '1', ' ': None})
+
 
 def _convert_latex(exp: str):
     """
     LaTeX formatted string (exp) and returns an operable expression. For example "\frac{7}{5+y}" returns
-    "((7)/(5+y))". It does by iterating over the items in self.re_patterns, where the keys are regex patterns, and
-    the values are strings which should replace the patterns.
+    "((7)/(5+y))". The rules in re_patterns are applied in order, but instead of one re.sub per rule they are grouped
+    into precompiled stages: \frac first, then the \times, \left and \right literals, then a single alternation over the
+    remaining backslash commands, and finally one str.translate for every single character rule (plus whitespace).
+    The grouping is safe because no rule produces text that an earlier rule in the same stage would have matched.
     :param exp: A LaTeX formatted string
     :return: An interoperable string (with white-space removed)
     """
-    for pattern, replace in re_patterns.items():
-        exp = re.sub(pattern, replace, exp)
-    exp = exp.replace(" ", "")  # Remove any remaining whitespace
-    return exp.lower()  # Lowercase all values in the expression
+    if '\\' in exp:  # Typed answers never contain a backslash, so they skip straight to the character rules
+        if '\\frac' in exp:
+            exp = _FRACTION.sub(r'((\1)/(\2))', exp)
+        exp = exp.replace('\\times', '*').replace('\\left', '').replace('\\right', '')
+        exp = _COMMAND_PATTERN.sub(lambda match: _COMMANDS[match.group()], exp)
+    return exp.translate(_CHARACTERS).lower()  # Lowercase all values in the expression
+
+
+# Character classes for _syntactic_analysis(). Every character the legacy rules tell apart gets its own class: '*' and
+# '/' are always treated alike, as are the digits 0-9, but other unicode numerals (² ½ 一...) only pass isnumeric() and
+# some of them pass isalpha() as well.
+_OPEN, _CLOSE, _EQUALS, _PLUS, _MINUS, _TIMES, _DIGIT, _NUMERAL, _LETTER_NUMERAL, _VARIABLE, _LETTER, _OTHER = range(12)
+_CLASSES = 12
+_OPERATORS = (_PLUS, _MINUS, _TIMES)
+_NUMERALS = (_DIGIT, _NUMERAL, _LETTER_NUMERAL)
+
+
+def _character_class(character: str):
+    """
+    :return: The class of a single character, as used by _syntactic_analysis()
+    """
+    if character in '()=+-*/':
+        return (_OPEN, _CLOSE, _EQUALS, _PLUS, _MINUS, _TIMES, _TIMES)['()=+-*/'.index(character)]
+    elif character.isnumeric():
+        if character in '0123456789':
+            return _DIGIT
+        return _LETTER_NUMERAL if character.isalpha() else _NUMERAL
+    elif character.isalpha():
+        return _VARIABLE if character in 'ymxc' else _LETTER
+    return _OTHER
+
+
+class _CharacterClasses(dict):
+    """
+    A str.translate() table from a character to its class. ASCII is precomputed, anything else is classified on the
+    fly (and not stored, so that stray unicode can't grow the table).
+    """
+    def __missing__(self, ordinal: int):
+        return _character_class(chr(ordinal))
+
+
+_CHARACTER_CLASSES = _CharacterClasses((ordinal, _character_class(chr(ordinal))) for ordinal in range(128))
+
+
+def _accepts(position: int, previous, before_previous, current: int):
+    """
+    The rules of _syntactic_analysis(), written over character classes instead of characters. Brackets are checked
+    separately since a finite table can't count them.
+    :param position: The index of the current character, with everything past 3 counted as 3 (nothing looks further
+                     back than two characters, and only from index 3 on)
+    :param previous: The class of the previous character, or None at the start of the string
+    :param before_previous: The class of the character before that, or None
+    :param current: The class of the current character
+    :return: False if the current character makes the expression invalid, True otherwise
+    """
+    if current == _CLOSE:
+        return previous not in _OPERATORS  # +) /) ×)
+    elif current == _TIMES:
+        return position != 0 and previous not in (_PLUS, _MINUS, _TIMES, _EQUALS)  # /+ /- // /× =/ ×+ ×- ×/ ×× =×
+    elif current == _PLUS:
+        if previous in (_PLUS, _TIMES, _EQUALS):  # ++ ×+ /+ =+
+            return False
+        return not (position == 3 and previous == _MINUS and before_previous not in _NUMERALS)  # +-+ --+ (-+ etc.
+    elif current == _MINUS:  # +-- --- -+- ++- (-- *-- *+- /-- etc.
+        return not (position == 3 and previous in _OPERATORS and before_previous not in (_DIGIT, _VARIABLE))
+    elif current == _EQUALS:
+        return previous not in (_PLUS, _MINUS, _TIMES, _EQUALS)  # /= -= ×= += ==
+    elif current in _NUMERALS:
+        return previous not in (_VARIABLE, _LETTER_NUMERAL, _LETTER)  # Prevents a2
+    return current != _LETTER  # A safety net in case the user adds other characters
+
+
+def _build_transitions():
+    """
+    Builds the transition table of _syntactic_analysis() from _accepts(). A state is the position (as _accepts() counts
+    it) together with the classes of the last two characters. States are numbered so that the rejecting state is 0 and
+    every state reached by reading a bracket or an equals sign (the characters that have to check the bracket depth)
+    comes before the rest, and each number is premultiplied by the number of classes so that the next state is
+    table[state + class].
+    :return: The table, the start state and the first state not reached by a bracket or an equals sign
+    """
+    states = [(0, None, None)] + [(1, previous, None) for previous in range(_CLASSES)] + \
+             [(position, previous, before_previous) for position in (2, 3) for previous in range(_CLASSES)
+              for before_previous in range(_CLASSES)]
+    states.sort(key=lambda state: state[1] not in (_OPEN, _CLOSE, _EQUALS))
+    numbers = {state: (number + 1) * _CLASSES for number, state in enumerate(states)}
+    table = [0] * _CLASSES  # The rejecting state goes nowhere
+    for position, previous, before_previous in states:
+        for current in range(_CLASSES):
+            if _accepts(position, previous, before_previous, current):
+                table.append(numbers[min(position + 1, 3), current, previous if position else None])
+            else:
+                table.append(0)
+    plain = min(number for state, number in numbers.items() if state[1] not in (_OPEN, _CLOSE, _EQUALS))
+    return table, numbers[0, None, None], plain
+
+
+_TRANSITIONS, _START, _PLAIN = _build_transitions()
 
 
 def _syntactic_analysis(exp: str):
     """
     During syntactic analysis (parsing), the sequence of interoperable string produced by the self.convert_latex is
     examined whether or not it is a mathematically meaningful statement. For example ((2-1+) is NOT meaningful,
-    whereas (2-1) is.
+    whereas (2-1) is. The string is translated into character classes in one go, then run through a transition table
+    built from the rules in _accepts(), so each character costs a single lookup. Only brackets and equals signs go on
+    to check the bracket depth.
     :param exp: An interoperable string (as formatted by the convert_latex() method)
     :return: True if the syntax is correct, False otherwise
     """
-    stack = []  # Checks whether the brackets in the expression are correct
-    for i, char in enumerate(exp):
-        if char == '(':
-            stack.append(char)
-        elif char == ')':
-            if len(stack) == 0:
-                return False  # Prevents )() and other such issues
-            elif exp[i - 1] == '+' or exp[i - 1] == '/' or exp[i - 1] == '*' or exp[i - 1] == '-':
-                return False  # +) /) ×)
-            stack.pop()
-            continue
-        elif char == '/' or char == '*':
-            if i == 0:
-                return False
-            elif exp[i - 1] == '+' or exp[i - 1] == '/' or exp[i - 1] == '*' or exp[i - 1] == '-' or exp[i - 1] == '=':
-                return False  # /+ /- // /× =/ ×+ ×- ×/ ×× =×
-        elif char == '+':
-            if i == 0:  # Expression that starts with a plus is allowed
-                continue
-            elif exp[i - 1] == '+' or exp[i - 1] == '*' or exp[i - 1] == '/' or exp[i - 1] == '=':  # ++ ×+ /+ =+
+    state = _START
+    depth = 0  # Checks whether the brackets in the expression are correct
+    for character_class in exp.translate(_CHARACTER_CLASSES).encode():
+        state = _TRANSITIONS[state + character_class]
+        if state < _PLAIN:  # Either rejected, or the character was a bracket or an equals sign
+            if not state:
                 return False
-            elif i > 2:
-                if exp[i - 1] == '-' and not exp[i - 2].isnumeric():  # +-+ --+ +++ -++ (-+ etc.
-                    return False
-        elif char == '-':
-            if i == 0:  # Expression that starts with -- is allowed
-                continue
-            elif i > 2:
-                if (exp[i - 1] == '+' or exp[i - 1] == '-' or exp[i - 1] == '*' or exp[i - 1] == '/') \
-                        and (not exp[i - 2] in 'mxcy0123456789'):  # +-- --- -+- ++- (-- *-- *+- /-- etc.
-                    return False
-        elif char == '=':
-            if i == 0:
-                continue  # Expression that starts with = is allowed
-            elif exp[i - 1] == '+' or exp[i - 1] == '/' or exp[i - 1] == '*' or exp[i - 1] == '-' or exp[i - 1] == '=':
-                return False  # /= -= ×= += ==
-            elif len(stack) > 0:
+            elif character_class == _OPEN:
+                depth += 1
+            elif character_class == _CLOSE:
+                if not depth:
+                    return False  # Prevents )() and other such issues
+                depth -= 1
+            elif depth:
                 return False  # Prevents (x = c) = 4
-        elif char.isnumeric():
-            if i == 0:
-                continue
-            if exp[i - 1].isalpha():
-                return False  # Prevents a2
-        elif char.isalpha() and char not in 'ymxc':
-            return False  # Not all that useful but acts as a safety net if user attempts to add other characters
-    if len(stack) > 0:
-        return False  # Prevents (() and other errors with opening and closing brackets
-    return True
+    return not depth  # Prevents (() and other errors with opening and closing brackets
 
 
 def _lexical_analysis(exp: str):
@@ -180,16 +263,236 @@ def _contains_number(user_input: str):
     return False
 
 
+# Operator precedence used by the evaluator: multiplication, division, addition, then subtraction (so 8/2*2 is 8/(2*2)
+# and 5-2+1 is 5-(2+1)). Operators of equal precedence are evaluated left to right.
+_PRECEDENCE = {'-': 1, '+': 2, '/': 3, '*': 4}
+_OPERATIONS = {'-': operator.sub, '+': operator.add, '/': operator.truediv, '*': operator.mul}
+_NEGATE = 'neg'  # Unary minus, e.g. the minus in -(2). Binds tighter than any binary operator
+VARIABLES = ('m', 'c', 'x', 'y')
+
+# Points checked by LatexParser.one() and LatexParser.four(), as multiples of (x2 - x1, y2 - y1) added to (x1, y1). The
+# first two are the coordinates given in the question; the others are further points on the same line (with integer
+# coordinates) that catch answers which only happen to pass through the two given points. An answer that divides by
+# zero at one of the further points, such as (y-3)/(x)=2 at x=0, is not checked there.
+SAMPLE_POINTS = (0, 1, -1, 2)
+
+
+def _divide(dividend, divisor):
+    """
+    Exact division. Stays on plain ints when the divisor goes into the dividend, otherwise returns a Fraction.
+    :return: The quotient, as an int if it is a whole number
+    :raises ZeroDivisionError: If divisor is 0
+    """
+    if dividend.__class__ is int and divisor.__class__ is int:
+        quotient, remainder = divmod(dividend, divisor)
+        return quotient if remainder == 0 else Fraction(dividend, divisor)
+    quotient = Fraction(dividend) / divisor
+    return quotient.numerator if quotient.denominator == 1 else quotient
+
+
+# The same operations with exact arithmetic: integers stay integers and division produces a Fraction only when the
+# result isn't a whole number, so the common integer questions never pay for Fraction.
+_EXACT_OPERATIONS = dict(_OPERATIONS, **{'/': _divide})
+
+
+def _to_rpn(exp: list, number=float):
+    """
+    Uses the shunting-yard algorithm to convert a tokenized expression into reverse Polish notation in a single pass.
+    For example ['2', '*', '(', 'x', '+', '4', ')'] returns [2.0, 'x', 4.0, '+', '*'].
+    :param exp: A list of tokenized statements (see _lexical_analysis() for more details)
+    :param number: The type operands are converted to - float, or int for exact arithmetic
+    :return: A list of operands (as numbers, apart from variables) and operators in reverse Polish notation, or None if
+             the expression is blank or is not well formed (mismatched brackets, a missing operand, an operand that is
+             not a number or two operands with no operator between them). The recursive evaluator this replaced
+             accepted some of these: it left juxtaposed operands unreduced, so (2)((1)) counted as its first value 2,
+             and _check_solution skipped a side such as a lone - that didn't reduce to a number at all
+    """
+    output = []
+    operators = []
+    expect_operand = True  # True at the start of the expression, after an operator and after an open bracket
+    for token in exp:
+        if token == '(':
+            if not expect_operand:
+                return None  # Prevents 2(3)
+            operators.append(token)
+        elif token == ')':
+            if expect_operand:
+                return None  # Prevents () and (2+)
+            while operators and operators[-1] != '(':
+                output.append(operators.pop())
+            if not operators:
+                return None  # Prevents 2)
+            operators.pop()
+        elif token in _PRECEDENCE:
+            if expect_operand:
+                if token == '-':
+                    operators.append(_NEGATE)
+                elif token != '+':  # A unary plus does nothing
+                    return None
+                continue
+            precedence = _PRECEDENCE[token]
+            while operators and operators[-1] != '(' and \
+                    (operators[-1] == _NEGATE or _PRECEDENCE[operators[-1]] >= precedence):
+                output.append(operators.pop())
+            operators.append(token)
+            expect_operand = True
+        else:
+            if not expect_operand:
+                return None  # Prevents (2)3
+            if token in VARIABLES:
+                output.append(token)
+            else:
+                try:
+                    output.append(number(token))
+                except ValueError:
+                    return None  # An operand that isn't a number, e.g. '--3'
+            expect_operand = False
+    if expect_operand or '(' in operators:
+        return None  # Blank expression, trailing operator or an unclosed bracket
+    output.extend(reversed(operators))
+    return output
+
+
+class Expression:
+    """
+    One side of an answer, compiled once into reverse Polish notation. Numbers are converted when the expression is
+    compiled and variables (m, c, x and y) are left as slots, so the same answer can be evaluated at any number of
+    points without re-tokenizing it or copying the token list.
+    """
+    __slots__ = ('rpn', 'operations')
+
+    def __init__(self, exp: list, exact: bool = False):
+        """
+        :param exp: A list of tokenized statements (see _lexical_analysis() for more details)
+        :param exact: True to evaluate with ints and Fractions (see _divide() for more details) instead of floats
+        """
+        self.rpn = _to_rpn(exp, int if exact else float)
+        self.operations = _EXACT_OPERATIONS if exact else _OPERATIONS
+
+    def evaluate(self, values: dict = None, undefined=False):
+        """
+        Evaluates the expression with a stack, so it takes a single pass with no recursion.
+        :param values: A dictionary whose keys are the variables and values are the numbers to substitute for them
+        :param undefined: What to return if there was a ZeroDivisionError - default is False
+        :return: False if the expression is blank or malformed or a variable has no value, undefined if there was a
+                 ZeroDivisionError, otherwise it returns the evaluated expression
+        """
+        if self.rpn is None:
+            return False
+        if values is None:
+            values = {}
+        operations = self.operations
+        stack = []
+        try:
+            for token in self.rpn:
+                if token.__class__ is not str:  # A number
+                    stack.append(token)
+                elif token in operations:
+                    right = stack.pop()
+                    stack[-1] = operations[token](stack[-1], right)
+                elif token == _NEGATE:
+                    stack[-1] = -stack[-1]
+                else:  # A variable
+                    stack.append(values[token])
+        except ZeroDivisionError:
+            return undefined
+        except KeyError:
+            return False
+        return stack[0]
+
+
+# The coordinates of the two points in each question, in the order the app asks them (see widgets.MODEL for the model
+# answers)
+COORDINATES = (
+    (1, 5, 2, 7),
+    (2, 11, 13, 22),
+    (3, 4, 5, 20),
+    (4, 13, 1, -5),
+    (-3, 22, 1, 2),
+    (3, -11, -2, 9),
+    (5, 133, 2, 58),
+    (-1, -4, 8, 23),
+    (4, -17, -2, 31),
+    (4, 11, -2, -13),
+    (2, -16, -3, 19),
+    (-8, -2, -4, -6),
+    (-4, -40, -6, -62),
+    (-1, -7, 19, 133),
+    (14, 5, 6, 5),
+    (77, -3, 41, -3),
+    (2, 5, 10, 9),
+    (3, -7, 27, 1),
+    (-1, 1, 7, 5),
+    (40, 10, 20, 5),
+)
+
+
+PARSE_CACHE_SIZE = 4096  # Number of tokenized answers kept by _tokenize()
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _tokenize(exp: str, two: bool = False):
+    """
+    Takes an answer from raw text to tokens: converts it to an interoperable string, checks its syntax, adjusts the
+    coefficients and splits it into tokens. Students submit the same answers over and over, so results are kept in a
+    bounded LRU cache keyed on the raw text (see parse_cache_info() for the hit and miss counts). Tokens are returned
+    as tuples so that nothing can alter a cached entry.
+    :param exp: The answer as it was submitted
+    :param two: True for LatexParser.two(), where x is a multiplication sign rather than a variable
+    :return: A tuple of tuples, with each tuple being an expression (see _lexical_analysis()), or None if the answer is
+             not mathematically valid
+    """
+    if two:
+        exp = re.sub(r"x|X", "*", exp)
+    exp = _convert_latex(exp)  # Convert to a interoperable string
+    if not _syntactic_analysis(exp):  # Check if string is mathematically valid
+        return None
+    for variable in ('x', 'y'):  # Adjust the coefficients (i.e. Nx --> N * x)
+        exp = _adjust_coefficient(exp, variable)
+    return tuple(tuple(expression) for expression in _lexical_analysis(exp))
+
+
+def parse_cache_info():
+    """
+    :return: The hits, misses, maxsize and currsize of the _tokenize() cache, as a functools _CacheInfo named tuple.
+             Call _tokenize.cache_clear() after changing re_patterns.
+    """
+    return _tokenize.cache_info()
+
+
+# The steps LatexParser keeps an index of known correct answers for (see LatexParser.canonical_answers()), with the
+# number of answers each one has accepted by lookup (hits) and passed on to be evaluated in full (misses)
+STEPS = ('zero', 'one', 'two', 'three', 'four')
+_index_hits = Counter()
+_index_misses = Counter()
+
+
+def answer_index_info():
+    """
+    :return: A dictionary of (hits, misses) tuples keyed by step, counted across every LatexParser in this process.
+             A hit is a correct answer accepted straight from the parser's index, a miss is any other valid answer.
+    """
+    return {step: (_index_hits[step], _index_misses[step]) for step in STEPS}
+
+
 def parse(function):
+    step = function.__name__
+    indexed = step in STEPS
+
     def wrapper(self, exp, *args, **kwargs):
-        if function.__name__ == 'two':
-            exp = re.sub(r"x|X", "*", exp)
-        exp = _convert_latex(exp)  # Convert to a interoperable string
-        if not _syntactic_analysis(exp):  # Check if string is mathematically valid
+        exp = _tokenize(exp, step == 'two')
+        if exp is None:
             return False
-        for variable in ('x', 'y'):  # Adjust the coefficients (i.e. Nx --> N * x)
-            exp = _adjust_coefficient(exp, variable)
-        exp = _lexical_analysis(exp)
+        if indexed:
+            index = self.index.get(step)
+            if index is None:  # Built on first use, with every canonical answer checked by the step itself
+                answers = (_tokenize(answer, step == 'two') for answer in self.canonical_answers()[STEPS.index(step)])
+                index = self.index[step] = frozenset(answer for answer in answers
+                                                     if answer is not None and function(self, answer))
+            if exp in index:
+                _index_hits[step] += 1
+                return True
+            _index_misses[step] += 1
         return function(self, exp, *args, **kwargs)
 
     return wrapper
@@ -197,118 +500,127 @@ def parse(function):
 
 class LatexParser:
 
-    def __init__(self, x1, y1, x2, y2):
+    def __init__(self, x1, y1, x2, y2, exact=True):
+        """
+        :param exact: True to grade with exact arithmetic, so m, c and every answer are kept as ints or Fractions end
+                      to end. False grades with floats, which makes answers such as (1/3) depend on rounding.
+        """
         self.x1 = x1
         self.y1 = y1
         self.x2 = x2
         self.y2 = y2
-        self.m = float((y2 - y1) / (x2 - x1))
-        self.c = float(y1 - (self.m * x1))
+        self.exact = exact
+        if exact:
+            self.m = _divide(y2 - y1, x2 - x1)
+            self.c = _divide(y1 * (x2 - x1) - (y2 - y1) * x1, x2 - x1)
+            self.points = [(x1 + k * (x2 - x1), y1 + k * (y2 - y1)) for k in SAMPLE_POINTS]
+        else:
+            self.m = float((y2 - y1) / (x2 - x1))
+            self.c = float(y1 - (self.m * x1))
+            self.points = [(float(x1 + k * (x2 - x1)), float(y1 + k * (y2 - y1))) for k in SAMPLE_POINTS]
+        self.index = {}  # Tokenized correct answers keyed by step, so that common answers are accepted with a lookup
 
-    def _evaluate_expression(self, exp: list):
+    def canonical_answers(self):
         """
-        Uses recursive descent parsing to evaluate an expression. The function checks for the existence of a bracket,
-        if it finds one then it adds its index to the stack. When the function finds a closed bracket symbol it calls
-        the evaluate_brackets() method.
-        :param exp: A list of tokenized statements (see self.lexical_analysis() for more details)
-        :return: False if there was a ZeroDivisionError, otherwise it returns the evaluated expression
+        The answers students most often give to each step, written the way the keyboard writes them: the model answer
+        with its sides swapped, its terms reordered and (for a fractional slope) x inside or outside the fraction.
+        These are only candidates for the index - each step keeps the ones it grades correct.
+        :return: A list of lists of answers, one list for each step
         """
-        stack = []
-        for i, x in enumerate(exp):
-            if x == '(':
-                stack.append(i)
-            elif x == ')':
-                start = stack.pop()
-                result = self._evaluate_brackets(exp[start + 1: i])
-                if result is not False:
-                    exp[start: i + 1] = result
-                    return self._evaluate_expression(exp)
-                else:
-                    return False
-        return self._evaluate_brackets(exp)
+        x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y2
+        m = Fraction(y2 - y1, x2 - x1)
+        c = y1 - m * x1
+
+        def number(value):
+            return str(value) if value.denominator == 1 else f'(({value.numerator})/({value.denominator}))'
+
+        def times_x(coefficient):
+            return {1: 'x', -1: '-x'}.get(coefficient, f'{coefficient}x')
+
+        def add(*terms):
+            return ''.join(terms[:1] + tuple(term if term.startswith('-') else '+' + term for term in terms[1:]))
+
+        if m.denominator != 1:
+            x_terms = [f'{number(m)}x', f"(({times_x(m.numerator)})/({m.denominator}))"]
+        else:
+            x_terms = [times_x(m.numerator)]
+        gradients = [f'(({y2}-{y1})/({x2}-{x1}))', f'(({y1}-{y2})/({x1}-{x2}))']
+        sides = {
+            0: [(gradient, number(m)) for gradient in gradients],
+            1: [('y', add(x_term, 'c')) for x_term in x_terms] + [('y', add('c', x_term)) for x_term in x_terms],
+            2: [(str(y), add(f'{number(m)}×{x}', 'c')) for x, y in ((x1, y1), (x2, y2))] +
+               [(str(y), add('c', f'{x}×{number(m)}')) for x, y in ((x1, y1), (x2, y2))],
+            3: [('c', number(c))],
+            4: [('y', x_term if c == 0 else add(x_term, number(c))) for x_term in x_terms] +
+               [('y', add(number(c), x_term)) for x_term in x_terms if c != 0],
+        }
+        answers = [[f'{left}={right}' for left, right in sides[step]] +
+                   [f'{right}={left}' for left, right in sides[step]] for step in range(5)]
+        answers[0] += gradients + [number(m)]
+        answers[3] += [number(c)]
+        return answers
 
     @staticmethod
-    def _evaluate_brackets(exp: list):
+    def _evaluate_expression(exp: list):
         """
-        Evaluates an expression in the following order: Multiplication, Division, Addition, Subtraction
+        Compiles the tokenized expression and evaluates it with floats (see Expression for more details).
         :param exp: A list of tokenized statements (see self.lexical_analysis() for more details)
-        :return: False if there was a ZeroDivisionError, otherwise it returns the evaluated expression
+        :return: False if the expression is blank, malformed or there was a ZeroDivisionError, otherwise it returns
+                 the evaluated expression as a float
         """
-        count = 1
-        while len(exp) > 1:
-            if '*' in exp:
-                index = exp.index('*')
-                product = float(exp[index - 1]) * float(exp[index + 1])
-                exp.insert(index + 2, product)
-                del exp[index - 1:index + 2]
-                continue
-            if '/' in exp:
-                index = exp.index('/')
-                try:
-                    division = float(exp[index - 1]) / float(exp[index + 1])
-                except ZeroDivisionError:
-                    return False
-                exp.insert(index + 2, division)
-                del exp[index - 1:index + 2]
-                continue
-            if '+' in exp:
-                index = exp.index('+')
-                summation = float(exp[index - 1]) + float(exp[index + 1])
-                exp.insert(index + 2, summation)
-                del exp[index - 1:index + 2]
-                continue
-            if '-' in exp:
-                index = exp.index('-')
-                subtraction = float(exp[index - 1]) - float(exp[index + 1])
-                exp.insert(index + 2, subtraction)
-                del exp[index - 1:index + 2]
-                continue
-            # If the loop has descended to this point then something has gone wrong
-            if count > 5:  # Prevents a infinite iterations
-                break
-            count += 1
+        return Expression(exp).evaluate()
 
-        return exp
+    def _compile(self, user_input: list):
+        """
+        :param user_input: A list of lists, with each list being an expression (see _lexical_analysis())
+        :return: A list of Expression objects, one for each side of the user's answer
+        """
+        return [Expression(exp, self.exact) for exp in user_input]
 
-    def _check_solution(self, exp: list, solution=None):
+    @staticmethod
+    def _check_solution(expressions: list, values: dict, solution=None, undefined=False):
         """
-        Iterates over the list of list and reduced each expression submitted by the user to its simplest form.
+        Evaluates each expression submitted by the user, with the variables set to values, to its simplest form.
         If a solution is given the function checks whether or not each given expression equals the solution. If a
         solution is not given, then the function checks whether submitted expression is equal to each other.
-        :param exp: user input expressed as str in a LaTeX form
-        :param solution: model answer expressed as an integer - default is None
+        :param expressions: A list of Expression objects, one for each side of the user's answer
+        :param values: A dictionary whose keys are the variables and values are the numbers to substitute for them
+        :param solution: model answer expressed as a number - default is None
+        :param undefined: What to return if an expression divides by zero at values - default is False
         :return: True if all expressions reduce to "solution". False if any expression cannot be reduced to "solution".
         """
         if solution is None:
             evaluated_expressions = set()
-            for expression in exp:
-                simplified = self._evaluate_expression(expression)          # Evaluate each expression
-                if _check_float(simplified[0]):
-                    evaluated_expressions.add(float(simplified[0]))
+            for expression in expressions:
+                simplified = expression.evaluate(values, None)              # Evaluate each expression
+                if simplified is None:                                      # ZeroDivisionError
+                    return undefined
+                if simplified is False:                                     # Blank or malformed
+                    return False
+                evaluated_expressions.add(simplified)
             return len(evaluated_expressions) == 1
         else:
-            for expression in exp:
-                simplified = self._evaluate_expression(expression)
-                if simplified is False:                                     # ZeroDivisionError
-                    return False
-                elif len(simplified) == 0:                                  # User left the solution blank
-                    return False
-                if _check_float(simplified[0]):
-                    if float(simplified[0]) != solution:
-                        return False
-                else:
+            for expression in expressions:
+                simplified = expression.evaluate(values, None)
+                if simplified is None:
+                    return undefined
+                if simplified is False or simplified != solution:
                     return False
             return True
 
-
-    @staticmethod
-    def _substitute_value(expression, variable: str, value: str):
+    def _check_points(self, expressions: list, values: dict):
         """
-        :param expression: A list of lists example: [['y'], ['m', '*', 'x', '+', 'c']]
-        :param variable: The variable to be substituted
-        :param value: The value the variable will take
+        Checks the answer at each of self.points. It must hold at the two points given in the question; at the further
+        points it must hold wherever it is defined, so that a division by x, say, doesn't fail it where x is 0.
+        :param expressions: A list of Expression objects, one for each side of the user's answer
+        :param values: The values of any variables other than x and y
+        :return: True if step is correct, False otherwise
         """
-        return [[value if term == variable else term for term in exp] for exp in expression]
+        for index, (x, y) in enumerate(self.points):
+            checked = self._check_solution(expressions, dict(values, x=x, y=y), undefined=None)
+            if checked is False or (checked is None and index < 2):
+                return False
+        return True
 
     @staticmethod
     def _check_instance(expression, conditions: dict, equals=False):
@@ -331,6 +643,33 @@ class LatexParser:
                 return False
         return True
 
+    @classmethod
+    def grade_many(cls, submissions, coordinates=COORDINATES, exact=True, parsers=None):
+        """
+        Grades a batch of answers, e.g. every answer in a set of DataLogger files after a rule in re_patterns has
+        changed. One LatexParser is built per question (the first time the question is seen) and identical answers to
+        the same step of the same question are only graded once. Results are yielded as they are graded, in the same
+        order as submissions.
+        :param submissions: An iterable of (question_index, step, raw_text) tuples, where question_index indexes
+                            coordinates and raw_text is the answer as it was submitted (None if nothing was recognised)
+        :param coordinates: The coordinates of each question - default is COORDINATES
+        :param exact: Passed on to each LatexParser
+        :param parsers: A dictionary of LatexParser objects keyed by question_index, to reuse between batches
+        :return: A generator of (question_index, step, raw_text, result) tuples
+        """
+        if parsers is None:
+            parsers = {}
+        results = {}
+        for question_index, step, raw_text in submissions:
+            key = (question_index, step, raw_text)
+            result = results.get(key)
+            if result is None:
+                parser = parsers.get(question_index)
+                if parser is None:
+                    parser = parsers[question_index] = cls(*coordinates[question_index], exact=exact)
+                result = results[key] = raw_text is not None and bool(parser.run(raw_text, step))
+            yield question_index, step, raw_text, result
+
     def run(self, user_input: str, id_number: int):
         if id_number == 0:
             return self.zero(user_input)
@@ -346,14 +685,14 @@ class LatexParser:
     @parse
     def run_tutorial(self, user_input: str, id_number: int):
         if id_number == 4:
-            return user_input == [['(', '(', '3', ')', '/', '(', '4', ')', ')']]
+            return user_input == (('(', '(', '3', ')', '/', '(', '4', ')', ')'),)
         if id_number == 3:
-            return user_input == [['5', '*', '8'], ['40']]
+            return user_input == (('5', '*', '8'), ('40',))
         if id_number == 2:
-            return user_input == [['y'], ['-3', '*', 'x', '+', 'c']]
+            return user_input == (('y',), ('-3', '*', 'x', '+', 'c'))
         if id_number == 1:
-            return user_input == [['(', '(', '1', ')', '/', '(', '2', ')', ')']] or [['1', '/', '2']]
-        return user_input == [['y'], ['m', 'x', '+', 'c']]
+            return user_input == (('(', '(', '1', ')', '/', '(', '2', ')', ')'),) or (('1', '/', '2'),)
+        return user_input == (('y',), ('m', 'x', '+', 'c'))
 
     @parse
     def zero(self, user_input: str):
@@ -364,27 +703,21 @@ class LatexParser:
         """
         if not self._check_instance(user_input, {'c': 0, 'x': 0, 'y': 0}):  # Solution must not have c, x or y in it
             return False
-        user_input = self._substitute_value(user_input, 'm', str(self.m))
-        return self._check_solution(user_input, solution=self.m)
+        expressions = self._compile(user_input)
+        return self._check_solution(expressions, {'m': self.m}, solution=self.m)
 
     @parse
     def one(self, user_input: str):
         """
         Checks whether the user_input is in the correct format. Then checks whether 'c', 'x', 'y' and '=' is in the user
-        input. Then substitutes values.
+        input. Then compiles the answer once and evaluates it at each of self.points.
         :return: True if step is correct, False otherwise
         """
         if not self._check_instance(user_input, {'y': 1, 'c': 1, 'm': 0}, True):
             # Solution must contain a y, x, c and an equals sign, but cannot contain an m
             return False
-        solution_array = []  # Substitute both (x1, y1) and (x2, y2) into equation.
-        for pair in ((('c', str(self.c)), ('x', str(self.x1)), ('y', str(self.y1))),
-                     (('c', str(self.c)), ('x', str(self.x2)), ('y', str(self.y2)))):
-            temp = user_input
-            for (variable, value) in pair:
-                temp = self._substitute_value(temp, variable, value)
-            solution_array.append(temp)
-        return all(map(self._check_solution, solution_array))
+        expressions = self._compile(user_input)
+        return self._check_points(expressions, {'c': self.c})
 
     @parse
     def two(self, user_input: str):
@@ -396,8 +729,8 @@ class LatexParser:
         if not self._check_instance(user_input, {'c': -1, 'm': 0, 'y': 0}, True):
             # Solution must contain an equal sign and at least one c, and cannot contain a y or an m
             return False
-        user_input = self._substitute_value(user_input, 'c', f'{self.c}')
-        return self._check_solution(user_input)
+        expressions = self._compile(user_input)
+        return self._check_solution(expressions, {'c': self.c})
 
     @parse
     def three(self, user_input: str):
@@ -411,114 +744,111 @@ class LatexParser:
         if not self._check_instance(user_input, {'m': 0, 'x': 0, 'y': 0}):
             # Solution cannot contain an x, y or m
             return False
-        user_input = self._substitute_value(user_input, 'c', f'{self.c}')
-        return self._check_solution(user_input, self.c)
+        expressions = self._compile(user_input)
+        return self._check_solution(expressions, {'c': self.c}, self.c)
 
     @parse
     def four(self, user_input: str):
         """
         Checks whether solution is in correct syntax, then if '=', 'x', 'y' in user_input. Converts Nx --> N×x then
-        replaces x and y with x1 and y1. Finally checks whether the solution is valid.
+        evaluates the answer at each of self.points. Finally checks whether the solution is valid.
         :return: True if step is correct, False otherwise
         """
         if not self._check_instance(user_input, {'y': 1, 'm': 0, 'c': 0}, True):
             # Solution cannot contain an m or c and must include an x, y and an equals sign
             return False
-        solution_array = []  # Substitute both (x1, y1) and (x2, y2) into equation.
-        for pair in ((('x', str(self.x1)), ('y', str(self.y1))), (('x', str(self.x2)), ('y', str(self.y2)))):
-            temp = user_input
-            for (variable, value) in pair:
-                temp = self._substitute_value(temp, variable, value)
-            solution_array.append(temp)
-        return all(map(self._check_solution, solution_array))
+        expressions = self._compile(user_input)
+        return self._check_points(expressions, {})
 
 
-if __name__ == "__main__":
+def read_logged_answers(file_name: str):
+    """
+    Reads the answers out of a file written by DataLogger, in either format (see eventlog.read_rows). Each 'solution'
+    row holds the time, the question number and a dictionary such as
+    {'2': {'correct': True, 'confidence': 0.98, 'text': '5=2×1+c'}} whose key is the step. Rows logged outside a
+    question (e.g. the tutorial, question number -1) and answers MathPix was unsure about (logged as None) are skipped.
+    :param file_name: Path to a {user_id}-data.bin or {user_id}-data.csv file
+    :return: A generator of (time, question_index, step, text, correct) tuples, in the order they were logged
+    """
+    for row in read_rows(file_name):
+        if len(row) < 4 or row[2] != 'solution' or int(row[1]) < 0 or row[3] in ('', 'None'):
+            continue
+        for step, event_data in literal_eval(row[3]).items():
+            yield row[0], int(row[1]), int(step), event_data['text'], event_data['correct']
+
+
+_worker_parsers = {}  # The LatexParser objects each grade_parallel() worker process keeps between chunks
 
-    questions = [[1, 5, 2, 7], [3, 4, 5, 20], [-3, 22, 1, 2], [-1, -4, 8, 23], [-10, 6, -2, -2], [-1, -7, 19, 133],
-                 [14, 5, 6, 5], [40, 10, 20, 5]]
-
-    test_cases = {
-                    '00': ['((7-5)/(2-1))=2', '((5-7)/(1-2))=2', '2=((7-5)/(2-1))', '(2=((5-7)/(1-2)))', '((-2)/(-1))=2',
-                         '2=((-2)/(-1))', '((2)/(1))=2', '2=((2)/(1))', '2', '=2', '=((7-5)/(2-1))', '((7-5)/(2-1))',
-                         '((5-7)/(1-2))', '=((5-7)/(1-2))', '((-2)/(-1))', '=((-2)/(-1))', '((2)/(1))', '=((2)/(1))'],
-                    '01': ['y=2x+c', 'y=c+2x', '2x+c=y', 'c+2x=y'],
-                    '02': ['5=2×1+c', '5=1×2+c', '1×2+c=5', '2×1+c=5', '5=c+2×1', '5=c+1×2', 'c+2×1=5', 'c+1×2=5',
-                         '2+c=5', 'c+2=5', '5=2+c', '5=c+2', 'c=5-2', '5-2=c', '7=2×2+c', '7=2×2+c', '2×2+c=7',
-                         '2×2+c=7', '7=c+2×2', '7=c+2×2', 'c+2×2=7', 'c+2×2=7', '4+c=7', 'c+4=7', '7=4+c', '7=c+4',
-                         'c=7-4', '7-4=c', '7=c+2x2', '5=2x1+c', '1X2+c=5'], 
-                    '03': ['c=3', '3=c', '=3', '3'],
-                    '04': ['y=2x+3', 'y=3+2x', '3+2x=y', '2x+3=y'],
-                    '10': ['((20-4)/(5-3))=8', '((4-20)/(3-5))=8', '8=((20-4)/(5-3))', '(8=((4-20)/(3-5)))',
-                         '((-16)/(-2))=8', '8=((-16)/(-2))', '((16)/(2))=8', '8=((16)/(2))', '8', '=8',
-                         '=((20-4)/(5-3))', '((20-4)/(5-3))', '((4-20)/(3-5))', '=((4-20)/(3-5))', '((-16)/(-2))',
-                         '=((-16)/(-2))', '((16)/(2))', '=((16)/(2))'], '11': ['y=8x+c', 'y=c+8x', '8x+c=y', 'c+8x=y'],
-                    '12': ['4=8×3+c', '4=3×8+c', '3×8+c=4', '8×3+c=4', '4=c+8×3', '4=c+3×8', 'c+8×3=4', 'c+3×8=4',
-                         '24+c=4', 'c+24=4', '4=24+c', '4=c+24', 'c=4-24', '4-24=c', '20=8×5+c', '20=5×8+c', '5×8+c=20',
-                         '8×5+c=20', '20=c+8×5', '20=c+5×8', 'c+8×5=20', 'c+5×8=20', '40+c=20', 'c+40=20', '20=40+c',
-                         '20=c+40', 'c=20-40', '20-40=c'],
-                    '13': ['c=-20', '-20=c', '=-20', '-20'],
-                    '14': ['y=8x-20', 'y=-20+8x', '-20+8x=y', '8x-20=y'],
-                    '20': ['((2-22)/(1--3))=-5', '((22-2)/(-3-1))=-5', '-5=((2-22)/(1--3))', '(-5=((22-2)/(-3-1)))',
-                         '((20)/(-4))=-5', '-5=((20)/(-4))', '((-20)/(4))=-5', '-5=((-20)/(4))', '-5', '=-5',
-                         '=((2-22)/(1--3))', '((2-22)/(1--3))', '((22-2)/(-3-1))', '=((22-2)/(-3-1))', '((20)/(-4))',
-                         '=((20)/(-4))', '((-20)/(4))', '=((-20)/(4))'],
-                    '21': ['y=c+-5x', 'y=-5x+c', '-5x+c=y', 'c+-5x=y'],
-                    '22': ['22=-5×-3+c', '22=-3×-5+c', '-3×-5+c=22', '-5×-3+c=22', '22=c+-5×-3', '22=c+-3×-5',
-                         'c+-5×-3=22', 'c+-3×-5=22', '15+c=22', 'c+15=22', '22=15+c', '22=c+15', 'c=22-15', '22-15=c',
-                         '2=-5×1+c', '2=1×-5+c', '1×-5+c=2', '-5×1+c=2', '2=c+-5×1', '2=c+1×-5', 'c+-5×1=2', 'c+1×-5=2',
-                         '-5+c=2', 'c+-5=2', '2=-5+c', '2=c+-5', 'c=2--5', '2--5=c', '2=-5×1+c=-5+c'],
-                    '23': ['c=7', '7=c', '=7', '7'],
-                    '24': ['y=-5x+7', 'y=7-5x', '7-5x=y', '-5x+7=y'],
-                    '30': ['((23--4)/(8--1))=3', '((-4-23)/(-1-8))=3', '3=((23--4)/(8--1))', '(3=((-4-23)/(-1-8)))',
-                         '((-27)/(-9))=3', '3=((-27)/(-9))', '((27)/(9))=3', '3=((27)/(9))', '3', '=3',
-                         '=((23--4)/(8--1))', '((23--4)/(8--1))', '((-4-23)/(-1-8))', '=((-4-23)/(-1-8))',
-                         '((-27)/(-9))', '=((-27)/(-9))', '((27)/(9))', '=((27)/(9))'],
-                    '31': ['y=3x+c', 'y=c+3x', '3x+c=y', 'c+3x=y'],
-                    '32': ['-4=3×-1+c', '-4=-1×3+c', '-1×3+c=-4', '3×-1+c=-4', '-4=c+3×-1', '-4=c+-1×3', 'c+3×-1=-4',
-                         'c+-1×3=-4', '-3+c=-4', 'c+-3=-4', '-4=-3+c', '-4=c+-3', 'c=-4--3', '-4--3=c', '23=3×8+c',
-                         '23=8×3+c', '8×3+c=23', '3×8+c=23', '23=c+3×8', '23=c+8×3', 'c+3×8=23', 'c+8×3=23', '24+c=23',
-                         'c+24=23', '23=24+c', '23=c+24', 'c=23-24', '23-24=c'], '33': ['c=-1', '-1=c', '=-1', '-1'],
-                    '34': ['y=3x-1', 'y=-1+3x', '-1+3x=y', '3x-1=y'],
-                    '40': ['((-2-6)/(-2--10))=-1', '((6--2)/(-10--2))=-1', '-1=((-2-6)/(-2--10))',
-                         '(-1=((6--2)/(-10--2)))', '((8)/(-8))=-1', '-1=((8)/(-8))', '((-8)/(8))=-1', '-1=((-8)/(8))',
-                         '-1', '=-1', '=((-2-6)/(-2--10))', '((-2-6)/(-2--10))', '((6--2)/(-10--2))',
-                         '=((6--2)/(-10--2))', '((8)/(-8))', '=((8)/(-8))', '((-8)/(8))', '=((-8)/(8))'],
-                    '41': ['y=-1x+c', 'y=c+-1x', '-1x+c=y', 'c+-1x=y'],
-                    '42': ['6=-1×-10+c', '6=-10×-1+c', '-10×-1+c=6', '-1×-10+c=6', '6=c+-1×-10', '6=c+-10×-1',
-                         'c+-1×-10=6', 'c+-10×-1=6', '10+c=6', 'c+10=6', '6=10+c', '6=c+10', 'c=6-10', '6-10=c',
-                         '-2=-1×-2+c', '-2=-2×-1+c', '-2×-1+c=-2', '-1×-2+c=-2', '-2=c+-1×-2', '-2=c+-2×-1',
-                         'c+-1×-2=-2', 'c+-2×-1=-2', '2+c=-2', 'c+2=-2', '-2=2+c', '-2=c+2', 'c=-2-2', '-2-2=c'],
-                    '43': ['c=-4', '-4=c', '=-4', '-4'], '44': ['y=-1x-4', 'y=-4-1x', '-4-1x=y', '-1x-4=y'],
-                    '50': ['((133--7)/(19--1))=7', '((-7-133)/(-1-19))=7', '7=((133--7)/(19--1))',
-                         '(7=((-7-133)/(-1-19)))', '((-140)/(-20))=7', '7=((-140)/(-20))', '((140)/(20))=7',
-                         '7=((140)/(20))', '7', '=7', '=((133--7)/(19--1))', '((133--7)/(19--1))', '((-7-133)/(-1-19))',
-                         '=((-7-133)/(-1-19))', '((-140)/(-20))', '=((-140)/(-20))', '((140)/(20))', '=((140)/(20))'],
-                    '51': ['y=7x+c', 'y=c+7x', '7x+c=y', 'c+7x=y'],
-                    '52': ['-7=7×-1+c', '-7=-1×7+c', '-1×7+c=-7', '7×-1+c=-7', '-7=c+7×-1', '-7=c+-1×7', 'c+7×-1=-7',
-                         'c+-1×7=-7', '-7+c=-7', 'c+-7=-7', '-7=-7+c', '-7=c+-7', 'c=-7--7', '-7--7=c', '133=7×19+c',
-                         '133=19×7+c', '19×7+c=133', '7×19+c=133', '133=c+7×19', '133=c+19×7', 'c+7×19=133',
-                         'c+19×7=133', '133+c=133', 'c+133=133', '133=133+c', '133=c+133', 'c=133-133', '133-133=c'],
-                    '53': ['c=0', '0=c', '=0', '0'], '54': ['y=7x', '7x=y'],
-                    '60': ['((5-5)/(6-14))=0', '((5-5)/(14-6))=0', '0=((5-5)/(6-14))', '(0=((5-5)/(14-6)))',
-                         '((0)/(8))=0', '0=((0)/(8))', '((0)/(-8))=0', '0=((0)/(-8))', '0', '=0', '=((5-5)/(6-14))',
-                         '((5-5)/(6-14))', '((5-5)/(14-6))', '=((5-5)/(14-6))', '((0)/(8))', '=((0)/(8))', '((0)/(-8))',
-                         '=((0)/(-8))'], '61': ['y=0x+c', 'y=c+0x', '0x+c=y', 'c+0x=y'],
-                    '62': ['5=0×14+c', '5=14×0+c', '14×0+c=5', '0×14+c=5', '5=c+0×14', '5=c+14×0', 'c+0×14=5', 'c+14×0=5',
-                         '0+c=5', 'c+0=5', '5=0+c', '5=c+0', 'c=5-0', '5-0=c', '5=0×6+c', '5=6×0+c', '6×0+c=5',
-                         '0×6+c=5', '5=c+0×6', '5=c+6×0', 'c+0×6=5', 'c+6×0=5', '0+c=5', 'c+0=5', '5=0+c', '5=c+0',
-                         'c=5-0', '5-0=c'], '63': ['c=5', '5=c', '=5', '5'], '64': ['y=5', '5=y'],
-                    '70': ["((10-5)/(40-20))=((5)/(20))=((1)/(4))"],
-                    '71': ["y=((x)/(4))+c"],
-                    '72': ["\\( 5=\\frac{20}{4}+c \\)"],
-                    '73': ["\\( c=0 \\)"],
-                    '74': ["\\( y=\\frac{x}{4} \\)"]
-                }
-
-    for i_index, (x_1, y_1, x_2, y_2) in enumerate(questions):
+
+def _grade_chunk(chunk):
+    """
+    Runs in a grade_parallel() worker process. Every submission in a chunk belongs to the same question, so the worker
+    only builds the LatexParser for that question once, however many chunks of it the worker receives.
+    :param chunk: A tuple (exact, submissions) - see LatexParser.grade_many()
+    :return: A list of results, in the same order as submissions
+    """
+    exact, submissions = chunk
+    parsers = _worker_parsers.setdefault(exact, {})
+    return [result for *_, result in LatexParser.grade_many(submissions, exact=exact, parsers=parsers)]
+
+
+def grade_parallel(submissions, workers=None, chunk_size=1000, exact=True):
+    """
+    Grades a large batch of answers (e.g. a whole cohort) across a pool of processes. Duplicates are removed, the
+    distinct answers are sharded by question and sent to the workers in chunks, so each worker only needs a parser for
+    the questions it is given and each round trip carries up to chunk_size answers and results.
+    :param submissions: An iterable of (question_index, step, raw_text) tuples - see LatexParser.grade_many()
+    :param workers: Number of worker processes - default is the number of CPUs
+    :param chunk_size: Maximum number of answers sent to a worker at once
+    :param exact: Passed on to each LatexParser
+    :return: A list of (question_index, step, raw_text, result) tuples, in the same order as submissions (regardless of
+             the order the workers finish in)
+    """
+    submissions = list(submissions)
+    shards = {}
+    for submission in dict.fromkeys(submissions):  # Distinct submissions, in order
+        shards.setdefault(submission[0], []).append(submission)
+    chunks = [shard[start:start + chunk_size] for _, shard in sorted(shards.items())
+              for start in range(0, len(shard), chunk_size)]
+    results = {}
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk, chunk_results in zip(chunks, executor.map(_grade_chunk, [(exact, chunk) for chunk in chunks])):
+            results.update(zip(chunk, chunk_results))
+    return [(*submission, results[submission]) for submission in submissions]
+
+
+def _grade_files(arguments):
+    """
+    Regrades every answer in the given DataLogger files and writes one CSV row per answer to stdout, with the result
+    that was logged at the time next to the result the current rules give.
+    """
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['file', 'time', 'question', 'step', 'text', 'logged', 'regraded'])
+    changed = total = 0
+    answers = [(file_name, answer) for file_name in arguments.files for answer in read_logged_answers(file_name)]
+    submissions = [(question, step, text) for _, (_, question, step, text, _) in answers]
+    if arguments.workers > 1:
+        results = grade_parallel(submissions, arguments.workers)
+    else:
+        results = LatexParser.grade_many(submissions)
+    for (file_name, (time_log, _, _, _, logged)), (question, step, text, result) in zip(answers, results):
+        writer.writerow([file_name, time_log, question, step, text, logged, result])
+        changed += logged != result
+        total += 1
+    print(f'{changed} of {total} answers graded differently', file=sys.stderr)
+    if arguments.workers <= 1:  # Workers count their own hits
+        hits, misses = (sum(counts) for counts in zip(*answer_index_info().values()))
+        print(f'{hits} of {hits + misses} valid answers accepted from the answer index', file=sys.stderr)
+
+
+def _print_corpus(arguments):
+    """
+    Grades every answer in TEST_CASES and prints the results.
+    """
+    for i_index, (x_1, y_1, x_2, y_2) in enumerate(QUESTIONS):
         solution_checker = LatexParser(x_1, y_1, x_2, y_2)
         for j_index in range(5):
-            cases = test_cases[f"{i_index}{j_index}"]
+            cases = TEST_CASES[f"{i_index}{j_index}"]
             if j_index == 0:
                 func = solution_checker.zero
             elif j_index == 1:
@@ -532,4 +862,98 @@ if __name__ == "__main__":
             print(f'--- {i_index}{j_index} ---')
             for k_index, _solution in enumerate(cases):
                 _result = func(_solution)
-                print(_result, test_cases[f"{i_index}{j_index}"][k_index])
+                print(_result, TEST_CASES[f"{i_index}{j_index}"][k_index])
+
+
+QUESTIONS = [[1, 5, 2, 7], [3, 4, 5, 20], [-3, 22, 1, 2], [-1, -4, 8, 23], [-10, 6, -2, -2], [-1, -7, 19, 133],
+              [14, 5, 6, 5], [40, 10, 20, 5]]
+
+TEST_CASES = {
+    '00': ['((7-5)/(2-1))=2', '((5-7)/(1-2))=2', '2=((7-5)/(2-1))', '(2=((5-7)/(1-2)))', '((-2)/(-1))=2',
+         '2=((-2)/(-1))', '((2)/(1))=2', '2=((2)/(1))', '2', '=2', '=((7-5)/(2-1))', '((7-5)/(2-1))',
+         '((5-7)/(1-2))', '=((5-7)/(1-2))', '((-2)/(-1))', '=((-2)/(-1))', '((2)/(1))', '=((2)/(1))'],
+    '01': ['y=2x+c', 'y=c+2x', '2x+c=y', 'c+2x=y'],
+    '02': ['5=2×1+c', '5=1×2+c', '1×2+c=5', '2×1+c=5', '5=c+2×1', '5=c+1×2', 'c+2×1=5', 'c+1×2=5',
+         '2+c=5', 'c+2=5', '5=2+c', '5=c+2', 'c=5-2', '5-2=c', '7=2×2+c', '7=2×2+c', '2×2+c=7',
+         '2×2+c=7', '7=c+2×2', '7=c+2×2', 'c+2×2=7', 'c+2×2=7', '4+c=7', 'c+4=7', '7=4+c', '7=c+4',
+         'c=7-4', '7-4=c', '7=c+2x2', '5=2x1+c', '1X2+c=5'], 
+    '03': ['c=3', '3=c', '=3', '3'],
+    '04': ['y=2x+3', 'y=3+2x', '3+2x=y', '2x+3=y'],
+    '10': ['((20-4)/(5-3))=8', '((4-20)/(3-5))=8', '8=((20-4)/(5-3))', '(8=((4-20)/(3-5)))',
+         '((-16)/(-2))=8', '8=((-16)/(-2))', '((16)/(2))=8', '8=((16)/(2))', '8', '=8',
+         '=((20-4)/(5-3))', '((20-4)/(5-3))', '((4-20)/(3-5))', '=((4-20)/(3-5))', '((-16)/(-2))',
+         '=((-16)/(-2))', '((16)/(2))', '=((16)/(2))'], '11': ['y=8x+c', 'y=c+8x', '8x+c=y', 'c+8x=y'],
+    '12': ['4=8×3+c', '4=3×8+c', '3×8+c=4', '8×3+c=4', '4=c+8×3', '4=c+3×8', 'c+8×3=4', 'c+3×8=4',
+         '24+c=4', 'c+24=4', '4=24+c', '4=c+24', 'c=4-24', '4-24=c', '20=8×5+c', '20=5×8+c', '5×8+c=20',
+         '8×5+c=20', '20=c+8×5', '20=c+5×8', 'c+8×5=20', 'c+5×8=20', '40+c=20', 'c+40=20', '20=40+c',
+         '20=c+40', 'c=20-40', '20-40=c'],
+    '13': ['c=-20', '-20=c', '=-20', '-20'],
+    '14': ['y=8x-20', 'y=-20+8x', '-20+8x=y', '8x-20=y'],
+    '20': ['((2-22)/(1--3))=-5', '((22-2)/(-3-1))=-5', '-5=((2-22)/(1--3))', '(-5=((22-2)/(-3-1)))',
+         '((20)/(-4))=-5', '-5=((20)/(-4))', '((-20)/(4))=-5', '-5=((-20)/(4))', '-5', '=-5',
+         '=((2-22)/(1--3))', '((2-22)/(1--3))', '((22-2)/(-3-1))', '=((22-2)/(-3-1))', '((20)/(-4))',
+         '=((20)/(-4))', '((-20)/(4))', '=((-20)/(4))'],
+    '21': ['y=c+-5x', 'y=-5x+c', '-5x+c=y', 'c+-5x=y'],
+    '22': ['22=-5×-3+c', '22=-3×-5+c', '-3×-5+c=22', '-5×-3+c=22', '22=c+-5×-3', '22=c+-3×-5',
+         'c+-5×-3=22', 'c+-3×-5=22', '15+c=22', 'c+15=22', '22=15+c', '22=c+15', 'c=22-15', '22-15=c',
+         '2=-5×1+c', '2=1×-5+c', '1×-5+c=2', '-5×1+c=2', '2=c+-5×1', '2=c+1×-5', 'c+-5×1=2', 'c+1×-5=2',
+         '-5+c=2', 'c+-5=2', '2=-5+c', '2=c+-5', 'c=2--5', '2--5=c', '2=-5×1+c=-5+c'],
+    '23': ['c=7', '7=c', '=7', '7'],
+    '24': ['y=-5x+7', 'y=7-5x', '7-5x=y', '-5x+7=y'],
+    '30': ['((23--4)/(8--1))=3', '((-4-23)/(-1-8))=3', '3=((23--4)/(8--1))', '(3=((-4-23)/(-1-8)))',
+         '((-27)/(-9))=3', '3=((-27)/(-9))', '((27)/(9))=3', '3=((27)/(9))', '3', '=3',
+         '=((23--4)/(8--1))', '((23--4)/(8--1))', '((-4-23)/(-1-8))', '=((-4-23)/(-1-8))',
+         '((-27)/(-9))', '=((-27)/(-9))', '((27)/(9))', '=((27)/(9))'],
+    '31': ['y=3x+c', 'y=c+3x', '3x+c=y', 'c+3x=y'],
+    '32': ['-4=3×-1+c', '-4=-1×3+c', '-1×3+c=-4', '3×-1+c=-4', '-4=c+3×-1', '-4=c+-1×3', 'c+3×-1=-4',
+         'c+-1×3=-4', '-3+c=-4', 'c+-3=-4', '-4=-3+c', '-4=c+-3', 'c=-4--3', '-4--3=c', '23=3×8+c',
+         '23=8×3+c', '8×3+c=23', '3×8+c=23', '23=c+3×8', '23=c+8×3', 'c+3×8=23', 'c+8×3=23', '24+c=23',
+         'c+24=23', '23=24+c', '23=c+24', 'c=23-24', '23-24=c'], '33': ['c=-1', '-1=c', '=-1', '-1'],
+    '34': ['y=3x-1', 'y=-1+3x', '-1+3x=y', '3x-1=y'],
+    '40': ['((-2-6)/(-2--10))=-1', '((6--2)/(-10--2))=-1', '-1=((-2-6)/(-2--10))',
+         '(-1=((6--2)/(-10--2)))', '((8)/(-8))=-1', '-1=((8)/(-8))', '((-8)/(8))=-1', '-1=((-8)/(8))',
+         '-1', '=-1', '=((-2-6)/(-2--10))', '((-2-6)/(-2--10))', '((6--2)/(-10--2))',
+         '=((6--2)/(-10--2))', '((8)/(-8))', '=((8)/(-8))', '((-8)/(8))', '=((-8)/(8))'],
+    '41': ['y=-1x+c', 'y=c+-1x', '-1x+c=y', 'c+-1x=y'],
+    '42': ['6=-1×-10+c', '6=-10×-1+c', '-10×-1+c=6', '-1×-10+c=6', '6=c+-1×-10', '6=c+-10×-1',
+         'c+-1×-10=6', 'c+-10×-1=6', '10+c=6', 'c+10=6', '6=10+c', '6=c+10', 'c=6-10', '6-10=c',
+         '-2=-1×-2+c', '-2=-2×-1+c', '-2×-1+c=-2', '-1×-2+c=-2', '-2=c+-1×-2', '-2=c+-2×-1',
+         'c+-1×-2=-2', 'c+-2×-1=-2', '2+c=-2', 'c+2=-2', '-2=2+c', '-2=c+2', 'c=-2-2', '-2-2=c'],
+    '43': ['c=-4', '-4=c', '=-4', '-4'], '44': ['y=-1x-4', 'y=-4-1x', '-4-1x=y', '-1x-4=y'],
+    '50': ['((133--7)/(19--1))=7', '((-7-133)/(-1-19))=7', '7=((133--7)/(19--1))',
+         '(7=((-7-133)/(-1-19)))', '((-140)/(-20))=7', '7=((-140)/(-20))', '((140)/(20))=7',
+         '7=((140)/(20))', '7', '=7', '=((133--7)/(19--1))', '((133--7)/(19--1))', '((-7-133)/(-1-19))',
+         '=((-7-133)/(-1-19))', '((-140)/(-20))', '=((-140)/(-20))', '((140)/(20))', '=((140)/(20))'],
+    '51': ['y=7x+c', 'y=c+7x', '7x+c=y', 'c+7x=y'],
+    '52': ['-7=7×-1+c', '-7=-1×7+c', '-1×7+c=-7', '7×-1+c=-7', '-7=c+7×-1', '-7=c+-1×7', 'c+7×-1=-7',
+         'c+-1×7=-7', '-7+c=-7', 'c+-7=-7', '-7=-7+c', '-7=c+-7', 'c=-7--7', '-7--7=c', '133=7×19+c',
+         '133=19×7+c', '19×7+c=133', '7×19+c=133', '133=c+7×19', '133=c+19×7', 'c+7×19=133',
+         'c+19×7=133', '133+c=133', 'c+133=133', '133=133+c', '133=c+133', 'c=133-133', '133-133=c'],
+    '53': ['c=0', '0=c', '=0', '0'], '54': ['y=7x', '7x=y'],
+    '60': ['((5-5)/(6-14))=0', '((5-5)/(14-6))=0', '0=((5-5)/(6-14))', '(0=((5-5)/(14-6)))',
+         '((0)/(8))=0', '0=((0)/(8))', '((0)/(-8))=0', '0=((0)/(-8))', '0', '=0', '=((5-5)/(6-14))',
+         '((5-5)/(6-14))', '((5-5)/(14-6))', '=((5-5)/(14-6))', '((0)/(8))', '=((0)/(8))', '((0)/(-8))',
+         '=((0)/(-8))'], '61': ['y=0x+c', 'y=c+0x', '0x+c=y', 'c+0x=y'],
+    '62': ['5=0×14+c', '5=14×0+c', '14×0+c=5', '0×14+c=5', '5=c+0×14', '5=c+14×0', 'c+0×14=5', 'c+14×0=5',
+         '0+c=5', 'c+0=5', '5=0+c', '5=c+0', 'c=5-0', '5-0=c', '5=0×6+c', '5=6×0+c', '6×0+c=5',
+         '0×6+c=5', '5=c+0×6', '5=c+6×0', 'c+0×6=5', 'c+6×0=5', '0+c=5', 'c+0=5', '5=0+c', '5=c+0',
+         'c=5-0', '5-0=c'], '63': ['c=5', '5=c', '=5', '5'], '64': ['y=5', '5=y'],
+    '70': ["((10-5)/(40-20))=((5)/(20))=((1)/(4))"],
+    '71': ["y=((x)/(4))+c"],
+    '72': ["\\( 5=\\frac{20}{4}+c \\)"],
+    '73': ["\\( c=0 \\)"],
+    '74': ["\\( y=\\frac{x}{4} \\)"]
+}
+
+
+if __name__ == "__main__":
+
+    argument_parser = argparse.ArgumentParser(description='Grades the test corpus (the default) or logged answers.')
+    commands = argument_parser.add_subparsers(dest='command')
+    commands.add_parser('corpus', help='Grade every answer in TEST_CASES and print the results')
+    grade_parser = commands.add_parser('grade', help='Regrade every answer in files written by DataLogger')
+    grade_parser.add_argument('files', nargs='+', metavar='file', help='A {user_id}-data.bin or .csv file')
+    grade_parser.add_argument('-w', '--workers', type=int, default=1,
+                              help='Grade in this many processes (see grade_parallel) - default is 1')
+    _arguments = argument_parser.parse_args()
+    {'grade': _grade_files}.get(_arguments.command, _print_corpus)(_arguments)
@@ -0,0 +1,139 @@
+"""
+A load test of the submission path. Simulated tablets, each with its own MathPix client as the app has, send five field
+submissions one after another for a while, and the latency of every submission and every request to MathPix is reported
+at the 50th, 95th and 99th percentiles, along with the throughput. The answers are synthetic handwriting (see
+handwriting.py), sent as the preprocessed PNGs the app sends or, with --strokes, as strokes, mixed with typed answers.
+The target is the stand-in in mock_server.py, started here with the latency and error rate given, unless --url points
+somewhere else - never at the real API, which charges for every request.
+"""
+from api import AsyncMathPixAPI, MathPixAPI, OCRCache
+from handwriting import render, writing
+from imaging import IMAGE_MARGIN, export_scale, preprocess, stroke_box, strokes_payload
+from mock_server import MockMathPixServer
+from statistics import quantiles
+from threading import Thread
+from timeit import default_timer
+import argparse
+import random
+
+WIDTH, HEIGHT = 600, 160  # About the size of a ResponseField on the tablets we deploy to
+TYPED_ANSWERS = ['(7-5/2-1)=2', 'y=2x+c', '5=2×1+c', 'c=3', 'y=2x+3']  # Question 0's model answer, a step a field
+
+
+def handwritten_answers(count: int, strokes: bool = False, seed: int = 0):
+    """
+    :param count: How many different answers to make
+    :param strokes: Make strokes (see imaging.strokes_payload) rather than images
+    :return: A list of handwritten answers, each a line of writing of between 3 and 12 characters
+    """
+    rng = random.Random(seed)
+    answers = []
+    for index in range(count):
+        lines = writing(WIDTH, HEIGHT, rng.randint(3, 12), rng.uniform(40, 120), seed * count + index)
+        if strokes:
+            answers.append(strokes_payload(lines, 0, HEIGHT))
+            continue
+        box = stroke_box(lines, 0, HEIGHT, IMAGE_MARGIN)  # As ExpressionWriter.get_image_data()
+        scale = export_scale(box)
+        png = preprocess(render(lines, WIDTH, HEIGHT, scale), int(WIDTH * scale), int(HEIGHT * scale), box, scale)
+        answers.append(MathPixAPI.format_png(png))
+    return answers
+
+
+def submissions(answers: list, handwritten: float = 0.8, seed: int = 0):
+    """
+    :param answers: The handwritten answers to choose from
+    :param handwritten: The share of fields that are handwritten rather than typed
+    :return: An endless iterator of payloads, as BaseNavigationPane.compare() makes them
+    """
+    rng = random.Random(seed)
+    while True:
+        yield {step: rng.choice(answers) if rng.random() < handwritten else TYPED_ANSWERS[step] for step in range(5)}
+
+
+def percentiles(values: list):
+    """
+    :return: A tuple of the 50th, 95th and 99th percentiles of values
+    """
+    if len(values) < 2:
+        return tuple(values * 3) or (0, 0, 0)
+    cuts = quantiles(values, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def run(url: str, tablets: int = 4, duration: float = 10.0, backend: str = 'thread', strokes: bool = False,
+        handwritten: float = 0.8):
+    """
+    Sends submissions from tablets threads, each with its own client and with no cache, for duration seconds.
+    :param url: The base URL of the API
+    :param backend: 'thread' for MathPixAPI, 'asyncio' for AsyncMathPixAPI
+    :return: A dictionary of results: the numbers of submissions, handwritten answers, answers that failed and requests
+             that needed retrying, the seconds taken, and the (p50, p95, p99) latencies of submissions and of requests
+             in seconds
+    """
+    answers = handwritten_answers(50, strokes)
+    timings = []  # A (seconds, failed answers) tuple for each submission
+    requests = []  # A Request, without its response, for each handwritten answer sent
+    clients = [(AsyncMathPixAPI if backend == 'asyncio' else MathPixAPI)(url, cache=OCRCache(size=0))
+               for _ in range(tablets)]
+    stop = default_timer() + duration
+
+    def tablet(client, seed):
+        for payload in submissions(answers, handwritten, seed):
+            if default_timer() >= stop:
+                return
+            start = default_timer()
+            result = client.post_data(payload)
+            timings.append((default_timer() - start, len(result.failed)))
+            requests.extend(client.records)  # Just this submission's, as each tablet has its own client
+            client.records.clear()
+
+    threads = [Thread(target=tablet, args=(client, seed)) for seed, client in enumerate(clients)]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = default_timer() - start
+    for client in clients:
+        client.close()
+    return {'submissions': len(timings), 'answers': len(requests), 'failed': sum(failed for _, failed in timings),
+            'retried': sum(request.attempts > 1 for request in requests), 'seconds': seconds,
+            'submission_latency': percentiles([latency for latency, _ in timings]),
+            'request_latency': percentiles([request.latency for request in requests])}
+
+
+def report(results: dict):
+    def milliseconds(latencies):
+        return ' / '.join(f'{latency * 1000:.1f}' for latency in latencies)
+
+    print(f"{results['submissions']} submissions ({results['answers']} handwritten answers) in "
+          f"{results['seconds']:.1f} s: {results['submissions'] / results['seconds']:.1f} submissions/s, "
+          f"{results['answers'] / results['seconds']:.1f} answers/s")
+    print(f"submission latency p50 / p95 / p99: {milliseconds(results['submission_latency'])} ms")
+    print(f"request latency p50 / p95 / p99: {milliseconds(results['request_latency'])} ms")
+    print(f"{results['retried']} requests retried, {results['failed']} answers failed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', help='The API to load (default: a mock_server.py started here)')
+    parser.add_argument('-t', '--tablets', type=int, default=4, help='Tablets submitting at once')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Seconds to run for')
+    parser.add_argument('--backend', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--strokes', action='store_true', help='Send strokes rather than images')
+    parser.add_argument('--handwritten', type=float, default=0.8, help='Share of fields that are handwritten')
+    parser.add_argument('--latency-ms', type=float, default=300, help='Mock server: delay added to every answer')
+    parser.add_argument('--jitter-ms', type=float, default=200, help='Mock server: up to this much more, at random')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='Mock server: share of answers that fail')
+    arguments = parser.parse_args()
+    server = None
+    if arguments.url is None:
+        server = MockMathPixServer(latency=arguments.latency_ms / 1000, jitter=arguments.jitter_ms / 1000,
+                                   error_rate=arguments.error_rate).start()
+    try:
+        report(run(arguments.url or server.url, arguments.tablets, arguments.duration, arguments.backend,
+                   arguments.strokes, arguments.handwritten))
+    finally:
+        if server is not None:
+            server.stop()
@@ -5,12 +5,24 @@ Config.set('kivy', 'keyboard_mode', '')  # Need to set before loading everything
 from kivy.app import App
 from kivy.core.text import LabelBase
 from kivy.core.window import Window
+from api import get_client
+from data import log
+from os.path import join
+from telemetry import uploader
 import widgets
 import screens
 
 
 class MainApp(App):
-    pass
+
+    def on_start(self):
+        get_client().cache.use_directory(join(self.user_data_dir, 'ocr-cache'))
+        uploader.use_directory(join(self.user_data_dir, 'telemetry-outbox'))
+
+    def on_stop(self):
+        log.close()  # Flushes the event log, first, so that nothing below can keep it waiting
+        uploader.close()  # What isn't sent now is sent the next time the app starts
+        get_client().close(wait=False)  # Answers still being read are of no use once the app has stopped
 
 
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+"""
+A local stand-in for the MathPix API, for benchmarks, load tests (see load_test.py) and for running the app without an
+API key. Every image posted to /v3/text, and every set of strokes posted to /v3/strokes, is read as a 2, or as each of
+a list of canned responses in turn. Like MathPix, images that aren't a PNG are answered with an error and the size of
+those that are is given in the response. Answers can be made to take a while, and a share of them to fail with a 503.
+Run `python mock_server.py` and point MathPixAPI's base_url at the address it prints.
+
+MockCollectorServer stands in for the server telemetry.py uploads events to, in the same way: `python mock_server.py
+--collector` and set telemetry.ENDPOINT to the address it prints before the app starts.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle
+from threading import Thread
+import argparse
+import base64
+import binascii
+import gzip
+import json
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+RESPONSE = {'text': '\\( 2 \\)', 'latex_styled': '2', 'confidence': 1, 'confidence_rate': 1}
+IMAGE_ERROR = {'error': 'Invalid image', 'error_info': {'id': 'image_decode_error', 'message': 'Invalid image'}}
+PNG_PREFIX = 'data:image/png;base64,'
+COLLECTOR_PATH = '/v1/events'
+
+
+def read_image(body: bytes, response: dict = RESPONSE):
+    """
+    :return: The response to a request to /v3/text: response with the width and height of the PNG it holds, or
+             IMAGE_ERROR if it doesn't hold one
+    """
+    try:
+        src = json.loads(body)['src']
+        png = base64.b64decode(src[len(PNG_PREFIX):], validate=True) if src.startswith(PNG_PREFIX) else b''
+    except (ValueError, KeyError, TypeError, AttributeError, binascii.Error):
+        return IMAGE_ERROR
+    if png[:8] != b'\x89PNG\r\n\x1a\n' or png[12:16] != b'IHDR':
+        return IMAGE_ERROR
+    width, height = struct.unpack('>II', png[16:24])
+    return dict(response, image_width=width, image_height=height)
+
+
+class MockMathPixHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keeps connections alive, as the real API does
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle's algorithm holds the body back on a reused
+        # connection until the client's delayed ACK arrives
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+        time.sleep(self.server.handshake_delay)  # Stands in for the TLS handshake a real connection would need
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path not in ('/v3/text', '/v3/strokes'):
+            self.send_error(404)
+            return
+        self.server.requests += 1
+        # Stands in for the time MathPix takes to read the answer
+        time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        if random.random() < self.server.error_rate:
+            status, response = 503, {'error': 'Service unavailable'}
+        else:
+            status, response = 200, next(self.server.responses)
+            if self.path == '/v3/text':
+                response = read_image(request, response)
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown out the benchmarks
+
+
+class MockCollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != COLLECTOR_PATH:
+            self.send_error(404)
+            return
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        if random.random() < self.server.error_rate:
+            self.send_error(503)
+            return
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                request = gzip.decompress(request)
+            events = [json.loads(line) for line in request.decode('utf-8').splitlines()]
+        except (OSError, EOFError, ValueError):
+            self.send_error(400)
+            return
+        batch_id = self.headers.get('X-Batch-Id')
+        with self.server.lock:
+            if batch_id is not None and batch_id in self.server.batches:
+                self.server.duplicates += 1  # Taken before, but the client never heard
+            else:
+                self.server.batches[batch_id] = events
+                self.server.events.extend(events)
+        if random.random() < self.server.lose_rate:
+            self.close_connection = True  # Hangs up without answering, so the client sends the batch again
+            return
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Room for a batch client to open all of its connections at once
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """
+        Serves from a daemon thread.
+        :return: The server, so that it can be started as it is created
+        """
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        """
+        A client hanging up before it has its answer, e.g. a request it cancelled, is nothing to report.
+        """
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockMathPixServer(StandInServer):
+
+    def __init__(self, address=('127.0.0.1', 0), handshake_delay=0.0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 responses=None):
+        """
+        :param address: The host and port to listen on - port 0 picks a free one
+        :param handshake_delay: Seconds each new connection is held up for before its first request is read
+        :param latency: Seconds each answer takes to be read
+        :param jitter: Up to this many more seconds, at random, added to each answer's latency
+        :param error_rate: The share of answers, between 0 and 1, that fail with a 503 (which MathPixAPI retries)
+        :param responses: A list of responses to give in turn, in MathPix's format (see RESPONSE) - default is RESPONSE
+        """
+        super().__init__(address, MockMathPixHandler)
+        self.handshake_delay = handshake_delay
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.responses = cycle(responses or [RESPONSE])
+        self.connections = 0  # Connections accepted so far, to check whether clients reuse them
+        self.requests = 0  # Answers read so far, to check whether clients cache them
+
+
+class MockCollectorServer(StandInServer):
+    """
+    Takes batches of events POSTed to COLLECTOR_PATH as (gzipped) JSON lines, and keeps them in batches and events.
+    A batch sent again with an X-Batch-Id it has already taken is counted in duplicates rather than kept twice.
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, error_rate=0.0, lose_rate=0.0):
+        """
+        :param error_rate: The share of batches, between 0 and 1, that fail with a 503 without being taken
+        :param lose_rate: The share of batches that are taken but never answered, as if the response were lost
+        """
+        super().__init__(address, MockCollectorHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lose_rate = lose_rate
+        self.batches = {}  # The events of each batch taken, by ID
+        self.events = []  # Every event taken, in the order the batches arrived
+        self.requests = 0  # Batches POSTed, including the ones that failed and duplicates
+        self.duplicates = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return self.url + COLLECTOR_PATH
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('--handshake-ms', type=float, default=0, help='Delay added to every new connection')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Delay added to every answer')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Up to this much more delay, at random')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of answers that fail with a 503')
+    parser.add_argument('--responses', help='A JSON file holding a list of responses to give in turn')
+    parser.add_argument('--collector', action='store_true', help='Stand in for the telemetry server instead')
+    arguments = parser.parse_args()
+    if arguments.collector:
+        server = MockCollectorServer(('127.0.0.1', arguments.port), arguments.latency_ms / 1000,
+                                     arguments.jitter_ms / 1000, arguments.error_rate)
+        print(f'Collecting events at {server.endpoint}')
+    else:
+        responses = None
+        if arguments.responses:
+            with open(arguments.responses) as responses_file:
+                responses = json.load(responses_file)
+        server = MockMathPixServer(('127.0.0.1', arguments.port), arguments.handshake_ms / 1000,
+                                   arguments.latency_ms / 1000, arguments.jitter_ms / 1000, arguments.error_rate,
+                                   responses)
+        print(f'Serving the MathPix API at {server.url}')
+    server.serve_forever()
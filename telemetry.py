@@ -0,0 +1,261 @@
+"""
+Uploads the events DataLogger logs to a collection server, so that sessions can be followed without fetching each
+tablet's {user_id}-data.bin. Events are batched, BATCH_ROWS at a time or whatever has been logged after BATCH_INTERVAL
+seconds, and each batch is written to an outbox as gzipped JSON lines before anything is sent. A thread of its own sends
+the outbox oldest batch first, retrying with jittered exponential backoff while the server can't be reached, so logging
+an event never waits for the network and a tablet can be offline for a whole lesson without losing any. Once the outbox
+is given a directory under App.user_data_dir, batches that haven't been sent when the app stops are sent the next time
+it starts.
+
+Each batch is POSTed to ENDPOINT with Content-Encoding: gzip and an X-Batch-Id header. A batch whose response was lost
+is sent again with the same ID, so the server can drop the copy. ENDPOINT is read when the uploader starts, in
+MainApp.on_start, and nothing is uploaded if it is None then. See mock_server.MockCollectorServer for a local stand-in.
+"""
+from collections import OrderedDict
+import gzip
+import json
+import os
+import random
+import requests
+import threading
+import time
+import uuid
+
+ENDPOINT = None  # The URL batches are POSTed to - None turns uploading off
+BATCH_ROWS = 200  # The most events sent in one batch
+BATCH_INTERVAL = 30.0  # The longest an event waits for its batch to fill before the batch is sent anyway, in seconds
+TIMEOUT = (3.05, 10)  # Seconds to connect and to wait for the server to answer, for each attempt
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}  # Any other error status drops the batch, which would never be taken
+BACKOFF = 1.0  # After n failures in a row, the next attempt waits a random time between 0 and BACKOFF * 2 ** n seconds
+MAX_BACKOFF = 300.0  # The longest wait between attempts, in seconds
+OUTBOX_SIZE = 5000  # Batches kept waiting to be sent before the oldest are dropped (about 10 kB each on disk)
+EXTENSION = '.jsonl.gz'
+
+
+class TelemetryUploader:
+    """
+    Batches events and sends them to endpoint from a thread of its own (see the module docstring). Safe to use from
+    any thread.
+    """
+
+    def __init__(self, endpoint=None, batch=BATCH_ROWS, interval=BATCH_INTERVAL, timeout=TIMEOUT,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF, outbox_size=OUTBOX_SIZE):
+        """
+        :param endpoint: The URL to POST batches to - default is ENDPOINT as it is when the uploader is started
+        :param batch: The most events in a batch
+        :param interval: The longest an event waits for its batch to fill, in seconds
+        :param outbox_size: How many batches to keep waiting to be sent
+        """
+        self.endpoint = endpoint
+        self.batch = batch
+        self.interval = interval
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.outbox_size = outbox_size
+        self.directory = None
+        self.sent = 0  # Batches the server took
+        self.failures = 0  # Attempts that have failed in a row, which sets the backoff
+        self.rejected = 0  # Batches dropped because the server refused them
+        self.evicted = 0  # Batches dropped because the outbox was full
+        self._pending = []  # Events not yet in a batch
+        self._pending_since = 0.0
+        self._outbox = OrderedDict()  # Batches waiting to be sent, oldest first: ID -> body, or None if on disk
+        self._retry_at = 0.0
+        self._flushing = False
+        self._closing = False
+        self._wake = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts sending batches, unless there is nowhere to send them, in which case every event is dropped.
+        :return: The uploader, so that it can be started as it is created
+        """
+        if self._thread is None:
+            self.endpoint = ENDPOINT if self.endpoint is None else self.endpoint
+            if self.endpoint is not None:
+                self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+                self._thread.start()
+        return self
+
+    def put(self, event: dict):
+        """
+        Adds an event to the next batch, if the uploader has been started. Only ever waits for the lock.
+        :param event: Anything json.dumps() can write, with repr() as the fallback for other values
+        """
+        if self._thread is None or self._closing:
+            return
+        with self._wake:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append(event)
+            if len(self._pending) >= self.batch:
+                self._wake.notify_all()
+
+    def use_directory(self, directory: str):
+        """
+        Keeps the outbox on disk, e.g. under App.user_data_dir, so that batches outlive the app, and starts the uploader.
+        Batches already in the directory, left by an earlier run, are sent first.
+        """
+        if self.start()._thread is None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        names = [name[:-len(EXTENSION)] for name in os.listdir(directory) if name.endswith(EXTENSION)]
+        with self._wake:
+            self.directory = directory
+            outbox = OrderedDict((name, None) for name in sorted(names))
+            for name, body in self._outbox.items():
+                outbox[name] = body if body is None else self._store(name, body)
+            self._outbox = OrderedDict(sorted(outbox.items()))
+            self._evict()
+            self._wake.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Batches every event put so far and sends the outbox, without waiting for the backoff. Returns once the outbox
+        is empty or an attempt has failed, which leaves the rest to be retried in the background as usual.
+        :param timeout: The most seconds to wait, or None to wait for the attempts (each bounded by TIMEOUT)
+        :return: True if everything was sent
+        """
+        if self._thread is None:
+            return not self._pending and not self._outbox
+        with self._wake:
+            self._flushing = True
+            self._retry_at = 0.0
+            self._wake.notify_all()
+            self._wake.wait_for(lambda: not self._flushing, timeout)
+            return not self._pending and not self._outbox
+
+    def close(self, timeout=5.0):
+        """
+        Batches whatever is left and makes one last attempt at sending the outbox. Batches that couldn't be sent stay
+        in the directory for the next run.
+        :param timeout: The most seconds to wait for the last attempt
+        """
+        if self._thread is None:
+            return
+        with self._wake:
+            self._closing = True
+            self._wake.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        session = requests.Session()
+        while True:
+            with self._wake:
+                self._wake.wait(self._wait())
+                if self._pending and (self._flushing or self._closing or len(self._pending) >= self.batch or
+                                      time.monotonic() >= self._pending_since + self.interval):
+                    self._seal()
+                if not self._outbox or time.monotonic() < self._retry_at:
+                    self._flushing = False  # Everything has been batched, and sent or an attempt failed
+                    self._wake.notify_all()
+                    if self._closing:
+                        break
+                    continue
+                name, body = next(iter(self._outbox.items()))
+            if body is None:
+                body = self._read(name)
+                if body is None:  # The file has gone, e.g. with the app's data
+                    with self._wake:
+                        self._remove(name)
+                    continue
+            sent = self._post(session, name, body)
+            with self._wake:
+                self._sent(name, sent)
+                self._wake.notify_all()
+        session.close()
+
+    def _wait(self):
+        """
+        :return: The seconds until the thread has something to do, or None if it has to be woken
+        """
+        if self._closing or self._flushing:
+            return 0
+        deadlines = []
+        if self._pending:
+            deadlines.append(self._pending_since + self.interval)
+        if self._outbox:
+            deadlines.append(self._retry_at)
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _seal(self):
+        """
+        Turns the pending events into batches and adds them to the outbox.
+        """
+        while self._pending:
+            events, self._pending = self._pending[:self.batch], self._pending[self.batch:]
+            lines = '\n'.join(json.dumps(event, separators=(',', ':'), ensure_ascii=False, default=repr)
+                              for event in events)
+            name = f'{time.time_ns():020d}-{uuid.uuid4().hex[:12]}'  # Sorts oldest first
+            body = gzip.compress(lines.encode('utf-8'), mtime=0)
+            self._outbox[name] = body if self.directory is None else self._store(name, body)
+        self._pending_since = time.monotonic()
+        self._evict()
+
+    def _store(self, name: str, body: bytes):
+        """
+        :return: None once body is on disk, or body if it couldn't be written, to keep it in memory instead
+        """
+        try:
+            temporary = os.path.join(self.directory, f'{name}.tmp')
+            with open(temporary, 'wb') as batch_file:
+                batch_file.write(body)
+            os.replace(temporary, os.path.join(self.directory, name + EXTENSION))
+        except OSError:
+            return body
+        return None
+
+    def _read(self, name: str):
+        try:
+            with open(os.path.join(self.directory, name + EXTENSION), 'rb') as batch_file:
+                return batch_file.read()
+        except OSError:
+            return None
+
+    def _post(self, session: requests.Session, name: str, body: bytes):
+        """
+        :return: True if the server took the batch, None if it refused it, or False if it should be sent again later
+        """
+        try:
+            r = session.post(self.endpoint, data=body, timeout=self.timeout,
+                             headers={'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip',
+                                      'X-Batch-Id': name})
+        except requests.RequestException:
+            return False  # Offline, or the server is down
+        if r.status_code < 300:
+            return True
+        return False if r.status_code in RETRY_STATUSES else None
+
+    def _sent(self, name: str, sent):
+        """
+        Removes the batch from the outbox unless it has to be sent again, in which case the outbox waits out the
+        backoff.
+        """
+        if sent is False:
+            self.failures += 1
+            self._retry_at = time.monotonic() + random.uniform(0, min(self.max_backoff,
+                                                                      self.backoff * 2 ** self.failures))
+            return
+        if sent:
+            self.sent += 1
+            self.failures = 0
+        else:
+            self.rejected += 1
+        self._remove(name)
+
+    def _remove(self, name: str):
+        if self._outbox.pop(name, b'') is None:
+            try:
+                os.remove(os.path.join(self.directory, name + EXTENSION))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while len(self._outbox) > self.outbox_size:
+            self._remove(next(iter(self._outbox)))
+            self.evicted += 1
+
+
+uploader = TelemetryUploader()
@@ -1,5 +1,5 @@
-from api import MathPixAPI
-from latex_parser import LatexParser
+from api import MathPixAPI, get_client
+from latex_parser import COORDINATES, LatexParser
 from kivy.app import App
 from kivy.animation import Animation
 from kivy.clock import Clock
@@ -13,12 +13,20 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.widget import Widget
 from kivy.utils import get_color_from_hex as hex_color
 from data import log
+from imaging import IMAGE_MARGIN, encode_png, export_scale, preprocess, stroke_box, strokes_payload
 from urllib.request import urlopen
 from kivy.uix.popup import Popup
 
 TEXT_SIZE = Window.height / 26
 CURSOR_BLUE = [0.01, 0.33, 0.64, 1]  # Has to be RGBA as the cursor needs to disappear
 CLEAR = [1, 1, 1, 0]
+SAVE_IMAGES = False  # Debugging: also write each handwritten answer to user_data_dir/image_N.png as it is sent
+SEND_STROKES = False  # Send handwritten answers to MathPix as strokes (see imaging.strokes_payload) instead of images
+PREPROCESS_IMAGES = True  # Crop, scale down and binarise handwritten answers before sending them (see get_image_data)
+# Seconds after the pen is lifted before the answer is read ahead of Compare - None turns it off. Read as each
+# ExpressionWriter is created, so set it before the app builds its screens, e.g. at the top of main.py
+SPECULATE_DELAY = 1.0
+MAX_SPECULATIONS = 3  # The most answers read ahead of Compare for each field on each question
 
 MODEL = {
     '00': '(7-5/2-1)=2',
@@ -123,29 +131,6 @@ MODEL = {
     '194': 'y=(x/4)'
  }
 
-COORDINATES = (
-    (1, 5, 2, 7),
-    (2, 11, 13, 22),
-    (3, 4, 5, 20),
-    (4, 13, 1, -5),
-    (-3, 22, 1, 2),
-    (3, -11, -2, 9),
-    (5, 133, 2, 58),
-    (-1, -4, 8, 23),
-    (4, -17, -2, 31),
-    (4, 11, -2, -13),
-    (2, -16, -3, 19),
-    (-8, -2, -4, -6),
-    (-4, -40, -6, -62),
-    (-1, -7, 19, 133),
-    (14, 5, 6, 5),
-    (77, -3, 41, -3),
-    (2, 5, 10, 9),
-    (3, -7, 27, 1),
-    (-1, 1, 7, 5),
-    (40, 10, 20, 5),
-)
-
 MODIFIER = {'8': '×', '9': '(', '0': ')', '=': '+'}
 
 COLORS = ['#29d88e', '#28d792', '#1ed1a0', '#14cbad', '#0bc5b5']
@@ -186,6 +171,11 @@ class ExpressionWriter(Widget):
         self.allow_drawing = False
         self.pen_color = [0, 0, 0, 1]
         self.pen_width = 2
+        self.strokes = []  # A (Line, width, pen) tuple for every line drawn, pen being False for the eraser
+        self.revision = 0  # Counts the lines drawn, so that a read ahead of an earlier drawing is known to be stale
+        self.speculation = None  # A (revision, Future) tuple for the last answer read ahead of Compare
+        self.speculations = 0  # Answers read ahead of Compare since the field was last reset
+        self._speculate = Clock.create_trigger(self.speculate, SPECULATE_DELAY or 0)
 
     def on_touch_down(self, touch):
         """
@@ -195,6 +185,8 @@ class ExpressionWriter(Widget):
         """
         if self.parent.ids['peek_widget'].visible:
             return
+        if self.parent.navigation.comparing:  # The answer is being graded, so it can't change until the result is in
+            return
         # Begin drawing only if the touch falls inside the widget and writing is set to True and the user hasn't already
         # submitted an answer
         if self.collide_point(touch.x, touch.y) and self.parent.writing and not self.parent.data_submitted:
@@ -204,6 +196,9 @@ class ExpressionWriter(Widget):
                 touch.ud['current_line'] = Line(
                     points=(touch.x, touch.y), width=self.pen_width
                 )
+            self.strokes.append((touch.ud['current_line'], self.pen_width, self.drawing))
+            self.revision += 1
+            self.cancel_speculation()
             if not self.drawing:
                 eraser = self.parent.ids['eraser_circle']
                 eraser.center = touch.pos  # Move the drawing circle to the location of the touch
@@ -225,15 +220,66 @@ class ExpressionWriter(Widget):
 
     def on_touch_up(self, touch):
         """
-        Sets allow_drawing to False
+        Sets allow_drawing to False. If a line was being drawn, restarts the countdown to reading the answer ahead of
+        Compare.
         :param touch: A Touch object - see https://kivy.org/doc/stable/guide/inputs.html#touch-events for more details
         """
+        if self.allow_drawing and SPECULATE_DELAY is not None:
+            self._speculate.cancel()
+            self._speculate()
         self.allow_drawing = False
         if not self.drawing:
             self.parent.ids['eraser_circle'].visible = False  # Hide the drawing circle
 
     def clear_canvas(self):
         self.canvas.after.clear()
+        self.strokes = []
+        self.revision += 1
+        self.cancel_speculation()
+        self.speculations = 0
+
+    def cancel_speculation(self):
+        """
+        Drops the answer read ahead of Compare, which is stale once the drawing changes. If it hasn't been sent yet it
+        never is, and one being sent only holds up the next read ahead, never a Compare (see MathPixAPI.submit_data).
+        """
+        self._speculate.cancel()
+        if self.speculation is not None:
+            self.speculation[1].cancel()
+            self.speculation = None
+
+    def speculate(self, *_):
+        """
+        Called SPECULATE_DELAY seconds after the pen was last lifted. Sends the answer to MathPix in the background so
+        that, if it hasn't changed by the time Compare is pressed, the result is already there or on its way (see
+        speculative_result). At most MAX_SPECULATIONS answers are sent this way for each field on each question.
+        """
+        field = self.parent
+        if field.data_submitted or not field.writing or not self.strokes or self.speculations >= MAX_SPECULATIONS or \
+                field.navigation.comparing:
+            return
+        data = field.retrieve_data()
+        future = get_client().submit_data({field.id_number: data}, speculative=True).get(field.id_number)
+        if future is not None:
+            self.speculation = (self.revision, future)
+            self.speculations += 1
+
+    def speculative_result(self):
+        """
+        Cancels any read ahead still waiting to start, as the answer is about to be sent anyway. That includes one
+        queued behind another field's read ahead, which is sent with the rest of the submission instead.
+        :return: The Future of the answer read ahead of Compare, if it is of the drawing as it is now, is being or has
+                 been sent, and hasn't failed
+        """
+        self._speculate.cancel()
+        if self.speculation is None or self.speculation[0] != self.revision:
+            return None
+        future = self.speculation[1]
+        if get_client().withdraw(future):  # Never one that has been sent, which would be paid for twice
+            return None
+        if future.done() and (future.cancelled() or future.exception() or future.result().response is None):
+            return None
+        return future
 
     def switch_draw_mode(self, use_pen=False):
         """
@@ -254,14 +300,32 @@ class ExpressionWriter(Widget):
 
     def get_image_data(self):
         """
-        The function first saves the ExpressionWriter.canvas as a PNG file to the user_data_directory (automatically
-        determined depending on the device the user is running the app on). Then this images is sent to the MathPix API
-        which then return data on the handwritten answer (see api.py for more details). The api call updates self.data
-        which in turn calls self._on_data().
+        The function renders the ExpressionWriter.canvas into a texture and encodes its pixels as a PNG in memory (see
+        imaging.py), so nothing is written to the device's storage unless SAVE_IMAGES is set. Unless PREPROCESS_IMAGES
+        is turned off, the canvas is first cropped to the strokes, rendered no more than imaging.IMAGE_HEIGHT pixels tall
+        (the Fbo does the scaling) and reduced to a 1 bit black and white image. The PNG is returned as a data URI, ready to
+        be sent to the MathPix API which then returns data on the handwritten answer (see api.py for more details).
+        """
+        box = stroke_box([(line.points, width, pen) for line, width, pen in self.strokes], self.x, self.top,
+                         IMAGE_MARGIN)
+        if PREPROCESS_IMAGES and box is not None:
+            scale = export_scale(box)
+            texture = self.export_as_image(scale=scale).texture
+            png = preprocess(texture.pixels, *texture.size, box, scale)
+        else:
+            texture = self.export_as_image().texture
+            png = encode_png(texture.pixels, *texture.size)
+        if SAVE_IMAGES:
+            with open(f'{App.get_running_app().user_data_dir}/image_{self.parent.id_number}.png', 'wb') as image_file:
+                image_file.write(png)
+        return MathPixAPI.format_png(png)
+
+    def get_strokes_data(self):
+        """
+        The lines drawn on the canvas in MathPix's strokes format (see imaging.strokes_payload), with whatever the
+        eraser rubbed out left out.
         """
-        file_name = f'{App.get_running_app().user_data_dir}/image_{self.parent.id_number}.png'
-        self.export_to_png(file_name)
-        return MathPixAPI().format_data(file_name)
+        return strokes_payload([(line.points, width, pen) for line, width, pen in self.strokes], self.x, self.top)
 
 
 class ResponseField(FloatLayout):
@@ -364,6 +428,8 @@ class ResponseField(FloatLayout):
         details)
         """
         if self.writing:  # True if ResponseField is in 'handwriting mode'
+            if SEND_STROKES:
+                return self.ids['expression_writer'].get_strokes_data()
             return self.ids['expression_writer'].get_image_data()
         return self.ids['keyboard_writer'].get_text()
 
@@ -416,10 +482,15 @@ class ResponseField(FloatLayout):
 class BaseNavigationPane(FloatLayout):
     solutions = DictProperty()
     score = NumericProperty()  # Bindings happen in kv file
+    comparing = BooleanProperty(False)  # True while answers are with MathPix
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.bind(solutions=self._on_solutions)
+        self._pending = set()  # The id_number of each field still waiting on MathPix
+        self._requests = {}  # The latency, attempts and status of each request in the current submission
+        self._speculated = set()  # The id_number of each field in the current submission that was read ahead
+        self._connection_failed = False
 
     def reset(self):
         self.solutions = {}
@@ -515,26 +586,83 @@ class BaseNavigationPane(FloatLayout):
             yield field
 
     def compare(self):
-        payload = {}
-        for field in self.fields():
-            if not field.data_submitted:  # Check if data has already been submitted - prevents wasteful resubmissions
-                payload.update({field.id_number: field.retrieve_data()})
-
-        user_answers = MathPixAPI().post_data(payload)
-        print(user_answers)
-        if user_answers is None:  # A network error has occured - open the connection popup
-            self.parent.parent.parent.connection_popup.open()
+        """
+        Submits every answer that hasn't been submitted yet. Typed answers are checked straight away; handwritten ones
+        are sent to MathPix in the background and each is checked as soon as its own result arrives (see _on_result).
+        Handwritten answers that were read ahead of Compare and haven't changed since are not sent again (see
+        ExpressionWriter.speculate). Presses while a submission is in flight are ignored.
+        """
+        if self.comparing:
             return
+        payload, speculated = {}, {}
         for field in self.fields():
-            data = user_answers.get(field.id_number, None)
-            if data is not None:
-                if type(data) == dict:
-                    confidence = data.get('confidence', 1)
-                    text = data.get('latex_styled', None)
-                    field.check_answer(text=text, confidence=confidence)
+            if not field.data_submitted:  # Check if data has already been submitted - prevents wasteful resubmissions
+                future = field.ids['expression_writer'].speculative_result() if field.writing else None
+                if future is None:
+                    payload.update({field.id_number: field.retrieve_data()})
                 else:
-                    field.check_answer(text=data)
+                    speculated[field.id_number] = future  # Already read (or being read) ahead of Compare
+        futures = {**speculated, **get_client().submit_data(payload)}
+        fields = {field.id_number: field for field in self.fields()}
+        for id_number, data in payload.items():
+            if id_number not in futures and data is not None:
+                fields[id_number].check_answer(text=data)
+        if not futures:
+            log.save_data()
+            return
+        self.comparing = True
+        self._pending = set(futures)
+        self._requests = {}
+        self._speculated = set(speculated)
+        self._connection_failed = False
+        for id_number, future in futures.items():
+            future.add_done_callback(
+                lambda future, field=fields[id_number]: Clock.schedule_once(lambda dt: self._on_result(field, future)))
+
+    def _on_result(self, field, future):
+        """
+        Called on the main thread when MathPix has answered for one field. Checks that field's answer, then once every
+        field is back logs how long each request took, how many attempts it needed (none if the response was cached)
+        and the running cache hit and miss counts, saves the log, and opens the connection popup if any of the requests
+        failed. Fields whose request failed stay unsubmitted, so pressing Compare again only resends those.
+        :param field: The ResponseField the result is for
+        :param future: The Future returned by MathPixAPI.submit_data
+        """
+        request = None if future.cancelled() or future.exception() else future.result()
+        data = None if request is None else request.response
+        if request is not None:
+            self._requests[str(field.id_number)] = {'latency': round(request.latency, 3), 'attempts': request.attempts,
+                                                    'status': request.status,
+                                                    'speculative': field.id_number in self._speculated}
+        if data is None:  # A network error has occured
+            self._connection_failed = True
+        elif type(data) == dict:
+            field.check_answer(text=data.get('latex_styled', None), confidence=data.get('confidence', 1))
+        else:
+            field.check_answer(text=data)
+        self._pending.discard(field.id_number)
+        if self._pending:
+            return
+        self.comparing = False
+
+        @log.TimeStamp('ocr')
+        def log_requests(requests: dict):
+            cache = get_client().cache
+            return dict(requests, cache={'hits': cache.hits, 'misses': cache.misses})
+        log_requests(self._requests)
         log.save_data()
+        if self._connection_failed:
+            self.parent.parent.parent.connection_popup.open()
+
+    def on_comparing(self, _, comparing):
+        """
+        Callback for when self.comparing is changed. Shows the Compare and Confirm buttons as busy while a submission
+        is in flight (see RoundedButton.on_busy).
+        """
+        for button_id, text in (('compare', 'Compare'), ('confirm', 'Confirm')):
+            button = self.ids[button_id]
+            button.text = 'Checking...' if comparing else text
+            button.busy = comparing
 
     @counter
     @log.TimeStamp('peek')
@@ -580,8 +708,6 @@ class NavigationPane(BaseNavigationPane):
         """
         screen = self.parent.parent
         screen.question_number += 1
-        # if log.online:
-        #     log.online_data_packet.update({str(screen.question_number): {}})  # Add a new question key a to data logger
         log.question_number = screen.question_number
         try:
             x1, y1, x2, y2 = COORDINATES[screen.question_number]
@@ -1072,18 +1198,22 @@ class Cursor(Widget):
 
 
 class RoundedButton(ButtonBehavior, Label):
+    busy = BooleanProperty(False)  # True while the button's action is in progress, e.g. Compare waiting on MathPix
 
     def on_disabled(self, *args):
         """
-        Callback for when self.disabled is changed. If True then disabled reduce saturation and value by 11%, otherwise
-        increase saturation and value by 11%.
+        Callback for when self.disabled or self.busy is changed. If either is True then reduce saturation and value by
+        11%, otherwise increase saturation and value by 11%.
         :param args: args inherited from callback - not needed
         """
-        if self.disabled:
+        if self.disabled or self.busy:
             self.color = [0.75, 0.75, 0.75, 1]
         else:
             self.color = [1, 1, 1, 1]
 
+    def on_busy(self, *args):
+        self.on_disabled()
+
 class IDInput(TextInput):
 
     def insert_text(self, substring, from_undo=False):